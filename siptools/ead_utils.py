@@ -1,11 +1,14 @@
 """"Utility functions for EAD3 structmap creation."""
 
+from bisect import bisect_right
+
 import lxml.etree as ET
 import mets
 from siptools.utils import (add_file_div,
                             add_file_to_filesec,
                             create_filegrp,
-                            get_md_references)
+                            get_md_references,
+                            sorted_md_ids)
 from siptools.xml.mets import NAMESPACES
 
 
@@ -22,10 +25,15 @@ def compile_ead3_structmap(dmdsec_loc,
                            object_refs,
                            file_properties,
                            supplementary_files,
-                           supplementary_types):
+                           supplementary_types,
+                           deterministic_ids=False,
+                           objid=None):
     """The function creates a METS structMap and fileSec section
     based on EAD3 metadata structure and the files listed in the
     EAD3 metadata.
+
+    File identifiers are derived from the file paths and objid if
+    deterministic_ids is True, see siptools.utils.file_identifier().
     """
     file_ids = {}
     filegrp = mets.filegrp()
@@ -41,7 +49,9 @@ def compile_ead3_structmap(dmdsec_loc,
         object_refs=object_refs,
         file_properties=file_properties,
         supplementary_files=supplementary_files,
-        supplementary_types=supplementary_types)
+        supplementary_types=supplementary_types,
+        deterministic_ids=deterministic_ids,
+        objid=objid)
 
     for supplementary_type in supplementary_types:
         (s_filegrp, file_ids) = create_filegrp(
@@ -50,7 +60,9 @@ def compile_ead3_structmap(dmdsec_loc,
             all_amd_refs=all_amd_refs,
             object_refs=object_refs,
             file_properties=file_properties,
-            supplementary_type=supplementary_type)
+            supplementary_type=supplementary_type,
+            deterministic_ids=deterministic_ids,
+            objid=objid)
         filesec_child_elems.append(s_filegrp)
 
     filesec_element = mets.filesec(child_elements=filesec_child_elems)
@@ -59,6 +71,40 @@ def compile_ead3_structmap(dmdsec_loc,
     return structmap, filesec, file_ids
 
 
+# pylint: disable=too-many-arguments
+def create_ead3_structmap(dmdsec_loc,
+                          workspace,
+                          all_amd_refs,
+                          all_dmd_refs,
+                          object_refs,
+                          file_properties,
+                          file_ids):
+    """Create a METS structMap based on EAD3 metadata structure for an
+    already created fileSec. The fptr elements refer to the file
+    identifiers of the given fileSec instead of new file elements.
+
+    :param dmdsec_loc: EAD3 descriptive metadata file
+    :param workspace: Workspace path
+    :param all_amd_refs: XML element tree of administrative metadata
+        references
+    :param all_dmd_refs: XML element tree of descriptive metadata
+        references
+    :param object_refs: Object references.
+    :param file_properties: Dictionary collection of file properties.
+    :param file_ids: Dict of file paths and identifiers in the fileSec
+    :returns: Struct map XML element tree.
+    """
+    return _create_structmap(filegrp=None,
+                             all_amd_refs=all_amd_refs,
+                             all_dmd_refs=all_dmd_refs,
+                             dmdsec_loc=dmdsec_loc,
+                             structmap_type='EAD3-logical',
+                             workspace=workspace,
+                             object_refs=object_refs,
+                             file_properties=file_properties,
+                             file_ids=file_ids)
+
+
 # pylint: disable=too-many-arguments
 def _create_structmap(filegrp,
                       all_amd_refs,
@@ -69,7 +115,10 @@ def _create_structmap(filegrp,
                       object_refs,
                       file_properties,
                       supplementary_files=None,
-                      supplementary_types=None):
+                      supplementary_types=None,
+                      file_ids=None,
+                      deterministic_ids=False,
+                      objid=None):
     """Create structmap based on ead3 descriptive metadata structure.
 
     :param filegrp: fileGrp element
@@ -79,11 +128,16 @@ def _create_structmap(filegrp,
         references
     :param dmdsec_loc: EAD3 descriptive metadata file
     :param structmap_type: TYPE attribute of structMap element
-    :param workspace: Workspace path, required by _ead3_c_div()
+    :param workspace: Workspace path
     :param object_refs: Object references.
     :param file_properties: Dictionary collection of file properties.
     :param supplementary_files: Supplementary files.
     :param supplementary_types: Supplementary types.
+    :param file_ids: Dict of file paths and identifiers of an existing
+        fileSec. If given, no file elements are added to filegrp.
+    :param deterministic_ids: True to derive new file identifiers from
+        the file paths
+    :param objid: Object identifier for deterministic file identifiers
     :returns: Struct map XML element tree.
     """
     if supplementary_files is None:
@@ -94,33 +148,31 @@ def _create_structmap(filegrp,
     structmap = mets.structmap(type_attr=structmap_type)
     container_div = mets.div(type_attr='logical')
 
-    root = ET.parse(dmdsec_loc).getroot()
-
-    try:
-        label = root.xpath(("//ead3:archdesc/@otherlevel | "
-                            "//ead3:archdesc/@level"),
-                           namespaces=NAMESPACES)[0]
-    except IndexError:
-        label = 'archdesc'
-
     amdids = get_md_references(all_amd_refs, directory='.')
     dmdids = get_md_references(all_dmd_refs, directory='.')
 
-    div_ead = mets.div(type_attr='archdesc', label=label, dmdid=dmdids,
-                       admid=amdids)
-
-    if root.xpath("//ead3:archdesc/ead3:dsc", namespaces=NAMESPACES):
-        for elem in root.xpath("//ead3:dsc/*", namespaces=NAMESPACES):
-            if ET.QName(elem.tag).localname in ALLOWED_C_SUBS:
-                _ead3_c_div(parent=elem,
-                            div=div_ead,
-                            filegrp=filegrp,
-                            all_amd_refs=all_amd_refs,
-                            object_refs=object_refs,
-                            supplementary_files=supplementary_files,
-                            supplementary_types=supplementary_types,
-                            file_properties=file_properties,
-                            workspace=workspace)
+    href_index = build_href_index(file_properties)
+
+    # Keyword arguments for add_fptrs_div_ead()
+    fptr_kwargs = {'filegrp': filegrp,
+                   'all_amd_refs': all_amd_refs,
+                   'object_refs': object_refs,
+                   'file_properties': file_properties,
+                   'file_ids': file_ids,
+                   'deterministic_ids': deterministic_ids,
+                   'objid': objid,
+                   'href_index': href_index}
+    if file_ids is None:
+        # Daos referring to the same file share one file element
+        fptr_kwargs['added_file_ids'] = {}
+
+    (label, c_divs) = _parse_ead3(dmdsec_loc, fptr_kwargs)
+
+    div_ead = mets.div(type_attr='archdesc', label=label,
+                       dmdid=sorted_md_ids(dmdids),
+                       admid=sorted_md_ids(amdids))
+    for c_div in c_divs:
+        div_ead.append(c_div)
 
     container_div.append(div_ead)
     structmap.append(container_div)
@@ -129,51 +181,124 @@ def _create_structmap(filegrp,
     return ET.ElementTree(mets_element)
 
 
-def _ead3_c_div(parent,
-                div,
-                filegrp,
-                all_amd_refs,
-                object_refs,
-                supplementary_files,
-                supplementary_types,
-                file_properties,
-                workspace):
-    """Create div elements based on ead3 c elements. Fptr elements are
-    created based on ead dao elements. The Ead3 elements tags are put
+def _parse_ead3(dmdsec_loc, fptr_kwargs):
+    """Parse the archdesc label and create div elements based on the
+    ead3 c elements of an EAD3 file. The Ead3 elements tags are put
     into @type and the @level or @otherlevel attributes from ead3 will
     be put into @label.
 
-    Daoset elements within the ead3 c element will be looped over and
-    create their own divs if they exist, containing the dao elements.
+    The file is parsed incrementally. A div is created when a c element
+    starts, and the fptrs and daoset divs of its did element are added
+    when the c element ends. Processed elements are removed from the
+    parsed tree, so that only the open elements and the did elements of
+    the open c elements are kept in memory. The memory use depends on
+    the nesting depth of the c elements instead of the size of the
+    file.
 
-    :param parent: Element to follow in EAD3
-    :param div: Div element in structmap
-    :param filegrp: fileGrp element
-    :param all_amd_refs: XML element tree of administrative metadata
-        references.
-    :param object_refs: Object references.
-    :param supplementary_files: Supplementary files.
-    :param supplementary_types: Supplementary types.
-    :param file_properties: Dictionary collection of file properties.
-    :param workspace: Workspace path, required by add_fptrs_div_ead()
+    :param dmdsec_loc: EAD3 descriptive metadata file
+    :param fptr_kwargs: Keyword arguments for add_fptrs_div_ead()
+    :returns: A tuple of the archdesc label and a list of the divs of
+              the top level c elements
     """
+    label = None
+    c_divs = []
+    has_dsc = False
+
+    # Kinds of the open elements and the divs of the open c elements
+    open_kinds = []
+    open_divs = []
+
+    for event, elem in ET.iterparse(dmdsec_loc, events=('start', 'end'),
+                                    huge_tree=True):
+        if event == 'start':
+            parent_kind = open_kinds[-1] if open_kinds else None
+            kind = _ead3_element_kind(elem, parent_kind)
+            open_kinds.append(kind)
+
+            if kind == 'archdesc' and label is None:
+                label = _parse_archdesc_label(elem)
+            elif kind == 'dsc' and parent_kind == 'archdesc':
+                has_dsc = True
+            elif kind == 'c':
+                open_divs.append(
+                    mets.div(type_attr=ET.QName(elem.tag).localname,
+                             label=_parse_label(elem)))
+            continue
+
+        kind = open_kinds.pop()
+        if kind in ('did', 'keep'):
+            # Kept until the c element ends
+            continue
+
+        if kind == 'c':
+            c_div = open_divs.pop()
+            _add_did_fptrs(elem, c_div, fptr_kwargs)
+            if open_kinds[-1] == 'c':
+                open_divs[-1].append(c_div)
+            else:
+                c_divs.append(c_div)
+
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            parent.remove(elem)
+
+    if label is None:
+        label = 'archdesc'
+    if not has_dsc:
+        c_divs = []
+
+    return label, c_divs
+
 
-    c_div = mets.div(type_attr=(ET.QName(parent.tag).localname),
-                     label=_parse_label(parent))
+def _ead3_element_kind(elem, parent_kind):
+    """Return the kind of an EAD3 element for _parse_ead3().
 
-    # Create child divs based on the child c elements
-    for elem in parent.findall("./*"):
+    :param elem: Started element
+    :param parent_kind: Kind of the parent element, None for the root
+    :returns: 'archdesc', 'dsc', 'c' for the c elements of dsc, 'did'
+              for the did elements of the c elements, 'keep' for the
+              descendants of those, or None for the other elements
+    """
+    if parent_kind in ('did', 'keep'):
+        return 'keep'
+    if elem.tag == '{%s}archdesc' % NAMESPACES['ead3']:
+        return 'archdesc'
+    if elem.tag == '{%s}dsc' % NAMESPACES['ead3']:
+        return 'dsc'
+    if parent_kind in ('dsc', 'c'):
         if ET.QName(elem.tag).localname in ALLOWED_C_SUBS:
-            _ead3_c_div(parent=elem,
-                        div=c_div,
-                        filegrp=filegrp,
-                        all_amd_refs=all_amd_refs,
-                        object_refs=object_refs,
-                        supplementary_files=supplementary_files,
-                        supplementary_types=supplementary_types,
-                        file_properties=file_properties,
-                        workspace=workspace)
+            return 'c'
+        if parent_kind == 'c' and \
+                elem.tag == '{%s}did' % NAMESPACES['ead3']:
+            return 'did'
+    return None
+
+
+def _parse_archdesc_label(elem):
+    """Return the @otherlevel or @level attribute of archdesc element,
+    whichever comes first.
+
+    :param elem: archdesc element
+    :returns: Label or None
+    """
+    for name, value in elem.attrib.items():
+        if name in ('otherlevel', 'level'):
+            return value
+    return None
+
+
+def _add_did_fptrs(parent, c_div, fptr_kwargs):
+    """Add the fptrs of an ead3 c element to its div. Fptr elements
+    are created based on ead dao elements.
 
+    Daoset elements within the ead3 c element will be looped over and
+    create their own divs if they exist, containing the dao elements.
+
+    :param parent: c element
+    :param c_div: Div element of the c element
+    :param fptr_kwargs: Keyword arguments for add_fptrs_div_ead()
+    """
     # Create divs for daoset elements, appending the dao elements and file
     # references to the daoset elements
     for elem in parent.xpath("./ead3:did/*", namespaces=NAMESPACES):
@@ -181,26 +306,15 @@ def _ead3_c_div(parent,
             daoset_div = mets.div(type_attr='daoset', label=_parse_label(elem))
 
             daoset_hrefs = collect_dao_hrefs(elem)
-            daoset_div = add_fptrs_div_ead(
-                c_div=daoset_div,
-                hrefs=daoset_hrefs,
-                filegrp=filegrp,
-                all_amd_refs=all_amd_refs,
-                object_refs=object_refs,
-                file_properties=file_properties)
+            daoset_div = add_fptrs_div_ead(c_div=daoset_div,
+                                           hrefs=daoset_hrefs,
+                                           **fptr_kwargs)
             c_div.append(daoset_div)
 
     # Collect dao elements and file references as fptr elements if they
     # exist directly under the ead3 c element
     c_hrefs = collect_dao_hrefs(parent)
-    c_div = add_fptrs_div_ead(c_div=c_div,
-                              hrefs=c_hrefs,
-                              filegrp=filegrp,
-                              all_amd_refs=all_amd_refs,
-                              object_refs=object_refs,
-                              file_properties=file_properties)
-
-    div.append(c_div)
+    add_fptrs_div_ead(c_div=c_div, hrefs=c_hrefs, **fptr_kwargs)
 
 
 def _parse_label(elem):
@@ -220,12 +334,18 @@ def _parse_label(elem):
     return label
 
 
+# pylint: disable=too-many-arguments
 def add_fptrs_div_ead(c_div,
                       hrefs,
                       filegrp,
                       all_amd_refs,
                       object_refs,
-                      file_properties):
+                      file_properties,
+                      file_ids=None,
+                      deterministic_ids=False,
+                      objid=None,
+                      href_index=None,
+                      added_file_ids=None):
     """Creates fptr elements for hrefs. If the files contain
     file properties, like ordering data, the data is written to the
     parent div element.
@@ -240,25 +360,53 @@ def add_fptrs_div_ead(c_div,
         metadata references.
     :param object_refs: Object references.
     :param file_properties: Dictionary collection of file properties.
+    :param file_ids: Dict of file paths and identifiers of an existing
+        fileSec. If given, the existing identifiers are used instead of
+        adding new file elements to filegrp.
+    :param deterministic_ids: True to derive new file identifiers from
+        the file paths
+    :param objid: Object identifier for deterministic file identifiers
+    :param href_index: Index for resolving hrefs from
+        build_href_index(). Built from file_properties if not given.
+    :param added_file_ids: Dict of file paths and identifiers of the
+        file elements already added to filegrp. Updated with the added
+        file elements, so that each file is added only once.
     :returns: The modified c_div element
     """
+    if href_index is None:
+        href_index = build_href_index(file_properties)
+    if added_file_ids is None:
+        added_file_ids = {}
 
-    for href, label in hrefs:
-        amd_file = None
-        for path in file_properties:
-            if href in path:
-                amd_file = path
-                break
+    for (index, (href, label)) in enumerate(hrefs):
+        amd_file = resolve_href(href, file_properties, href_index)
         # href strings that do not match any file don't add anything new
         if not amd_file:
+            skipped = [skipped_href for (skipped_href, _) in hrefs[index + 1:]]
+            print("EAD3 dao href '%s' does not match any file. No file "
+                  "pointer created for it%s." % (
+                      href, " or the following daos: %s" % ", ".join(
+                          skipped) if skipped else ""))
             break
 
         properties = file_properties[amd_file]
-        fileid = add_file_to_filesec(all_amd_refs=all_amd_refs,
-                                     object_refs=object_refs,
-                                     path=amd_file,
-                                     filegrp=filegrp,
-                                     properties=properties)
+        if file_ids is None and amd_file in added_file_ids:
+            fileid = added_file_ids[amd_file]
+        elif file_ids is None:
+            fileid = add_file_to_filesec(all_amd_refs=all_amd_refs,
+                                         object_refs=object_refs,
+                                         path=amd_file,
+                                         filegrp=filegrp,
+                                         properties=properties,
+                                         deterministic_ids=deterministic_ids,
+                                         objid=objid)
+            added_file_ids[amd_file] = fileid
+        elif properties and properties.get('supplementary'):
+            # Supplementary files are linked only from the
+            # supplementary structMap
+            fileid = None
+        else:
+            fileid = file_ids.get(amd_file)
         if fileid:
             fptr = mets.fptr(fileid=fileid)
             if any((properties and 'order' in properties, label)):
@@ -274,6 +422,85 @@ def add_fptrs_div_ead(c_div,
     return c_div
 
 
+def build_href_index(file_properties):
+    """Build an index for resolving EAD3 dao hrefs to file paths.
+
+    The index maps each end of a file path that consists of whole path
+    segments, e.g. 'b/c.txt' and 'c.txt' for 'a/b/c.txt', to the file
+    paths ending with it. For the hrefs that are only a part of a path,
+    the index also holds the file paths joined to one string with the
+    start offsets of the paths, so that the paths are searched without
+    a loop over them.
+
+    :param file_properties: Dictionary collection of file properties
+    :returns: A dict with keys "ends" for a dict of path ends and lists
+              of file paths in the order of file_properties, "paths" for
+              the list of file paths, "joined" for the paths joined with
+              newlines and "starts" for the offsets of the paths in it
+    """
+    ends = {}
+    paths = list(file_properties)
+    starts = []
+    offset = 0
+    for path in paths:
+        segments = path.split('/')
+        for start in range(1, len(segments)):
+            ends.setdefault('/'.join(segments[start:]), []).append(path)
+        starts.append(offset)
+        offset += len(path) + 1
+    return {'ends': ends, 'paths': paths, 'joined': '\n'.join(paths),
+            'starts': starts}
+
+
+def _find_paths(href, href_index):
+    """Iterate the file paths containing the href, in the order of the
+    file properties.
+
+    :param href: href of a dao element
+    :param href_index: Index from build_href_index()
+    :returns: Generator of file paths
+    """
+    if not href or '\n' in href:
+        return
+    (joined, starts) = (href_index['joined'], href_index['starts'])
+    position = joined.find(href)
+    while position != -1:
+        index = bisect_right(starts, position) - 1
+        yield href_index['paths'][index]
+        if index + 1 == len(starts):
+            return
+        position = joined.find(href, starts[index + 1])
+
+
+def resolve_href(href, file_properties, href_index):
+    """Return the path of the file that an EAD3 dao href refers to.
+
+    A file path equal to the href is preferred. Otherwise the href is
+    looked up from the path ends in the index, and as the last resort
+    the file paths containing the href are searched. If the href matches
+    several files, the first one in file_properties is used and the
+    matching files are reported.
+
+    :param href: href of a dao element
+    :param file_properties: Dictionary collection of file properties
+    :param href_index: Index from build_href_index()
+    :returns: File path, or None if no file matches the href
+    """
+    if href in file_properties:
+        return href
+
+    matches = href_index['ends'].get(href)
+    if matches is None:
+        matches = list(_find_paths(href, href_index))
+    if not matches:
+        return None
+
+    if len(matches) > 1:
+        print("EAD3 dao href '%s' matches several files: %s. Using file "
+              "'%s'." % (href, ", ".join(matches), matches[0]))
+    return matches[0]
+
+
 def collect_dao_hrefs(parent):
     """Returns the href and label attribute values from ead3 dao elements.
 
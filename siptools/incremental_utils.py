@@ -0,0 +1,385 @@
+"""Utility functions for updating an existing fileSec and structMap
+with new and changed files.
+"""
+
+import os
+from bisect import bisect_left
+
+import lxml.etree as ET
+import mets
+from siptools.utils import (add_file_div,
+                            add_file_to_filesec,
+                            decode_path,
+                            get_file_properties,
+                            get_md_references,
+                            get_objectlist,
+                            read_all_amd_references,
+                            read_md_references,
+                            sorted_md_ids)
+from siptools.xml.mets import NAMESPACES
+
+FPTR = '{%s}fptr' % NAMESPACES['mets']
+XLINK_HREF = '{%s}href' % NAMESPACES['xlink']
+
+# Remove the indentation of the existing files, so that the updated
+# files are indented the same way as the ones compiled from scratch
+PARSER = ET.XMLParser(remove_blank_text=True)
+
+
+# pylint: disable=too-many-locals
+def update_structmap(workspace, structmap_type=None, root_type='directory',
+                     deterministic_ids=False, objid=None):
+    """Update the fileSec and structMap of a workspace with the files
+    that have been added or changed after they were created.
+
+    The existing filesec.xml and structmap.xml are read into an index
+    of file paths to file elements and directory paths to div elements.
+    A file is changed if its administrative metadata references differ
+    from the ADMID attributes of its file element. Only the new and
+    changed files are added to the index, and the file properties are
+    read only for them. The other files keep their file identifiers.
+
+    Only directory based structMaps without supplementary files are
+    updated. Removed files are not supported either.
+
+    :param workspace: Workspace path
+    :param structmap_type: TYPE attribute of the structMap element
+    :param root_type: TYPE attribute of the root div element
+    :param deterministic_ids: True to derive the identifiers of new
+                              files from their paths
+    :param objid: Object identifier for deterministic file identifiers
+    :returns: A tuple of the fileSec and structMap element trees, or
+              None if the existing files can not be updated
+    """
+    filesec_index = read_filesec_index(
+        os.path.join(workspace, 'filesec.xml'))
+    if filesec_index is None:
+        return None
+    (filesec, filegrp, file_index) = filesec_index
+    file_paths = {file_elem.get('ID'): path
+                  for path, file_elem in file_index.items()}
+
+    structmap_index = read_structmap_index(
+        os.path.join(workspace, 'structmap.xml'),
+        structmap_type=structmap_type,
+        root_type=root_type)
+    if structmap_index is None:
+        return None
+    (structmap, dir_index, fptr_index) = structmap_index
+
+    object_refs = read_md_references(workspace,
+                                     'import-object-md-references.jsonl')
+    filelist = get_objectlist(object_refs)
+    all_amd_refs = read_all_amd_references(workspace)
+    all_dmd_refs = read_md_references(
+        workspace, 'import-description-md-references.jsonl')
+
+    if not set(file_index).issubset(filelist):
+        return None
+
+    updated_files = []
+    for path in filelist:
+        file_elem = file_index.get(path)
+        if file_elem is not None and not _file_changed(file_elem, path,
+                                                       all_amd_refs):
+            continue
+        properties = get_file_properties(path=path,
+                                         all_amd_refs=all_amd_refs,
+                                         workspace=workspace)
+        if properties and properties.get('supplementary'):
+            return None
+        updated_files.append((path, properties))
+
+    sorted_paths = sorted(file_index)
+    for path, properties in updated_files:
+        new_filegrp = mets.filegrp()
+        fileid = add_file_to_filesec(all_amd_refs=all_amd_refs,
+                                     object_refs=object_refs,
+                                     path=path,
+                                     filegrp=new_filegrp,
+                                     properties=properties,
+                                     deterministic_ids=deterministic_ids,
+                                     objid=objid)
+        file_elem = new_filegrp[0]
+
+        if path in file_index:
+            # Keep the identifier of a changed file and remove its
+            # old structMap entry
+            fileid = file_index[path].get('ID')
+            file_elem.set('ID', fileid)
+            filegrp.replace(file_index[path], file_elem)
+            _remove_fptr(fptr_index.pop(fileid))
+        else:
+            index = bisect_left(sorted_paths, path)
+            filegrp.insert(index, file_elem)
+            sorted_paths.insert(index, path)
+        file_index[path] = file_elem
+        file_paths[fileid] = path
+
+        fptr_index[fileid] = _insert_file(
+            path=path,
+            fileid=fileid,
+            properties=properties,
+            dir_index=dir_index,
+            file_paths=file_paths,
+            structmap_type=structmap_type,
+            all_amd_refs=all_amd_refs,
+            all_dmd_refs=all_dmd_refs)
+
+    # Directories may have got new metadata references, e.g. events,
+    # since the structMap was created
+    for div_path, div_elem in dir_index.items():
+        _update_div_references(div_elem=div_elem,
+                               directory=div_path or '.',
+                               all_amd_refs=all_amd_refs,
+                               all_dmd_refs=all_dmd_refs)
+
+    ET.cleanup_namespaces(filesec)
+    ET.cleanup_namespaces(structmap)
+
+    print("compile_structmap updated %d files in the existing fileSec and "
+          "structMap" % len(updated_files))
+
+    return filesec, structmap
+
+
+def read_filesec_index(filesec_file):
+    """Read an existing fileSec into an index of file paths and file
+    elements.
+
+    :param filesec_file: Path to the fileSec file
+    :returns: A tuple of the METS root element, the fileGrp element and
+              a dict of file paths and file elements, or None if the
+              file does not exist or it contains several fileGrps
+    """
+    if not os.path.isfile(filesec_file):
+        return None
+
+    root = ET.parse(filesec_file, parser=PARSER).getroot()
+    filegrps = root.findall('mets:fileSec/mets:fileGrp',
+                            namespaces=NAMESPACES)
+    if len(filegrps) != 1:
+        return None
+
+    file_index = {}
+    for file_elem in filegrps[0].iterfind('mets:file',
+                                          namespaces=NAMESPACES):
+        href = file_elem.find('mets:FLocat',
+                              namespaces=NAMESPACES).get(XLINK_HREF)
+        file_index[decode_path(href[len('file://'):])] = file_elem
+
+    return root, filegrps[0], file_index
+
+
+def read_structmap_index(structmap_file, structmap_type=None,
+                         root_type='directory'):
+    """Read an existing directory based structMap into an index of
+    directory paths and div elements.
+
+    :param structmap_file: Path to the structMap file
+    :param structmap_type: Expected TYPE attribute of the structMap
+    :param root_type: Expected TYPE attribute of the root div
+    :returns: A tuple of the structMap element tree, a dict of directory
+              paths and div elements, and a dict of file identifiers
+              and fptr elements, or None if the file does not exist or
+              it is not of the expected type. The root div has the
+              path ''.
+    """
+    if not os.path.isfile(structmap_file):
+        return None
+
+    structmap = ET.parse(structmap_file, parser=PARSER)
+    structmaps = structmap.getroot().findall('mets:structMap',
+                                             namespaces=NAMESPACES)
+    if len(structmaps) != 1 or structmaps[0].get('TYPE') != structmap_type:
+        return None
+
+    if structmap_type == 'Directory-physical':
+        root_type = 'directory'
+    container_div = structmaps[0].find('mets:div', namespaces=NAMESPACES)
+    if container_div is None or container_div.get('TYPE') != root_type:
+        return None
+
+    dir_index = {'': container_div}
+    fptr_index = {}
+    stack = [('', container_div)]
+    while stack:
+        (path, div_elem) = stack.pop()
+        for child in div_elem:
+            if child.tag == FPTR:
+                fptr_index[child.get('FILEID')] = child
+            elif child.get('ORDER') is not None:
+                # File div created by add_file_div()
+                for fptr in child.iterfind(FPTR):
+                    fptr_index[fptr.get('FILEID')] = fptr
+            else:
+                child_path = os.path.join(
+                    path, _directory_name(child, structmap_type))
+                dir_index[child_path] = child
+                stack.append((child_path, child))
+
+    return structmap, dir_index, fptr_index
+
+
+def _directory_name(div_elem, structmap_type):
+    """Return the directory name of a directory div.
+
+    :param div_elem: Directory div element
+    :param structmap_type: TYPE attribute of the structMap element
+    :returns: Directory name
+    """
+    if structmap_type == 'Directory-physical':
+        return div_elem.get('LABEL')
+    return div_elem.get('TYPE')
+
+
+def _file_changed(file_elem, path, all_amd_refs):
+    """Check if the metadata references of a file differ from the
+    ADMID attributes of its existing file element.
+
+    :param file_elem: Existing file element
+    :param path: File path
+    :param all_amd_refs: Administrative metadata references
+    :returns: True if the file has changed, False otherwise
+    """
+    amdids = get_md_references(all_amd_refs, path=path)
+    if set(file_elem.get('ADMID', '').split()) != amdids:
+        return True
+
+    streams = all_amd_refs[path]['streams']
+    stream_elems = file_elem.findall('mets:stream', namespaces=NAMESPACES)
+    if len(stream_elems) != len(streams):
+        return True
+    for stream, stream_elem in zip(streams, stream_elems):
+        stream_ids = get_md_references(all_amd_refs, path=path,
+                                       stream=stream)
+        if set(stream_elem.get('ADMID', '').split()) != stream_ids:
+            return True
+
+    return False
+
+
+def _remove_fptr(fptr):
+    """Remove an fptr element, and its file div if it has one, from the
+    structMap.
+
+    :param fptr: fptr element
+    """
+    parent = fptr.getparent()
+    if parent.get('ORDER') is not None:
+        parent.getparent().remove(parent)
+    else:
+        parent.remove(fptr)
+
+
+# pylint: disable=too-many-arguments
+def _insert_file(path,
+                 fileid,
+                 properties,
+                 dir_index,
+                 file_paths,
+                 structmap_type,
+                 all_amd_refs,
+                 all_dmd_refs):
+    """Insert a file to the structMap in the same place where a full
+    compilation would put it. Missing directory divs are created.
+
+    :param path: File path
+    :param fileid: File identifier
+    :param properties: File properties
+    :param dir_index: Dict of directory paths and div elements
+    :param file_paths: Dict of file identifiers and file paths
+    :param structmap_type: TYPE attribute of the structMap element
+    :param all_amd_refs: Administrative metadata references
+    :param all_dmd_refs: Descriptive metadata references
+    :returns: The new fptr element
+    """
+    parent_path = ''
+    parent = dir_index[parent_path]
+    for name in path.split('/')[:-1]:
+        div_path = os.path.join(parent_path, name)
+        if div_path not in dir_index:
+            amdids = get_md_references(all_amd_refs, directory=div_path)
+            dmdsec_id = get_md_references(all_dmd_refs, directory=div_path)
+            if structmap_type == 'Directory-physical':
+                div_elem = mets.div(type_attr='directory',
+                                    label=name,
+                                    dmdid=sorted_md_ids(dmdsec_id),
+                                    admid=sorted_md_ids(amdids))
+            else:
+                div_elem = mets.div(type_attr=name,
+                                    dmdid=sorted_md_ids(dmdsec_id),
+                                    admid=sorted_md_ids(amdids))
+            _insert_child(parent, div_elem, (2, name + '/'),
+                          file_paths, structmap_type)
+            dir_index[div_path] = div_elem
+        parent_path = div_path
+        parent = dir_index[div_path]
+
+    fptr = mets.fptr(fileid)
+    div_elem = add_file_div(fptr=fptr, properties=properties)
+    if div_elem is not None:
+        _insert_child(parent, div_elem, (1, path), file_paths,
+                      structmap_type)
+    else:
+        _insert_child(parent, fptr, (0, path), file_paths, structmap_type)
+
+    return fptr
+
+
+def _child_key(child, file_paths, structmap_type):
+    """Return the sort key of a child element of a structMap div.
+
+    The fptr elements come first, then the file divs and then the
+    directory divs, the same way as in create_div(). Files are sorted
+    by their paths and directories in the order of the first file in
+    them in the sorted file list.
+
+    :param child: Child element of a div
+    :param file_paths: Dict of file identifiers and file paths
+    :param structmap_type: TYPE attribute of the structMap element
+    :returns: Sort key as a tuple
+    """
+    if child.tag == FPTR:
+        return (0, file_paths[child.get('FILEID')])
+    if child.get('ORDER') is not None:
+        return (1, file_paths[child.find(FPTR).get('FILEID')])
+    return (2, _directory_name(child, structmap_type) + '/')
+
+
+def _insert_child(parent, child, key, file_paths, structmap_type):
+    """Insert a child element to its sorted place in a div.
+
+    :param parent: Parent div element
+    :param child: Child element to insert
+    :param key: Sort key of the child, see _child_key()
+    :param file_paths: Dict of file identifiers and file paths
+    :param structmap_type: TYPE attribute of the structMap element
+    """
+    for index, sibling in enumerate(parent):
+        if _child_key(sibling, file_paths, structmap_type) > key:
+            parent.insert(index, child)
+            return
+    parent.append(child)
+
+
+def _update_div_references(div_elem, directory, all_amd_refs, all_dmd_refs):
+    """Update the DMDID and ADMID attributes of a directory div from the
+    metadata references.
+
+    :param div_elem: Directory div element
+    :param directory: Directory path
+    :param all_amd_refs: Administrative metadata references
+    :param all_dmd_refs: Descriptive metadata references
+    """
+    new_div = mets.div(
+        type_attr=div_elem.get('TYPE'),
+        dmdid=sorted_md_ids(
+            get_md_references(all_dmd_refs, directory=directory)),
+        admid=sorted_md_ids(
+            get_md_references(all_amd_refs, directory=directory)))
+    for attribute in ('DMDID', 'ADMID'):
+        if new_div.get(attribute) is None:
+            div_elem.attrib.pop(attribute, None)
+        else:
+            div_elem.set(attribute, new_div.get(attribute))
@@ -34,20 +34,22 @@ def _uniques_list(reference_list, reference):
     return list(set_list)
 
 
-def _get_path_from_reference_file(reference_file, ref_path):
-    """An inner function to help read an existing JSON lines file.
+def _get_paths_from_reference_file(reference_file, ref_paths):
+    """An inner function to help read an existing JSON lines file. The
+    file is read once for all the paths.
 
     :reference_file: JSON Line reference file to read from.
-    :ref_path: The ref_path key to look for.
-    :return: Dictionary on finding, None when none is found.
+    :ref_paths: The ref_path keys to look for.
+    :return: Dictionary of the found path entries by ref_path. The first
+             entry of a path in the file is used.
     """
-    with open(reference_file) as out_file:
-        for line in out_file:
-            try:
-                return json.loads(line)[ref_path]
-            except KeyError:
-                continue
-    return None
+    found = {}
+    with open(reference_file) as in_file:
+        for line in in_file:
+            for (ref_path, path) in json.loads(line).items():
+                if ref_path in ref_paths:
+                    found.setdefault(ref_path, path)
+    return found
 
 
 def _setup_new_path(path_type):
@@ -144,87 +146,73 @@ class MetsSectionCreator:
 
         reference_file = os.path.join(self.workspace, ref_file)
 
-        path_map = {}
-        paths = []
-        # Whether or not the file initially exists.
-        file_exists = os.path.exists(reference_file)
-        # Collection of paths that underwent an update.
-        paths_updated = set()
+        # Path entries to write, in the order of the references.
+        paths = {}
+        # Existing path entries of the reference file. The file is read
+        # once for all the references.
+        existing_paths = {}
+        if os.path.exists(reference_file):
+            existing_paths = _get_paths_from_reference_file(
+                reference_file,
+                {_parse_refs(ref['path']) for ref in self.references})
+        # MD IDs of the reference lists by path and stream.
+        md_id_sets = {}
         for ref in self.references:
             ref_path = _parse_refs(ref['path'])
 
-            # We'll first set data to path-variable for processing.
-            try:
-                # Set a reference if path being processed already exists.
-                path = paths[path_map[ref_path]][ref_path]
-            except KeyError:
-                path = None
-                if file_exists:
-                    # Get existing path entry from a file.
-                    path = _get_path_from_reference_file(reference_file,
-                                                         ref_path)
-                    if path is not None:
-                        # Existing entry found.
-                        paths_updated.add(ref_path)
+            path = paths.get(ref_path)
+            if path is None:
+                # Existing entry of the file, or a new one.
+                path = existing_paths.get(ref_path)
                 if path is None:
-                    # No prior existing path so setting up new one.
                     path = _setup_new_path(ref['path_type'])
-                # Map to list of paths that underwent processing.
-                paths.append({ref_path: path})
-                path_map[ref_path] = len(paths) - 1
+                paths[ref_path] = path
 
             # Based on whether or not stream exists for the reference, we'll
-            # update the reference list.
+            # update the reference list. The MD IDs already in the lists
+            # are kept in sets, so that many references to the same path
+            # are added in linear time.
             if ref['stream']:
-                try:
-                    path['streams'][ref['stream']] = _uniques_list(
-                        path['streams'][ref['stream']],
-                        ref['md_id']
-                    )
-                except KeyError:
-                    path['streams'][ref['stream']] = list()
-                    path['streams'][ref['stream']].append(ref['md_id'])
+                md_ids = path['streams'].setdefault(ref['stream'], [])
             else:
-                path['md_ids'] = _uniques_list(path['md_ids'], ref['md_id'])
-
-            # After path-variable has been modified enough, set the updated
-            # path dictionary back paths-collection.
-            paths[path_map[ref_path]][ref_path] = path
+                md_ids = path['md_ids']
+            key = (ref_path, ref['stream'])
+            if key not in md_id_sets:
+                md_id_sets[key] = set(md_ids)
+                md_ids[:] = _uniques_list(md_ids, ref['md_id'])
+                md_id_sets[key].add(ref['md_id'])
+            elif ref['md_id'] not in md_id_sets[key]:
+                md_id_sets[key].add(ref['md_id'])
+                md_ids.append(ref['md_id'])
+
+        lines = [json.dumps({ref_path: path}) + '\n'
+                 for (ref_path, path) in paths.items()]
 
         # Write reference list JSON line file
-        if paths_updated:
+        if existing_paths:
             # Existing entries in reference file must be updated.
-            # We'll proceed to write to a separate temporary file.
+            # We'll proceed to write to a separate temporary file, which
+            # replaces the existing reference file as a whole.
             with open(reference_file) as in_file, open(
-                    f'{reference_file}.tmp', 'a'
+                    f'{reference_file}.tmp', 'w'
                     ) as out_file:
                 for line in in_file:
                     existing_json_data = json.loads(line)
                     for key in existing_json_data:
-                        if key not in paths_updated:
+                        if key not in existing_paths:
                             out_file.write(line)
-
-            for path in paths:
-                with open('%s.tmp' % reference_file, 'a') as out_file:
-                    json.dump(path, out_file)
-                    out_file.write('\n')
-        else:
+                out_file.write(''.join(lines))
+            os.rename('%s.tmp' % reference_file, reference_file)
+        elif lines:
             # If no existing entries required update, we'll append directly
             # to reference file.
-            for path in paths:
-                with open(reference_file, 'a') as out_file:
-                    json.dump(path, out_file)
-                    out_file.write('\n')
-
-        # If temporary file was written, it'll replace the existing reference
-        # file as a whole.
-        if os.path.exists('%s.tmp' % reference_file):
-            os.rename('%s.tmp' % reference_file, reference_file)
+            with open(reference_file, 'a') as out_file:
+                out_file.write(''.join(lines))
 
     # pylint: disable=too-many-arguments
     # pylint: disable=too-many-locals
     def write_md(self, metadata, mdtype, mdtypeversion, othermdtype=None,
-                 section=None, stdout=False):
+                 section=None, stdout=False, digest=None):
         """
         Wraps XML metadata into MD element and writes it to a lxml.etree XML
         file in the workspace. The output filename is
@@ -244,9 +232,12 @@ class MetsSectionCreator:
         :othermdtype (string): Value of mdWrap OTHERMDTYPE attribute
         :section (string): Type of mets metadata section
         :stdout (boolean): Print also to stdout
+        :digest (string): Digest of the metadata, if generated by the
+                          caller, e.g. without file specific elements
         :returns: md_id, filename - Metadata id and filename
         """
-        digest = generate_digest(metadata)
+        if digest is None:
+            digest = generate_digest(metadata)
         suffix = othermdtype if othermdtype else mdtype
         filename = encode_path("{}-{}-amd.xml".format(digest, suffix))
         md_id = f'_{digest}'
@@ -0,0 +1,288 @@
+"""Utility functions for validating METS documents against the XML
+schemas of the national specifications.
+
+Compiling the schema stack of the METS document is slow, so the schemas
+are resolved once into a cache directory, where the schema locations of
+the imports and includes point to the cached files. Later processes
+compile the schema from the cached files without resolving anything,
+and the compiled schema is kept in memory for the rest of the process.
+The cache is resolved again when a local schema or catalog file it was
+resolved from has changed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from urllib.parse import unquote, urljoin, urlparse
+from urllib.request import urlopen
+
+import lxml.etree as ET
+
+from siptools.xml.mets import METS_SCHEMA
+
+# XML catalog of the dpres-xml-schemas package
+DEFAULT_CATALOG = \
+    '/etc/xml/dpres-xml-schemas/schema_catalogs/catalog_main.xml'
+
+XS_NS = 'http://www.w3.org/2001/XMLSchema'
+CATALOG_NS = 'urn:oasis:names:tc:entity:xmlns:xml:catalog'
+
+SCHEMA_REFERENCES = ['{%s}%s' % (XS_NS, name)
+                     for name in ('import', 'include', 'redefine',
+                                  'override')]
+
+# File in the cache of a schema listing the local files it was resolved
+# from
+SOURCES_FILE = 'sources.json'
+
+_SCHEMAS = {}
+
+
+def default_cache_dir():
+    """Return the default directory for the cached schemas.
+
+    :returns: $XDG_CACHE_HOME/siptools/schemas or
+              ~/.cache/siptools/schemas
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'siptools', 'schemas')
+
+
+def get_schema(schema_location=METS_SCHEMA, catalog=None, cache_dir=None):
+    """Return the compiled XML schema.
+
+    The schema is compiled once per process. The schema files are
+    resolved with cache_schema(), unless they are already in the cache
+    directory.
+
+    :schema_location: URL or path of the schema
+    :catalog: XML catalog for resolving the schema locations. Defaults
+              to DEFAULT_CATALOG, if it exists.
+    :cache_dir: Directory of the cached schemas. Defaults to
+                default_cache_dir().
+    :returns: lxml.etree.XMLSchema object
+    """
+    if catalog is None and os.path.isfile(DEFAULT_CATALOG):
+        catalog = DEFAULT_CATALOG
+    cache_dir = cache_dir or default_cache_dir()
+
+    key = (schema_location, catalog, cache_dir)
+    if key not in _SCHEMAS:
+        schema_path = cache_schema(schema_location, cache_dir, catalog)
+        _SCHEMAS[key] = ET.XMLSchema(ET.parse(schema_path))
+    return _SCHEMAS[key]
+
+
+def cache_schema(schema_location, cache_dir, catalog=None):
+    """Resolve a schema and the schemas it imports and includes into the
+    cache directory.
+
+    The schema locations are resolved with the catalog, relative
+    locations against the location of the referring schema. The schema
+    locations in the cached files refer to the other cached files. An
+    existing cache of the same schema and catalog is used, unless one of
+    the local schema or catalog files it was resolved from has been
+    modified since. The files that no longer exist do not invalidate the
+    cache.
+
+    :schema_location: URL or path of the schema
+    :cache_dir: Directory of the cached schemas
+    :catalog: XML catalog for resolving the schema locations, or None
+    :returns: Path of the cached schema
+    """
+    if not urlparse(schema_location).scheme:
+        schema_location = os.path.abspath(schema_location)
+    key = hashlib.sha1(
+        ('%s %s' % (schema_location, catalog or '')).encode('utf-8')
+    ).hexdigest()
+    schema_dir = os.path.join(cache_dir, key)
+    main_schema = os.path.join(schema_dir, _cache_name(schema_location))
+    if os.path.isfile(main_schema) and not _sources_changed(schema_dir):
+        return main_schema
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.%s-' % key, dir=cache_dir)
+    try:
+        resolve = read_catalog(catalog) if catalog else {}
+        sources = resolve.get('files', [])[:]
+        pending = [schema_location]
+        done = {schema_location}
+        while pending:
+            location = pending.pop()
+            source = resolve_uri(location, resolve)
+            if _local_path(source):
+                sources.append(_local_path(source))
+            tree = _parse_schema(source)
+            for element in tree.iter(*SCHEMA_REFERENCES):
+                reference = element.get('schemaLocation')
+                if not reference:
+                    continue
+                reference = urljoin(location, reference)
+                element.set('schemaLocation', _cache_name(reference))
+                if reference not in done:
+                    done.add(reference)
+                    pending.append(reference)
+            tree.write(os.path.join(tmp_dir, _cache_name(location)),
+                       xml_declaration=True, encoding='UTF-8')
+        with open(os.path.join(tmp_dir, SOURCES_FILE), 'w') as outfile:
+            json.dump({path: _file_stamp(path) for path in sources},
+                      outfile, indent=0, sort_keys=True)
+        # Remove the outdated cache of the schema
+        shutil.rmtree(schema_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, schema_dir)
+        except OSError:
+            # Another process cached the schema at the same time
+            if not os.path.isfile(main_schema):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return main_schema
+
+
+def read_catalog(catalog):
+    """Read the URI mappings of an XML catalog.
+
+    The uri and system entries, the rewriteURI and rewriteSystem entries
+    and the next catalogs are read. Relative URIs are resolved against
+    the catalog file.
+
+    :catalog: Path of the XML catalog
+    :returns: Dict with keys "uri" for a dict of exact mappings,
+              "rewrite" for a list of prefixes and their replacements,
+              longest prefix first, and "files" for the paths of the
+              catalog files read
+    """
+    mappings = {'uri': {}, 'rewrite': [], 'files': []}
+    pending = [os.path.abspath(catalog)]
+    read = set()
+    while pending:
+        path = pending.pop(0)
+        if path in read or not os.path.isfile(path):
+            continue
+        read.add(path)
+        mappings['files'].append(path)
+        base = os.path.dirname(path)
+        for element in ET.parse(path).iter('{%s}*' % CATALOG_NS):
+            name = ET.QName(element).localname
+            if name in ('uri', 'system'):
+                mappings['uri'].setdefault(
+                    element.get('name') or element.get('systemId'),
+                    _catalog_target(base, element.get('uri')))
+            elif name in ('rewriteURI', 'rewriteSystem'):
+                mappings['rewrite'].append((
+                    element.get('uriStartString') or
+                    element.get('systemIdStartString'),
+                    _catalog_target(base, element.get('rewritePrefix'))))
+            elif name == 'nextCatalog':
+                pending.append(_catalog_target(base, element.get('catalog')))
+    mappings['rewrite'].sort(key=lambda item: len(item[0]), reverse=True)
+    return mappings
+
+
+def resolve_uri(uri, mappings):
+    """Resolve a URI with the catalog mappings.
+
+    :uri: URI to resolve
+    :mappings: Catalog mappings from read_catalog()
+    :returns: Mapped path or URI, or the URI itself if it is not mapped
+    """
+    if not mappings:
+        return uri
+    if uri in mappings['uri']:
+        return mappings['uri'][uri]
+    for (prefix, replacement) in mappings['rewrite']:
+        if uri.startswith(prefix):
+            return replacement + uri[len(prefix):]
+    return uri
+
+
+def validate_mets(mets_tree, schema=None):
+    """Validate METS document against the schema.
+
+    :mets_tree: METS document as ElementTree or Element
+    :schema: lxml.etree.XMLSchema object. Defaults to get_schema().
+    :raises: ValueError listing the validation errors, if the document is
+             not valid
+    """
+    schema = schema or get_schema()
+    if not schema.validate(mets_tree):
+        errors = [('line %d: %s' % (error.line, error.message))
+                  if error.line else error.message
+                  for error in schema.error_log]
+        raise ValueError('METS document is not valid:\n%s'
+                         % '\n'.join(errors))
+
+
+def validate_mets_file(path, schema=None):
+    """Validate METS document file against the schema.
+
+    :path: Path of the METS document
+    :schema: lxml.etree.XMLSchema object. Defaults to get_schema().
+    :raises: ValueError listing the validation errors, if the document is
+             not valid
+    """
+    parser = ET.XMLParser(huge_tree=True)
+    validate_mets(ET.parse(path, parser=parser), schema)
+
+
+def _catalog_target(base, uri):
+    """Resolve a URI in a catalog against the catalog directory."""
+    if urlparse(uri).scheme in ('', 'file'):
+        return os.path.join(base, unquote(urlparse(uri).path))
+    return uri
+
+
+def _cache_name(location):
+    """Return the file name of a schema in the cache directory."""
+    digest = hashlib.sha1(location.encode('utf-8')).hexdigest()[:16]
+    name = os.path.basename(urlparse(location).path) or 'schema.xsd'
+    return '%s-%s' % (digest, name)
+
+
+def _local_path(source):
+    """Return the path of a schema source, or None for a remote URL."""
+    if source.startswith('file:'):
+        return unquote(urlparse(source).path)
+    if urlparse(source).scheme:
+        return None
+    return source
+
+
+def _file_stamp(path):
+    """Return the modification time and size of a file, or None if the
+    file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return '%d %d' % (stat.st_mtime_ns, stat.st_size)
+
+
+def _sources_changed(schema_dir):
+    """Check whether a local file a cached schema was resolved from has
+    been modified. A cache without the list of its sources is outdated.
+    """
+    try:
+        with open(os.path.join(schema_dir, SOURCES_FILE)) as infile:
+            sources = json.load(infile)
+    except (OSError, ValueError):
+        return True
+    for (path, stamp) in sources.items():
+        current = _file_stamp(path)
+        if current is not None and current != stamp:
+            return True
+    return False
+
+
+def _parse_schema(source):
+    """Parse a schema from a path, a file URL or an HTTP(S) URL."""
+    if urlparse(source).scheme in ('http', 'https'):
+        with urlopen(source) as response:
+            return ET.parse(response, base_url=source)
+    return ET.parse(_local_path(source) or source)
@@ -6,13 +6,16 @@ import datetime
 import os
 import sys
 import uuid
-from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import lxml.etree
 import mets
 import xml_helpers.utils as xml_utils
-from siptools.utils import get_objectlist, read_md_references
+from siptools.schema_utils import (get_schema, validate_mets,
+                                   validate_mets_file)
+from siptools.utils import (COPY_MODES, calc_checksum, copy_file,
+                            get_objectlist, read_fixity, read_md_references)
 from siptools.xml.mets import (METS_CATALOG, METS_PROFILE, METS_SPECIFICATION,
                                NAMESPACES, RECORD_STATUS_TYPES, mets_extend)
 
@@ -21,6 +24,15 @@ from os import scandir
 
 click.disable_unicode_literals_warning = True
 
+# Order of the METS sections after metsHdr and the order of the metadata
+# sections within amdSec
+METS_SECTION_ORDER = ['dmdSec', 'amdSec', 'fileSec', 'structMap',
+                      'structLink', 'behaviorSec']
+AMDSEC_ORDER = ['techMD', 'rightsMD', 'sourceMD', 'digiprovMD']
+
+METS_PART_SUFFIXES = ('-amd.xml', 'dmdsec.xml', 'structmap.xml',
+                      'filesec.xml', 'rightsmd.xml')
+
 
 @click.command()
 @click.argument('mets_profile', type=click.Choice(METS_PROFILE))
@@ -72,9 +84,49 @@ click.disable_unicode_literals_warning = True
 @click.option('--copy_files',
               is_flag=True,
               help='Copy digital objects from base path to workspace')
+@click.option('--copy_mode',
+              type=click.Choice(COPY_MODES),
+              default='copy',
+              metavar='<COPY MODE>',
+              help='How --copy_files copies the digital objects: copy, '
+                   'reflink, hardlink or symlink. Reflink and hardlink '
+                   'copy the data if the file system does not support '
+                   'them. Defaults to "copy".')
+@click.option('--verify_copies',
+              is_flag=True,
+              help='Verify the objects copied with --copy_files against '
+                   'the PREMIS fixity recorded by import-object.')
 @click.option('--stdout',
               is_flag=True,
               help='Print output to stdout.')
+@click.option('--streaming',
+              is_flag=True,
+              help='Write the METS document incrementally, keeping only '
+                   'one partial METS document in memory at a time. '
+                   'Intended for very large packages.')
+@click.option('--jobs',
+              type=click.IntRange(min=1),
+              default=1,
+              metavar='<JOBS>',
+              help='Number of threads used for parsing the partial METS '
+                   'documents and for copying the digital objects. '
+                   'Defaults to 1.')
+@click.option('--validate',
+              is_flag=True,
+              help='Validate the METS document against the METS schema '
+                   'and the schemas it imports. The resolved schemas are '
+                   'cached for later runs.')
+@click.option('--schema_catalog',
+              type=click.Path(exists=True, dir_okay=False),
+              metavar='<CATALOG PATH>',
+              help='XML catalog for resolving the schemas with --validate. '
+                   'Defaults to the catalog of dpres-xml-schemas, if it is '
+                   'installed.')
+@click.option('--schema_cache',
+              type=click.Path(file_okay=False),
+              metavar='<CACHE DIR>',
+              help='Directory for the cached schemas. Defaults to '
+                   '~/.cache/siptools/schemas.')
 @click.option('--packagingservice',
               type=str,
               metavar='<PACKAGING SERVICE>',
@@ -116,9 +168,16 @@ def _attribute_values(given_params, fill_contentid=False):
         "stdout": False,
         "clean": False,
         "copy_files": False,
+        "copy_mode": "copy",
+        "verify_copies": False,
         "label": None,
         "last_moddate": None,
         "packagingservice": None,
+        "streaming": False,
+        "jobs": 1,
+        "validate": False,
+        "schema_catalog": None,
+        "schema_cache": None,
     }
     for key in given_params:
         if given_params[key]:
@@ -154,27 +213,53 @@ def compile_mets(**kwargs):
              copy_files: True copies the digital objects from base_path to
                          workspace
              stdout: True prints the output to stdout
+             streaming: True writes the METS document incrementally
+             jobs: Number of threads for parsing the partial documents
+             validate: True validates the METS document against the
+                       schema before it is written, or after it is
+                       written in streaming mode
+             schema_catalog: XML catalog for resolving the schemas
+             schema_cache: Directory for the cached schemas
              packagingservice: Packaging service specific parameter
+    :raises: ValueError if the METS document is not valid
     """
     attributes = _attribute_values(kwargs, True)
 
-    mets_document = create_mets(**attributes)
-
-    if attributes["stdout"]:
-        print(xml_utils.serialize(mets_document.getroot()))
-
     output_file = os.path.join(attributes["workspace"], 'mets.xml')
 
     if not os.path.exists(os.path.dirname(output_file)):
         os.makedirs(os.path.dirname(output_file))
 
-    with open(output_file, 'wb+') as outfile:
-        outfile.write(xml_utils.serialize(mets_document.getroot()))
+    schema = None
+    if attributes["validate"]:
+        schema = get_schema(catalog=attributes["schema_catalog"],
+                            cache_dir=attributes["schema_cache"])
+
+    if attributes["streaming"]:
+        write_mets(output_file, **attributes)
+        if schema is not None:
+            validate_mets_file(output_file, schema)
+        if attributes["stdout"]:
+            with open(output_file, 'rb') as infile:
+                print(infile.read())
+    else:
+        mets_document = create_mets(**attributes)
+        if schema is not None:
+            validate_mets(mets_document, schema)
+
+        if attributes["stdout"]:
+            print(xml_utils.serialize(mets_document.getroot()))
+
+        with open(output_file, 'wb+') as outfile:
+            outfile.write(xml_utils.serialize(mets_document.getroot()))
 
     print("compile_mets created file: %s" % output_file)
 
     if attributes["copy_files"]:
-        copy_objects(attributes["workspace"], attributes["base_path"])
+        copy_objects(attributes["workspace"], attributes["base_path"],
+                     copy_mode=attributes["copy_mode"],
+                     jobs=attributes["jobs"],
+                     verify=attributes["verify_copies"])
         print("compile_mets copied objects from %s to "
               "workspace" % attributes["base_path"])
 
@@ -205,9 +290,217 @@ def create_mets(fill_contentid=False, **attributes):
                  record_status: Record status
                  label: Short description about the package
                  packagingservice: Packaging service specific parameter
+                 jobs: Number of threads for parsing the partial
+                       documents. The documents are merged in the order
+                       of their file names regardless of the number.
     :returns: METS document ElementTree object
     """
     attributes = _attribute_values(attributes, fill_contentid)
+    (mets_element, metshdr) = _create_mets_root(attributes)
+
+    # Collect elements from workspace XML files
+    paths = sorted(entry.path for entry in scandir(attributes["workspace"])
+                   if entry.name.endswith(METS_PART_SUFFIXES)
+                   and entry.is_file())
+    elements = _map_parts(_parse_section, paths, attributes["jobs"])
+    elements = merge_sections(elements)
+
+    mets_element.append(metshdr)
+    for element in elements:
+        mets_element.append(element)
+    lxml.etree.cleanup_namespaces(mets_element)
+
+    return lxml.etree.ElementTree(mets_element)
+
+
+def merge_sections(elements):
+    """Merge the sections of partial METS documents.
+
+    The metadata sections of all amdSec elements are moved to the first
+    amdSec element and the rest of the amdSec elements are dropped. The
+    sections are collected by their type in one pass, so the time taken
+    grows linearly with the number of sections. The sections and the
+    metadata sections are returned in the order of the METS schema,
+    sections of the same type in their original order.
+
+    :elements: List of METS section elements
+    :returns: Merged and ordered list of METS section elements
+    """
+    sections = {name: [] for name in METS_SECTION_ORDER}
+    md_sections = {md_type: [] for md_type in AMDSEC_ORDER}
+    amdsec = None
+
+    for element in elements:
+        name = lxml.etree.QName(element).localname
+        if name != 'amdSec':
+            sections.setdefault(name, []).append(element)
+            continue
+        if amdsec is None:
+            amdsec = element
+            sections[name].append(element)
+        for md_elem in element:
+            if isinstance(md_elem.tag, str):
+                md_type = lxml.etree.QName(md_elem).localname
+                md_sections.setdefault(md_type, []).append(md_elem)
+
+    if amdsec is not None:
+        amdsec[:] = [md_elem for md_list in md_sections.values()
+                     for md_elem in md_list]
+
+    return [element for section_list in sections.values()
+            for element in section_list]
+
+
+def write_mets(output_file, fill_contentid=False, **attributes):
+    """Write METS document to a file incrementally from the partial METS
+    documents in workspace directory.
+
+    Creates the same document as create_mets(), but only one partial
+    METS document is kept in memory at a time. The sections are written
+    in the order of the METS schema: metsHdr, dmdSecs, one amdSec with
+    the techMD, rightsMD, sourceMD and digiprovMD elements of all
+    partial documents, fileSec and structMaps. Partial documents of the
+    same type are written in the order of their file names.
+
+    :output_file: Path of the METS document to write
+    :fill_contentid: True sets attribute "contentid" same as "objid" if
+                     "objid" is given, but "contentid" is not.
+    :attributes: The same keys as in create_mets()
+    """
+    attributes = _attribute_values(attributes, fill_contentid)
+    (mets_element, metshdr) = _create_mets_root(attributes)
+    parts = collect_mets_parts(attributes["workspace"],
+                               jobs=attributes["jobs"])
+
+    with lxml.etree.xmlfile(output_file, encoding='UTF-8') as xmlfile:
+        xmlfile.write_declaration()
+        with xmlfile.element(mets_element.tag,
+                             attrib=dict(mets_element.attrib),
+                             nsmap=mets_element.nsmap):
+            xmlfile.write(metshdr, pretty_print=True)
+            for section in METS_SECTION_ORDER:
+                if section == 'amdSec':
+                    _write_amdsec(xmlfile, parts)
+                    continue
+                for path in parts.get(section, []):
+                    xmlfile.write(_parse_section(path, remove_blank_text=True),
+                                  pretty_print=True)
+
+
+def _write_amdsec(xmlfile, parts):
+    """Write one amdSec element with the metadata sections of all
+    partial amdSec documents.
+
+    A partial document is grouped by the type of its first metadata
+    section. If it contains sections of several types, it is added to
+    the groups of the other types when its first group is written.
+
+    :xmlfile: lxml.etree.xmlfile context to write to
+    :parts: Partial METS documents from collect_mets_parts()
+    """
+    groups = {md_type: list(parts.get(md_type, []))
+              for md_type in AMDSEC_ORDER}
+    if not any(groups.values()):
+        return
+
+    with xmlfile.element('{%s}amdSec' % NAMESPACES['mets']):
+        for index, md_type in enumerate(AMDSEC_ORDER):
+            for path in groups[md_type]:
+                for md_elem in _parse_section(path, remove_blank_text=True):
+                    name = lxml.etree.QName(md_elem).localname
+                    if name == md_type:
+                        xmlfile.write(md_elem, pretty_print=True)
+                    elif name in AMDSEC_ORDER[index + 1:] and \
+                            path not in groups[name]:
+                        groups[name].append(path)
+
+
+def collect_mets_parts(workspace, jobs=1):
+    """Collect the partial METS documents in workspace directory.
+
+    Only the beginning of the files is parsed for finding out the
+    section they contain.
+
+    :workspace: Workspace path
+    :jobs: Number of threads for parsing the files
+    :returns: Dict of section names and lists of file paths sorted by
+              file name. Partial amdSec documents are listed under the
+              type of their first metadata section instead, e.g.
+              "techMD".
+    """
+    entries = sorted(scandir(workspace), key=lambda entry: entry.name)
+    paths = [entry.path for entry in entries
+             if entry.name.endswith(METS_PART_SUFFIXES) and entry.is_file()]
+
+    parts = {}
+    for path, section in zip(paths, _map_parts(_part_section, paths, jobs)):
+        if section:
+            parts.setdefault(section, []).append(path)
+    return parts
+
+
+def _map_parts(function, paths, jobs=1):
+    """Call function for each partial METS document.
+
+    With more than one job, the documents are handled in a thread pool.
+    lxml releases the GIL while parsing, so reading and parsing the files
+    overlaps. The results are returned in the order of the paths in
+    either case.
+
+    :function: Function taking a path as its only argument
+    :paths: Paths of the partial METS documents
+    :jobs: Number of threads
+    :returns: List of the results
+    """
+    if jobs and jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(function, paths, chunksize=64))
+    return [function(path) for path in paths]
+
+
+def _part_section(path):
+    """Return the name of the section in a partial METS document, or for
+    an amdSec the name of its first metadata section.
+
+    :path: Path of the partial METS document
+    :returns: Local name of the section element, or None if the document
+              has no sections
+    """
+    context = lxml.etree.iterparse(path, events=('start',))
+    try:
+        next(context)
+        (_, section) = next(context)
+    except StopIteration:
+        return None
+    name = lxml.etree.QName(section).localname
+    if name != 'amdSec':
+        return name
+
+    for _, elem in context:
+        if elem.getparent() is section:
+            return lxml.etree.QName(elem).localname
+        break
+    return None
+
+
+def _parse_section(path, remove_blank_text=False):
+    """Parse the section element of a partial METS document.
+
+    :path: Path of the partial METS document
+    :remove_blank_text: True to remove the indentation of the document
+    :returns: First child element of the document root
+    """
+    parser = lxml.etree.XMLParser(remove_blank_text=remove_blank_text,
+                                  huge_tree=True)
+    return lxml.etree.parse(path, parser=parser).getroot()[0]
+
+
+def _create_mets_root(attributes):
+    """Create METS root element and metsHdr element.
+
+    :attributes: Attributes from _attribute_values()
+    :returns: A tuple of METS root element and metsHdr element
+    """
     # Create list of agent elements
     if attributes["packagingservice"]:
         agents = [mets.agent(attributes["organization_name"],
@@ -226,18 +519,6 @@ def create_mets(fill_contentid=False, **attributes):
                            attributes["record_status"],
                            agents)
 
-    # Collect elements from workspace XML files
-    elements = []
-    for entry in scandir(attributes["workspace"]):
-        if entry.name.endswith(('-amd.xml', 'dmdsec.xml',
-                                'structmap.xml', 'filesec.xml',
-                                'rightsmd.xml')) and entry.is_file():
-            element = lxml.etree.parse(entry.path).getroot()[0]
-            elements.append(element)
-
-    elements = mets.merge_elements('{%s}amdSec' % NAMESPACES['mets'], elements)
-    elements.sort(key=mets.order)
-
     # Create METS element
     mets_element = mets.mets(METS_PROFILE[attributes["mets_profile"]],
                              objid=attributes["objid"],
@@ -248,12 +529,7 @@ def create_mets(fill_contentid=False, **attributes):
                                METS_SPECIFICATION,
                                attributes["contentid"],
                                attributes["contractid"])
-    mets_element.append(metshdr)
-    for element in elements:
-        mets_element.append(element)
-    lxml.etree.cleanup_namespaces(mets_element)
-
-    return lxml.etree.ElementTree(mets_element)
+    return mets_element, metshdr
 
 
 def clean_metsparts(path):
@@ -267,25 +543,67 @@ def clean_metsparts(path):
             if (name.endswith(('-amd.xml', 'dmdsec.xml', 'structmap.xml',
                                'filesec.xml', 'rightsmd.xml',
                                'md-references.jsonl',
-                               '-scraper.json', '-amd.json'))):
+                               '-scraper.json', '-amd.json',
+                               '-amd.jsonl', 'premis-agent-index.jsonl',
+                               'premis-event-catalog.jsonl'))):
                 os.remove(os.path.join(root, name))
 
 
-def copy_objects(workspace, data_dir):
+def copy_objects(workspace, data_dir, copy_mode='copy', jobs=1,
+                 verify=False):
     """
     Copy digital objects to workspace.
 
     :workspace: Workspace path
     :data_dir: Path to digital objects
+    :copy_mode: One of siptools.utils.COPY_MODES
+    :jobs: Number of threads for copying the objects
+    :verify: True to compare the checksums of the copies with the
+             PREMIS fixity recorded for the objects
+    :raises: ValueError if a checksum of a copy does not match
     """
-    files = get_objectlist(read_md_references(
-        workspace, "import-object-md-references.jsonl"
-    ))
-    for source in files:
+    object_refs = read_md_references(
+        workspace, "import-object-md-references.jsonl")
+    files = get_objectlist(object_refs)
+    for directory in sorted({os.path.dirname(source) for source in files}):
+        os.makedirs(os.path.join(workspace, directory), exist_ok=True)
+
+    def _copy_object(source):
+        """Copy and verify one digital object."""
         target = os.path.join(workspace, source)
-        if not os.path.exists(os.path.dirname(target)):
-            os.makedirs(os.path.dirname(target))
-        copyfile(os.path.join(data_dir, source), target)
+        copy_file(os.path.join(data_dir, source), target, copy_mode)
+        if verify:
+            verify_fixity(source, target, workspace, object_refs)
+
+    if jobs and jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for _ in executor.map(_copy_object, files):
+                pass
+    else:
+        for source in files:
+            _copy_object(source)
+
+
+def verify_fixity(path, target, workspace, object_refs=None):
+    """
+    Compare the checksum of a file with the PREMIS fixity recorded for
+    the digital object. Nothing is checked, if no fixity is recorded.
+
+    :path: Path of the digital object in the METS document
+    :target: Path of the file to check
+    :workspace: Workspace path
+    :object_refs: Import-object metadata references, if already read
+    :raises: ValueError if the checksum does not match
+    """
+    fixity = read_fixity(path, workspace, object_refs)
+    if fixity is None:
+        return
+    (algorithm, digest) = fixity
+    checksum = calc_checksum(target, algorithm.lower().replace('-', ''))
+    if checksum.lower() != digest.lower():
+        raise ValueError(
+            'Checksum of copied file %s does not match the recorded %s '
+            'fixity' % (target, algorithm))
 
 
 if __name__ == '__main__':
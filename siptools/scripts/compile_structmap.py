@@ -13,17 +13,18 @@ import mets
 import xml_helpers.utils as xml_utils
 from siptools.scripts.create_agent import create_agent
 from siptools.scripts.premis_event import premis_event
-from siptools.ead_utils import compile_ead3_structmap
-from siptools.utils import (add,
-                            add_file_div,
+from siptools.ead_utils import (compile_ead3_structmap,
+                                create_ead3_structmap)
+from siptools.incremental_utils import update_structmap
+from siptools.utils import (add_file_div,
                             create_filegrp,
                             encode_path,
                             get_md_references,
                             get_reference_lists,
                             iter_supplementary,
                             read_md_references,
-                            SUPPLEMENTARY_TYPES,
-                            tree)
+                            sorted_md_ids,
+                            SUPPLEMENTARY_TYPES)
 from siptools.xml.mets import NAMESPACES
 
 import siptools
@@ -43,9 +44,12 @@ SUPPLEMENTARY_REFERENCE_FILES = {
               help="Workspace directory. Defaults to ./workspace/")
 @click.option('--structmap_type',
               type=str,
+              multiple=True,
               metavar='<STRUCTMAP TYPE>',
               help="Type of structmap e.g. 'Fairdata-physical', "
-                   "'EAD3-logical', or 'Directory-physical'")
+                   "'EAD3-logical', or 'Directory-physical'. May be used "
+                   "multiple times to create several structmaps sharing "
+                   "the same file section.")
 @click.option('--root_type',
               type=str,
               default='directory',
@@ -56,10 +60,29 @@ SUPPLEMENTARY_REFERENCE_FILES = {
               metavar='<DMD LOCATION>',
               help="Location of structured descriptive metadata, "
                    "if applicable.")
+@click.option('--incremental',
+              is_flag=True,
+              help="Update the existing filesec.xml and structmap.xml "
+                   "with new and changed files instead of compiling them "
+                   "from scratch. Falls back to full compilation if the "
+                   "existing files can not be updated.")
+@click.option('--deterministic_ids',
+              is_flag=True,
+              help="Derive file identifiers from the file paths instead "
+                   "of generating random identifiers, so that repeated "
+                   "builds of the same workspace give the same "
+                   "identifiers.")
+@click.option('--objid',
+              type=str,
+              metavar='<OBJID>',
+              help="Object identifier of the package, used in deriving "
+                   "the file identifiers with --deterministic_ids.")
 @click.option('--stdout',
               is_flag=True,
               help='Print output also to stdout.')
-def main(workspace, structmap_type, root_type, dmdsec_loc, stdout):
+# pylint: disable=too-many-arguments
+def main(workspace, structmap_type, root_type, dmdsec_loc, incremental,
+         deterministic_ids, objid, stdout):
     """Tool for generating METS file section and structural map based on
     created/imported administrative metada and descriptive metadata.
     The script will also add order of the file to the structural map
@@ -70,16 +93,23 @@ def main(workspace, structmap_type, root_type, dmdsec_loc, stdout):
                       structmap_type=structmap_type,
                       root_type=root_type,
                       dmdsec_loc=dmdsec_loc,
+                      incremental=incremental,
+                      deterministic_ids=deterministic_ids,
+                      objid=objid,
                       stdout=stdout)
 
     return 0
 
 
 # pylint: disable=too-many-locals
+# pylint: disable=too-many-branches
 def compile_structmap(workspace='./workspace/',
                       structmap_type=None,
                       root_type='directory',
                       dmdsec_loc=None,
+                      incremental=False,
+                      deterministic_ids=False,
+                      objid=None,
                       stdout=False):
     """Generate METS file section and structural map based on
     created/imported administrative metada and descriptive metadata.
@@ -87,19 +117,117 @@ def compile_structmap(workspace='./workspace/',
     Supplementary files are put in a separate fileGrp section and
     a separate structmap file is created for these files.
 
+    Several structmap types may be given, in which case the file section
+    is created only once and shared by the structmaps. The first
+    structmap is written to structmap.xml and the others to
+    <structmap type>-structmap.xml.
+
+    In incremental mode the existing fileSec and structMap are updated
+    with the new and changed files, see update_structmap(). This is
+    supported for a single directory based structmap without
+    supplementary files, otherwise everything is compiled from scratch.
+
     :param workspace: Workspace directory
-    :param structmap_type: Type of structmap
+    :param structmap_type: Type of structmap, or a list of types
     :param root_type: Type of root div
     :param dmdsec_loc: Location of structured descriptive metadata
+    :param incremental: True to update the existing fileSec and
+                        structMap
+    :param deterministic_ids: True to derive the file identifiers from
+                              the file paths and objid
+    :param objid: Object identifier of the package
     :param stdout: True to print output to stdout
     """
+    structmap_types = _structmap_types(structmap_type)
+
     # Create an event documenting the structmap creation
     _create_event(
         workspace=workspace,
-        structmap_type=structmap_type,
+        structmap_type=structmap_types,
         root_type=root_type
     )
 
+    updated = None
+    if incremental:
+        if len(structmap_types) == 1 and \
+                structmap_types[0] != 'EAD3-logical':
+            updated = update_structmap(workspace=workspace,
+                                       structmap_type=structmap_types[0],
+                                       root_type=root_type,
+                                       deterministic_ids=deterministic_ids,
+                                       objid=objid)
+        if updated is None:
+            print("compile_structmap can not update the existing fileSec "
+                  "and structMap, compiling them from scratch")
+
+    if updated is not None:
+        (filesec, structmap) = updated
+        structmaps = [structmap]
+        supplementary_files = {}
+    else:
+        (filesec,
+         structmaps,
+         supplementary_files,
+         suppl_structmap) = _compile_sections(
+             workspace=workspace,
+             structmap_types=structmap_types,
+             root_type=root_type,
+             dmdsec_loc=dmdsec_loc,
+             deterministic_ids=deterministic_ids,
+             objid=objid)
+
+    if stdout:
+        print(xml_utils.serialize(filesec).decode("utf-8"))
+        for structmap in structmaps:
+            print(xml_utils.serialize(structmap).decode("utf-8"))
+        if supplementary_files:
+            print(xml_utils.serialize(suppl_structmap).decode("utf-8"))
+
+    output_fs_file = os.path.join(workspace, 'filesec.xml')
+    output_sm_files = [
+        os.path.join(workspace, _structmap_filename(index, current_type))
+        for index, current_type in enumerate(structmap_types)]
+    created_files = output_sm_files + [output_fs_file]
+
+    if not os.path.exists(os.path.dirname(output_fs_file)):
+        os.makedirs(os.path.dirname(output_fs_file))
+
+    for output_sm_file, structmap in zip(output_sm_files, structmaps):
+        with open(output_sm_file, 'wb+') as outfile:
+            outfile.write(xml_utils.serialize(structmap))
+
+    with open(output_fs_file, 'wb+') as outfile:
+        outfile.write(xml_utils.serialize(filesec))
+
+    if supplementary_files:
+        output_suppl_sm_file = os.path.join(workspace,
+                                            'supplementary_structmap.xml')
+        if not os.path.exists(os.path.dirname(output_suppl_sm_file)):
+            os.makedirs(os.path.dirname(output_suppl_sm_file))
+        with open(output_suppl_sm_file, 'wb+') as outfile:
+            outfile.write(xml_utils.serialize(suppl_structmap))
+        created_files.append(output_suppl_sm_file)
+
+    print("compile_structmap created files: " + " ".join(created_files))
+
+
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-arguments
+def _compile_sections(workspace, structmap_types, root_type, dmdsec_loc,
+                      deterministic_ids=False, objid=None):
+    """Compile the fileSec and structMaps from scratch.
+
+    :param workspace: Workspace directory
+    :param structmap_types: List of structmap types
+    :param root_type: Type of root div
+    :param dmdsec_loc: Location of structured descriptive metadata
+    :param deterministic_ids: True to derive the file identifiers from
+                              the file paths and objid
+    :param objid: Object identifier of the package
+    :returns: A tuple of the fileSec, a list of structMaps, a dict of
+              supplementary files and the supplementary structMap, which
+              is None if there are no supplementary files
+    """
     # Get reference list only after the structmap creation event
     (all_amd_refs,
      all_dmd_refs,
@@ -112,8 +240,10 @@ def compile_structmap(workspace='./workspace/',
         file_properties=file_properties
     )
 
+    structmaps = []
+
     # Create EAD3 based structMap and fileSec for EAD3-logical types
-    if structmap_type == 'EAD3-logical':
+    if structmap_types == ['EAD3-logical']:
         (structmap, filesec, file_ids) = compile_ead3_structmap(
             dmdsec_loc=dmdsec_loc,
             workspace=workspace,
@@ -122,7 +252,10 @@ def compile_structmap(workspace='./workspace/',
             object_refs=object_refs,
             file_properties=file_properties,
             supplementary_files=supplementary_files,
-            supplementary_types=supplementary_types)
+            supplementary_types=supplementary_types,
+            deterministic_ids=deterministic_ids,
+            objid=objid)
+        structmaps.append(structmap)
 
     else:
         (filesec, file_ids) = create_filesec(
@@ -130,22 +263,38 @@ def compile_structmap(workspace='./workspace/',
             object_refs=object_refs,
             file_properties=file_properties,
             supplementary_files=supplementary_files,
-            supplementary_types=supplementary_types)
-
-        # Add file path and ID dict to attributes
-        structmap = create_structmap(filesec=filesec,
-                                     all_amd_refs=all_amd_refs,
-                                     all_dmd_refs=all_dmd_refs,
-                                     filelist=filelist,
-                                     supplementary_files=supplementary_files,
-                                     supplementary_types=supplementary_types,
-                                     structmap_type=structmap_type,
-                                     root_type=root_type,
-                                     file_ids=file_ids,
-                                     file_properties=file_properties,
-                                     workspace=workspace)
+            supplementary_types=supplementary_types,
+            deterministic_ids=deterministic_ids,
+            objid=objid)
+
+        for current_type in structmap_types:
+            if current_type == 'EAD3-logical':
+                structmap = create_ead3_structmap(
+                    dmdsec_loc=dmdsec_loc,
+                    workspace=workspace,
+                    all_amd_refs=all_amd_refs,
+                    all_dmd_refs=all_dmd_refs,
+                    object_refs=object_refs,
+                    file_properties=file_properties,
+                    file_ids=file_ids)
+            else:
+                # Add file path and ID dict to attributes
+                structmap = create_structmap(
+                    filesec=filesec,
+                    all_amd_refs=all_amd_refs,
+                    all_dmd_refs=all_dmd_refs,
+                    filelist=filelist,
+                    supplementary_files=supplementary_files,
+                    supplementary_types=supplementary_types,
+                    structmap_type=current_type,
+                    root_type=root_type,
+                    file_ids=file_ids,
+                    file_properties=file_properties,
+                    workspace=workspace)
+            structmaps.append(structmap)
 
     # Create a separate structmap for supplementary files if they exist
+    suppl_structmap = None
     if supplementary_files:
         root_type = SUPPLEMENTARY_TYPES['main']
         suppl_structmap = create_structmap(
@@ -161,45 +310,47 @@ def compile_structmap(workspace='./workspace/',
             file_properties=file_properties,
             workspace=workspace)
 
-    if stdout:
-        print(xml_utils.serialize(filesec).decode("utf-8"))
-        print(xml_utils.serialize(structmap).decode("utf-8"))
-        if supplementary_files:
-            print(xml_utils.serialize(suppl_structmap).decode("utf-8"))
+    return filesec, structmaps, supplementary_files, suppl_structmap
 
-    output_sm_file = os.path.join(workspace, 'structmap.xml')
-    output_fs_file = os.path.join(workspace, 'filesec.xml')
-    created_files = [output_sm_file, output_fs_file]
 
-    if not os.path.exists(os.path.dirname(output_sm_file)):
-        os.makedirs(os.path.dirname(output_sm_file))
+def _structmap_types(structmap_type):
+    """Return the given structmap type or types as a list without
+    duplicates.
 
-    if not os.path.exists(os.path.dirname(output_fs_file)):
-        os.makedirs(os.path.dirname(output_fs_file))
+    :param structmap_type: Type of structmap, or a list of types
+    :returns: List of structmap types, ``[None]`` if no type is given
+    """
+    if not structmap_type:
+        return [None]
+    if isinstance(structmap_type, str):
+        return [structmap_type]
 
-    with open(output_sm_file, 'wb+') as outfile:
-        outfile.write(xml_utils.serialize(structmap))
+    structmap_types = []
+    for current_type in structmap_type:
+        if current_type not in structmap_types:
+            structmap_types.append(current_type)
+    return structmap_types
 
-    with open(output_fs_file, 'wb+') as outfile:
-        outfile.write(xml_utils.serialize(filesec))
 
-    if supplementary_files:
-        output_suppl_sm_file = os.path.join(workspace,
-                                            'supplementary_structmap.xml')
-        if not os.path.exists(os.path.dirname(output_suppl_sm_file)):
-            os.makedirs(os.path.dirname(output_suppl_sm_file))
-        with open(output_suppl_sm_file, 'wb+') as outfile:
-            outfile.write(xml_utils.serialize(suppl_structmap))
-        created_files.append(output_suppl_sm_file)
+def _structmap_filename(index, structmap_type):
+    """Return the name of the output file of a structmap.
 
-    print("compile_structmap created files: " + " ".join(created_files))
+    :param index: Index of the structmap in the given structmap types
+    :param structmap_type: Type of structmap
+    :returns: File name
+    """
+    if index == 0:
+        return 'structmap.xml'
+    return encode_path(structmap_type, suffix='-structmap.xml')
 
 
 def create_filesec(all_amd_refs,
                    object_refs,
                    file_properties,
                    supplementary_files,
-                   supplementary_types):
+                   supplementary_types,
+                   deterministic_ids=False,
+                   objid=None):
     """
     Create METS document element tree that contains fileSec element.
 
@@ -214,6 +365,9 @@ def create_filesec(all_amd_refs,
     :param supplementary_files: ID list of supplementary objects.
         Will be populated if supplementary objects exist.
     :param supplementary_types: Supplementary types.
+    :param deterministic_ids: True to derive the file identifiers from
+        the file paths, see siptools.utils.file_identifier()
+    :param objid: Object identifier for deterministic file identifiers
     :returns: A tuple of METS XML Element including file section
               element and a dict of file paths and identifiers
     """
@@ -224,7 +378,9 @@ def create_filesec(all_amd_refs,
         supplementary_files=supplementary_files,
         all_amd_refs=all_amd_refs,
         object_refs=object_refs,
-        file_properties=file_properties)
+        file_properties=file_properties,
+        deterministic_ids=deterministic_ids,
+        objid=objid)
     child_elements.append(filegrp)
 
     # Create file group for supplementary files if they exist
@@ -235,7 +391,9 @@ def create_filesec(all_amd_refs,
             all_amd_refs=all_amd_refs,
             object_refs=object_refs,
             file_properties=file_properties,
-            supplementary_type=supplementary_type)
+            supplementary_type=supplementary_type,
+            deterministic_ids=deterministic_ids,
+            objid=objid)
         child_elements.append(s_filegrp)
 
     filesec = mets.filesec(child_elements=child_elements)
@@ -280,8 +438,8 @@ def create_structmap(filesec,
         default value is "directory".
     :returns: structural map element
     """
-    amdids = get_md_references(all_amd_refs, directory='.')
-    dmdids = get_md_references(all_dmd_refs, directory='.')
+    amdids = sorted_md_ids(get_md_references(all_amd_refs, directory='.'))
+    dmdids = sorted_md_ids(get_md_references(all_dmd_refs, directory='.'))
 
     is_supplementary = False
     if structmap_type == 'Directory-physical':
@@ -330,30 +488,36 @@ def div_structure(filelist,
     """Create div structure for either a directory-based structmap
     or for supplementary files.
 
+    The structure is a flat list of path component tuples. Entries that
+    share a parent div are contiguous in the list, which is guaranteed
+    by the sorted file list for the directory-based structure. This
+    allows create_div() to build the divs with a stack of the currently
+    open divs only.
+
     :param filelist: Sorted list of digital objects (file paths).
     :param supplementary_files: Sorted list of supplementary objects
         (file paths).
     :param supplementary_types: Supplementary types.
     :param is_supplementary: Boolean to indicate whether the structure
         should be for supplemenjtary files or not.
-    :returns: The div structure as a dict like object
+    :returns: The div structure as a list of path component tuples
     """
-    divs = tree()
+    divs = []
     if is_supplementary:
         for supplementary_type in supplementary_types:
             # Supplementary structure is flat, but with one div
             # surrounding the files
-            root_div = divs[SUPPLEMENTARY_TYPES[supplementary_type]]
+            root_div = SUPPLEMENTARY_TYPES[supplementary_type]
             for amd_file in supplementary_files:
                 if supplementary_files[amd_file] == supplementary_type:
-                    add(root_div, [amd_file])
+                    divs.append((root_div, amd_file))
     else:
         # Directory based structure is like a directory tree
         for amd_file in filelist:
             # Do not add supplementary files to the directory based
             # structmap
             if amd_file not in supplementary_files:
-                add(divs, amd_file.split('/'))
+                divs.append(tuple(amd_file.split('/')))
     return divs
 
 
@@ -399,11 +563,14 @@ def create_div(divs,
                file_properties,
                path='',
                is_supplementary=False):
-    """Recursively create fileSec and structmap divs based on directory
-    structure.
+    """Create fileSec and structmap divs based on directory structure.
 
-    :param divs: Current directory or file in directory structure
-                 walkthrough
+    The divs are created iteratively with a stack of the currently open
+    divs, so the depth of the directory structure is not limited by the
+    recursion limit. Entries of `divs` sharing a parent div must be
+    contiguous, see div_structure().
+
+    :param divs: List of path component tuples from div_structure()
     :param parent: Parent element in structMap
     :param filesec: filesec element
     :param all_amd_refs: XML element tree of administrative metadata
@@ -415,39 +582,58 @@ def create_div(divs,
     :param file_ids: Dict with file paths and identifiers.
     :param workspace: Workspace path, required by add_file_div().
     :param file_properties: Dictionary collection of file properties.
-    :param path: Current path in directory structure walkthrough
+    :param path: Path of the parent element in directory structure
     :param is_supplementary: A boolean to indicate if a supplementary
                        structure is expected or not
     :returns: ``None``
     """
-    fptr_list = []
-    property_list = []
-    div_list = []
-    collection = file_properties
-    for div in divs.keys():
-        div_path = os.path.join(path, div)
-        if is_supplementary:
-            collection = supplementary_files
-            # Remove supplementary root div from current div path
-            supplementary_type = div_path.split('/')[0]
-            div_path = div_path[len(supplementary_type) + 1:]
-        # It's a file, lets create file+fptr elements
-        if div_path in collection:
-            fptr = mets.fptr(get_fileid(filesec, div_path, file_ids))
-            div_elem = add_file_div(fptr=fptr,
-                                    properties=file_properties[div_path])
-            if div_elem is not None:
-                property_list.append(div_elem)
-            else:
-                fptr_list.append(fptr)
-
-        # It's not a file, lets create a div element
-        else:
+    # Stack of the open divs, the first one being the given parent. The
+    # names of the open divs below the parent are kept in open_names.
+    stack = [_open_div(parent, path)]
+    open_names = []
+
+    for entry in divs:
+        # Close the divs that are not shared with the current entry
+        depth = 0
+        for open_name, div in zip(open_names, entry):
+            if open_name != div:
+                break
+            depth += 1
+        while len(open_names) > depth:
+            _close_div(stack.pop())
+            open_names.pop()
+
+        for level in range(depth, len(entry)):
+            div = entry[level]
+            current = stack[-1]
+            div_path = os.path.join(current['path'], div)
+            collection = file_properties
+            # Only the root divs of a supplementary structure are
+            # supplementary type divs
+            if is_supplementary and level == 0:
+                collection = supplementary_files
+                # Remove supplementary root div from current div path
+                supplementary_type = div_path.split('/')[0]
+                div_path = div_path[len(supplementary_type) + 1:]
+
+            # It's a file, lets create file+fptr elements
+            if div_path in collection:
+                fptr = mets.fptr(get_fileid(filesec, div_path, file_ids))
+                div_elem = add_file_div(fptr=fptr,
+                                        properties=file_properties[div_path])
+                if div_elem is not None:
+                    current['property_list'].append(div_elem)
+                else:
+                    current['fptr_list'].append(fptr)
+                break
+
+            # It's not a file, lets create a div element
             amdids = get_md_references(all_amd_refs, directory=div_path)
-            dmdsec_id = get_md_references(all_dmd_refs, directory=div_path)
+            dmdsec_id = sorted_md_ids(
+                get_md_references(all_dmd_refs, directory=div_path))
 
             # Some supplementary divs require links to the amdSec
-            if is_supplementary:
+            if is_supplementary and level == 0:
                 try:
                     amdids = get_md_references(
                         read_md_references(
@@ -456,6 +642,7 @@ def create_div(divs,
                         directory='.')
                 except KeyError:
                     pass
+            amdids = sorted_md_ids(amdids)
 
             if structmap_type == 'Directory-physical':
                 div_elem = mets.div(type_attr='directory',
@@ -466,26 +653,41 @@ def create_div(divs,
                 div_elem = mets.div(type_attr=div,
                                     dmdid=dmdsec_id,
                                     admid=amdids)
-            div_list.append(div_elem)
-            create_div(divs=divs[div],
-                       parent=div_elem,
-                       filesec=filesec,
-                       all_amd_refs=all_amd_refs,
-                       all_dmd_refs=all_dmd_refs,
-                       supplementary_files=supplementary_files,
-                       file_ids=file_ids,
-                       structmap_type=structmap_type,
-                       workspace=workspace,
-                       file_properties=file_properties,
-                       path=div_path)
+            current['div_list'].append(div_elem)
+            stack.append(_open_div(div_elem, div_path))
+            open_names.append(div)
+
+    while stack:
+        _close_div(stack.pop())
 
+
+def _open_div(div_elem, path):
+    """Return a stack entry for an open div in create_div().
+
+    :param div_elem: The div element
+    :param path: Path of the div in directory structure
+    :returns: A dict of the div element, its path and the child
+              elements collected for it
+    """
+    return {'div': div_elem,
+            'path': path,
+            'fptr_list': [],
+            'property_list': [],
+            'div_list': []}
+
+
+def _close_div(open_div):
+    """Append the collected child elements to an open div.
+
+    :param open_div: Stack entry from _open_div()
+    """
     # Add fptr list first, then div list
-    for fptr in fptr_list:
-        parent.append(fptr)
-    for div_elem in property_list:
-        parent.append(div_elem)
-    for div_elem in div_list:
-        parent.append(div_elem)
+    for fptr in open_div['fptr_list']:
+        open_div['div'].append(fptr)
+    for div_elem in open_div['property_list']:
+        open_div['div'].append(div_elem)
+    for div_elem in open_div['div_list']:
+        open_div['div'].append(div_elem)
 
 
 def _create_event(
@@ -500,14 +702,23 @@ def _create_event(
     event and agent metadata.
 
     :workspace: The path to the workspace
-    :structmap_type: Type of structmap
+    :structmap_type: Type of structmap, or a list of types
     :root_type: Type of root div
     """
-    if not structmap_type:
+    structmap_types = [current_type for current_type
+                       in _structmap_types(structmap_type) if current_type]
+    if not structmap_types:
         if root_type:
-            structmap_type = root_type
+            structmap_types = [root_type]
         else:
-            structmap_type = 'directory'
+            structmap_types = ['directory']
+
+    if len(structmap_types) == 1:
+        outcome_detail = ("Created METS structural map of type %s"
+                          % structmap_types[0])
+    else:
+        outcome_detail = ("Created METS structural maps of types %s"
+                          % ", ".join(structmap_types))
 
     create_agent(
         workspace=workspace,
@@ -524,8 +735,7 @@ def _create_event(
                  event_detail=("Creation of structural metadata with the "
                                "compile-structmap script"),
                  event_outcome="success",
-                 event_outcome_detail=("Created METS structural map of type %s"
-                                       % structmap_type),
+                 event_outcome_detail=outcome_detail,
                  workspace=workspace,
                  create_agent_file='compile-structmap-agents')
 
@@ -1,14 +1,46 @@
 """Command line tool for creating tar file from SIP directory"""
 
+import collections
+import contextlib
+import fnmatch
+import functools
+import grp
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import pwd
+import stat
 import sys
-import subprocess
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import scandir
+
 import click
 
-from siptools.utils import fsencode_path
+from siptools.utils import get_objectlist, read_md_references
 
 
 click.disable_unicode_literals_warning = True
 
+# Buffer size for reading the files and writing the tar file
+COPY_BUFSIZE = 4 * 1024 * 1024
+
+MANIFEST_ALGORITHMS = ['MD5', 'SHA-1', 'SHA-256', 'SHA-512']
+
+TAR_ENCODING = sys.getfilesystemencoding()
+
+# Compression functions and the sizes of the independently compressed
+# blocks. The compressed blocks are complete gzip members and xz
+# streams, which the standard tools decompress as one file.
+COMPRESSIONS = {
+    'gzip': (lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+             1024 * 1024),
+    'xz': (lambda data: lzma.compress(data, preset=6), 8 * 1024 * 1024),
+}
+
 
 @click.command()
 @click.argument('dir_to_tar', type=click.Path(exists=True))
@@ -22,44 +54,498 @@ click.disable_unicode_literals_warning = True
     help="Pattern for files to be excluded from the package."
          " This option can be repeated. Use single quotes around the pattern"
          " to avoid possible shell expansion.")
-def main(dir_to_tar, tar_filename, exclude):
+@click.option(
+    '--base_path', type=click.Path(exists=True, file_okay=False),
+    default=None,
+    metavar='<BASE PATH>',
+    help="Treat DIR_TO_TAR as the workspace and add only mets.xml, "
+         "signature.sig and the digital objects imported with "
+         "import-object to the TAR file. The digital objects are read "
+         "directly from the base path, so compile-mets --copy_files is "
+         "not needed.")
+@click.option(
+    '--manifest', type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    metavar='<MANIFEST FILE>',
+    help="Write the checksums of the files added to the TAR file to the "
+         "given file, one line per file in the format of md5sum.")
+@click.option(
+    '--manifest_algorithm', type=click.Choice(MANIFEST_ALGORITHMS),
+    default='MD5',
+    metavar='<ALGORITHM>',
+    help="Checksum algorithm for --manifest: MD5, SHA-1, SHA-256 or "
+         "SHA-512. Defaults to MD5.")
+@click.option(
+    '--progress', is_flag=True,
+    help="Print the progress as JSON lines with the number of members "
+         "and bytes added to stderr.")
+@click.option(
+    '--compression', type=click.Choice(sorted(COMPRESSIONS)),
+    default=None,
+    metavar='<COMPRESSION>',
+    help="Compress the TAR file with gzip or xz. The data is compressed "
+         "in independent blocks, which stock gzip and xz tools "
+         "decompress as one file. By default the TAR file is not "
+         "compressed.")
+@click.option(
+    '--jobs', type=click.IntRange(min=1),
+    default=1,
+    metavar='<JOBS>',
+    help="Number of threads used for compressing the blocks with "
+         "--compression. Defaults to 1.")
+# pylint: disable=too-many-arguments
+def main(dir_to_tar, tar_filename, exclude, base_path, manifest,
+         manifest_algorithm, progress, compression, jobs):
     """Create tar file from SIP directory.
 
     DIR_TO_TAR: Directory to be added in the TAR file.
     """
-    return compress(dir_to_tar, tar_filename, exclude)
+    return compress(dir_to_tar, tar_filename, exclude, base_path,
+                    manifest=manifest, manifest_algorithm=manifest_algorithm,
+                    progress=progress_printer() if progress else None,
+                    compression=compression, jobs=jobs)
 
 
-def compress(dir_to_tar, tar_filename, exclude=()):
+# pylint: disable=too-many-arguments
+def compress(dir_to_tar, tar_filename, exclude=(), base_path=None,
+             manifest=None, manifest_algorithm='MD5', progress=None,
+             compression=None, jobs=1):
     """
     Create tar file from SIP directory.
 
+    The directory is added in the order of the file names, with the
+    member names starting with "./" as in ``tar -cf TAR_FILE .``. A
+    relative tar file name is relative to dir_to_tar, and the tar file
+    itself is not added.
+
     :dir_to_tar: Directory to pack in tar package
     :tar_filename: File name of the tar file
-    :exclude: File patterns to use for excluding files.
+    :exclude: File patterns to use for excluding files, as with tar
+    :base_path: If given, dir_to_tar is a workspace and the tar file is
+                created with compress_sip() using this base path
+    :manifest: Path of the checksum manifest to write, or None
+    :manifest_algorithm: Checksum algorithm of the manifest
+    :progress: Function called with the numbers of members and bytes
+               added and the member name after each member, and with
+               None as the name when the tar file is finished
+    :compression: "gzip", "xz" or None for no compression
+    :jobs: Number of threads for compression
+    :returns: 0
     """
-    exclude_opts = []
-    for excl in exclude:
-        exclude_opts.append("--exclude=%s" % (excl))
-    command = ["tar"] + exclude_opts + [
-        "-cvvf", fsencode_path(tar_filename), "."]
+    if base_path is not None:
+        return compress_sip(dir_to_tar, base_path, tar_filename, exclude,
+                            manifest=manifest,
+                            manifest_algorithm=manifest_algorithm,
+                            progress=progress, compression=compression,
+                            jobs=jobs)
 
-    proc = subprocess.Popen(
-        command, cwd=dir_to_tar,
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT, close_fds=True
-    )
+    tar_path = os.path.join(dir_to_tar, tar_filename)
+    write_tar(tar_path, _walk_members(dir_to_tar, tar_path, exclude),
+              manifest=manifest, manifest_algorithm=manifest_algorithm,
+              progress=progress, compression=compression, jobs=jobs)
 
-    proc.communicate()
-    returncode = proc.returncode
+    print("Created tar file: %s" % tar_filename)
+
+    return 0
+
+
+# pylint: disable=too-many-arguments
+def compress_sip(workspace, base_path, tar_filename, exclude=(),
+                 manifest=None, manifest_algorithm='MD5', progress=None,
+                 compression=None, jobs=1):
+    """
+    Create tar file from the METS document and signature in workspace
+    and the digital objects in base path.
+
+    The digital objects are the files listed in
+    import-object-md-references.jsonl. They are streamed to the tar file
+    from the base path, so each object is read only once and no copy of
+    it is made in the workspace. The members are written in the order
+    mets.xml, signature.sig and the digital objects depth first in the
+    order of the file names, each preceded by its parent directories.
+    The member names are the same as in a tar file created from a
+    workspace with copied objects.
 
-    if returncode != 0:
-        raise OSError("Error in creating a TAR file. "
-                      "Return code: %d" % returncode)
+    :workspace: Workspace path containing mets.xml and signature.sig
+    :base_path: Base path of the digital objects
+    :tar_filename: File name of the tar file, relative to workspace
+    :exclude: File patterns to use for excluding files, as with tar
+    :manifest: Path of the checksum manifest to write, or None
+    :manifest_algorithm: Checksum algorithm of the manifest
+    :progress: Function called with the numbers of members and bytes
+               added and the member name after each member, and with
+               None as the name when the tar file is finished
+    :compression: "gzip", "xz" or None for no compression
+    :jobs: Number of threads for compression
+    :returns: 0
+    :raises: IOError if mets.xml is missing from the workspace
+    """
+    mets_path = os.path.join(workspace, 'mets.xml')
+    if not os.path.isfile(mets_path):
+        raise IOError("METS document %s not found." % mets_path)
+
+    members = [(workspace, '.'), (mets_path, './mets.xml')]
+    signature_path = os.path.join(workspace, 'signature.sig')
+    if os.path.isfile(signature_path):
+        members.append((signature_path, './signature.sig'))
+
+    objects = get_objectlist(read_md_references(
+        workspace, "import-object-md-references.jsonl"
+    ))
+    objects = sorted((os.path.normpath(path) for path in objects),
+                     key=lambda path: path.split(os.sep))
+    directories = set()
+    for path in objects:
+        parent = os.path.dirname(path)
+        new_directories = []
+        while parent and parent not in directories:
+            directories.add(parent)
+            new_directories.append(parent)
+            parent = os.path.dirname(parent)
+        for directory in reversed(new_directories):
+            members.append((os.path.join(base_path, directory),
+                            './' + directory))
+        members.append((os.path.join(base_path, path), './' + path))
+
+    members = [(source, name) for (source, name) in members
+               if name == '.' or not _is_excluded(name, exclude)]
+    write_tar(os.path.join(workspace, tar_filename), members,
+              manifest=manifest, manifest_algorithm=manifest_algorithm,
+              progress=progress, compression=compression, jobs=jobs)
 
     print("Created tar file: %s" % tar_filename)
 
-    return returncode
+    return 0
+
+
+# pylint: disable=too-many-arguments
+def write_tar(tar_path, members, manifest=None, manifest_algorithm='MD5',
+              progress=None, compression=None, jobs=1):
+    """
+    Write tar file from the given members.
+
+    The tar file is written in the GNU format, the default of GNU tar,
+    one member at a time, so the memory used does not grow with the
+    number of members. The files are read and the tar file is written
+    with COPY_BUFSIZE buffers. The manifest checksums are calculated
+    from the data while it is written to the tar file, so the files are
+    read only once. The compressed output is the same for any number of
+    jobs.
+
+    :tar_path: Path of the tar file
+    :members: Iterable of source paths and member names
+    :manifest: Path of the checksum manifest to write, or None
+    :manifest_algorithm: Checksum algorithm of the manifest
+    :progress: Function called with the numbers of members and bytes
+               added and the member name after each member, and with
+               None as the name when the tar file is finished
+    :compression: "gzip", "xz" or None for no compression
+    :jobs: Number of threads for compression
+    :raises: IOError if a file changes size while it is read
+    """
+    hardlinks = {}
+    member_count = 0
+    byte_count = 0
+
+    with open(tar_path, 'wb', buffering=COPY_BUFSIZE) as tar_file, \
+            _compressed(tar_file, compression, jobs) as outfile, \
+            _open_manifest(manifest) as manifest_file:
+        for (source, name) in members:
+            tarinfo = _create_tarinfo(source, name, hardlinks)
+            outfile.write(tarinfo.tobuf(tarfile.GNU_FORMAT, TAR_ENCODING,
+                                        'surrogateescape'))
+            if tarinfo.isreg():
+                checksum = _write_data(source, tarinfo.size, outfile,
+                                       manifest_algorithm if manifest
+                                       else None)
+                if manifest_file:
+                    manifest_file.write('%s  %s\n' % (checksum, name))
+                byte_count += tarinfo.size
+            member_count += 1
+            if progress:
+                progress(member_count, byte_count, name)
+
+        # End-of-archive marker and padding of the last record
+        outfile.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        remainder = outfile.tell() % tarfile.RECORDSIZE
+        if remainder:
+            outfile.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+
+    if progress:
+        progress(member_count, byte_count, None)
+
+
+def _compressed(fileobj, compression, jobs):
+    """
+    Wrap a file object for writing compressed data.
+
+    :fileobj: File object to write
+    :compression: "gzip", "xz" or None for no compression
+    :jobs: Number of threads for compression
+    :returns: Context manager of the file object to write to
+    """
+    if compression:
+        return BlockCompressor(fileobj, compression, jobs)
+    return contextlib.nullcontext(fileobj)
+
+
+class BlockCompressor:
+    """
+    Writable file object compressing the data in independent blocks.
+
+    The blocks are compressed in a thread pool and written in order, so
+    the output does not depend on the number of threads. At most two
+    blocks per thread are kept in memory.
+    """
+
+    def __init__(self, fileobj, compression, jobs=1):
+        """
+        :fileobj: File object for the compressed data
+        :compression: Key of COMPRESSIONS
+        :jobs: Number of threads
+        """
+        self.fileobj = fileobj
+        (self._compress, self.block_size) = COMPRESSIONS[compression]
+        self._buffer = bytearray()
+        self._position = 0
+        self._pending = collections.deque()
+        self._max_pending = 2 * jobs
+        self._executor = ThreadPoolExecutor(max_workers=jobs) \
+            if jobs > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        """Write uncompressed data."""
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+
+    def tell(self):
+        """Return the number of uncompressed bytes written."""
+        return self._position
+
+    def close(self):
+        """Compress the remaining data and wait for the blocks."""
+        if self._buffer or not self._position:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self.fileobj.write(self._pending.popleft().result())
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _submit(self, block):
+        """Compress a block or queue it for compression."""
+        if self._executor is None:
+            self.fileobj.write(self._compress(block))
+            return
+        self._pending.append(self._executor.submit(self._compress, block))
+        while len(self._pending) > self._max_pending:
+            self.fileobj.write(self._pending.popleft().result())
+
+
+def _open_manifest(manifest):
+    """
+    Open the manifest file for writing.
+
+    :manifest: Path of the manifest file or None
+    :returns: Context manager of the file, or of None if no path given
+    """
+    if manifest:
+        return open(manifest, 'w')
+    return contextlib.nullcontext()
+
+
+def _create_tarinfo(source, name, hardlinks):
+    """
+    Create tar header of a file. A file with several links, which is
+    already in the tar file, is added as a hard link to its first name.
+
+    :source: Path of the file
+    :name: Member name
+    :hardlinks: Dict of inodes and member names of the files with
+                several links, updated in place
+    :returns: TarInfo object
+    """
+    stat_result = os.lstat(source)
+    mode = stat_result.st_mode
+
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.mode = stat.S_IMODE(mode)
+    tarinfo.uid = stat_result.st_uid
+    tarinfo.gid = stat_result.st_gid
+    tarinfo.uname = _user_name(stat_result.st_uid)
+    tarinfo.gname = _group_name(stat_result.st_gid)
+    tarinfo.mtime = int(stat_result.st_mtime)
+
+    if stat.S_ISREG(mode):
+        inode = (stat_result.st_dev, stat_result.st_ino)
+        if stat_result.st_nlink > 1 and inode in hardlinks:
+            tarinfo.type = tarfile.LNKTYPE
+            tarinfo.linkname = hardlinks[inode]
+        else:
+            tarinfo.type = tarfile.REGTYPE
+            tarinfo.size = stat_result.st_size
+            if stat_result.st_nlink > 1:
+                hardlinks[inode] = name
+    elif stat.S_ISDIR(mode):
+        tarinfo.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(source)
+    elif stat.S_ISFIFO(mode):
+        tarinfo.type = tarfile.FIFOTYPE
+    elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        tarinfo.type = tarfile.CHRTYPE if stat.S_ISCHR(mode) \
+            else tarfile.BLKTYPE
+        tarinfo.devmajor = os.major(stat_result.st_rdev)
+        tarinfo.devminor = os.minor(stat_result.st_rdev)
+    else:
+        raise IOError("Unsupported file type: %s" % source)
+
+    return tarinfo
+
+
+def _write_data(source, size, outfile, algorithm=None):
+    """
+    Write the data of a file to tar file, padded to the tar block size.
+
+    :source: Path of the file
+    :size: Size of the file in the tar header
+    :outfile: Tar file object
+    :algorithm: Checksum algorithm, e.g. "SHA-256", or None
+    :returns: Checksum of the data, or None if no algorithm given
+    :raises: IOError if the file is shorter than the given size
+    """
+    hasher = hashlib.new(algorithm.lower().replace('-', '')) \
+        if algorithm else None
+    remaining = size
+    with open(source, 'rb', buffering=0) as infile:
+        while remaining > 0:
+            data = infile.read(min(remaining, COPY_BUFSIZE))
+            if not data:
+                raise IOError("File changed while it was read: %s" % source)
+            if hasher:
+                hasher.update(data)
+            outfile.write(data)
+            remaining -= len(data)
+
+    remainder = size % tarfile.BLOCKSIZE
+    if remainder:
+        outfile.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    return hasher.hexdigest() if hasher else None
+
+
+@functools.lru_cache(maxsize=None)
+def _user_name(uid):
+    """Return the name of a user, or empty string if it is unknown."""
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return ''
+
+
+@functools.lru_cache(maxsize=None)
+def _group_name(gid):
+    """Return the name of a group, or empty string if it is unknown."""
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return ''
+
+
+def progress_printer(interval=1.0):
+    """
+    Create a progress function for compress(), which prints the progress
+    to stderr as JSON lines. The lines are printed at most once in the
+    given interval, and always when the tar file is finished.
+
+    :interval: Minimum time between the lines in seconds
+    :returns: Progress function
+    """
+    last_time = [0.0]
+
+    def _print_progress(members, size, name):
+        """Print the numbers of members and bytes added."""
+        now = time.monotonic()
+        if name is not None and now - last_time[0] < interval:
+            return
+        last_time[0] = now
+        sys.stderr.write(json.dumps({
+            'members': members, 'bytes': size, 'member': name,
+            'done': name is None}) + '\n')
+
+    return _print_progress
+
+
+def _walk_members(dir_to_tar, tar_path, exclude):
+    """
+    Iterate the members for a tar file of a directory, depth first in
+    the order of the file names. Excluded directories are not descended
+    into and symbolic links are not followed.
+
+    :dir_to_tar: Directory to pack in tar package
+    :tar_path: Path of the tar file, which is skipped
+    :exclude: File patterns to use for excluding files
+    :returns: Generator of source paths and member names
+    """
+    root = os.path.abspath(dir_to_tar)
+    yield (root, '.')
+    for member in _walk_directory(root, './', os.path.abspath(tar_path),
+                                  exclude):
+        yield member
+
+
+def _walk_directory(directory, prefix, tar_path, exclude):
+    """
+    Iterate the members for the contents of a directory recursively.
+
+    :directory: Absolute directory path
+    :prefix: Member name prefix of the directory contents
+    :tar_path: Absolute path of the tar file, which is skipped
+    :exclude: File patterns to use for excluding files
+    :returns: Generator of source paths and member names
+    """
+    for entry in sorted(scandir(directory), key=lambda entry: entry.name):
+        name = prefix + entry.name
+        if entry.path == tar_path or _is_excluded(name, exclude):
+            continue
+        yield (entry.path, name)
+        if entry.is_dir(follow_symlinks=False):
+            for member in _walk_directory(entry.path, name + '/', tar_path,
+                                          exclude):
+                yield member
+
+
+def _is_excluded(name, exclude):
+    """
+    Check whether a tar member is excluded by the given patterns. Like
+    GNU tar, a pattern may match any trailing part of the member name or
+    of the name of its parent directories.
+
+    :name: Member name
+    :exclude: File patterns
+    :returns: True if the member is excluded
+    """
+    if not exclude:
+        return False
+    parts = name.split('/')
+    for end in range(1, len(parts) + 1):
+        for start in range(end):
+            subpath = '/'.join(parts[start:end])
+            if any(fnmatch.fnmatchcase(subpath, pattern)
+                   for pattern in exclude):
+                return True
+    return False
 
 
 if __name__ == '__main__':
@@ -2,20 +2,26 @@
 
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import csv
 import click
 
 import addml
 import lxml.etree as ET
+import xml_helpers.utils
 from siptools.mdcreator import MetsSectionCreator
-from siptools.utils import encode_path
+from siptools.utils import collect_files, encode_path, generate_digest
 
 click.disable_unicode_literals_warning = True
 
+# Size of the sample read for detecting the CSV dialect, also used as
+# the buffer size when opening the CSV files
+CSV_SAMPLE_SIZE = 64 * 1024
+
 
 @click.command()
-@click.argument('filename', type=str)
+@click.argument('filenames', nargs=-1, required=True, type=str)
 @click.option('--workspace', type=click.Path(exists=True),
               default='./workspace/',
               metavar='<WORKSPACE PATH>',
@@ -40,9 +46,22 @@ click.disable_unicode_literals_warning = True
 @click.option('--quot', 'quoting_char', type=str, required=True,
               metavar='<QUOTING CHAR>',
               help="Quoting character used in the CSV file")
+@click.option('--sniff', is_flag=True,
+              help="Detect the delimiter and quoting character of each "
+                   "CSV file from a sample of the file. --delim and --quot "
+                   "are used if they can not be detected")
+@click.option('--include', 'include', type=str, multiple=True,
+              metavar='<GLOB>',
+              help="File name pattern of the CSV files to include from "
+                   "the given directories. May be used multiple times. "
+                   "Defaults to *.csv")
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              metavar='<JOBS>',
+              help="Number of processes for reading the CSV headers. "
+                   "Defaults to 1")
 # pylint: disable=too-many-arguments
 def main(**kwargs):
-    """Tool for creating ADDML metadata for a CSV file. The
+    """Tool for creating ADDML metadata for CSV files. The
     ADDML metadata is written to <hash>-ADDML-amd.xml
     METS XML file in the workspace directory. The ADDML
     techMD reference is written to md-references.jsonl.
@@ -50,13 +69,14 @@ def main(**kwargs):
     just the new CSV file name is appended to the existing
     metadata.
 
-    FILENAME: Relative path to the file from current directory or from
-              --base_path.
+    FILENAMES: Relative paths to the files or directories from current
+               directory or from --base_path. The CSV files matching
+               --include are read from the directories.
     """
     base_path = kwargs["base_path"]
-    filename = kwargs["filename"]
-    if not os.path.exists(os.path.join(base_path, filename)):
-        raise click.UsageError("File does not exist")
+    for filename in kwargs["filenames"]:
+        if not os.path.exists(os.path.join(base_path, filename)):
+            raise click.UsageError("File does not exist: %s" % filename)
 
     create_addml(**kwargs)
     return 0
@@ -81,6 +101,10 @@ def _attribute_values(given_params):
         "quoting_char": given_params["quoting_char"],
         "flatfile_name": None,
         "stdout": False,
+        "filenames": (),
+        "include": ("*.csv",),
+        "jobs": 1,
+        "sniff": False,
     }
     for key in given_params:
         if given_params[key]:
@@ -97,10 +121,17 @@ def _attribute_values(given_params):
 
 def create_addml(**kwargs):
     """
-    Create ADDML metadata for a CSV file.
+    Create ADDML metadata for CSV files.
+
+    The headers of the CSV files are read in parallel processes, if jobs
+    is greater than one. Files with identical ADDML definitions share
+    one metadata file, and all metadata is written with one write of the
+    references.
 
     :kwargs: Given arguments
              filename: CSV file name
+             filenames: CSV file or directory names, used instead of
+                        filename
              workspace: Workspace path
              base_path: Base path of the digital objects
              isheader: True if the CSV file has a header line
@@ -108,14 +139,57 @@ def create_addml(**kwargs):
              delimiter: Delimiter used in CSV file
              record_separator: Record separator of CSV file
              quoting_char: Quoting character of CSV file
+             include: File name patterns of the CSV files in the
+                      directories
+             jobs: Number of processes for reading the headers
+             sniff: True for detecting the delimiter and quoting
+                    character of each file
              stdout: True for printing the output to stdout
     """
     attributes = _attribute_values(kwargs)
-    creator = AddmlCreator(attributes["workspace"], attributes["filename"])
-    creator.add_addml_md(attributes)
+    filenames = attributes["filenames"] or (attributes["filename"],)
+
+    file_attributes = [
+        _attribute_values(dict(kwargs, filename=filename))
+        for filename in collect_files(
+            filenames, attributes["base_path"], attributes["include"])
+    ]
+    headers = read_csv_headers(file_attributes, attributes["jobs"])
+
+    creator = AddmlCreator(attributes["workspace"])
+    for (file_attrs, header) in zip(file_attributes, headers):
+        creator.add_addml_md(file_attrs, header)
     creator.write()
 
 
+def read_csv_headers(file_attributes, jobs=1):
+    """
+    Read the headers of CSV files. If the dialects of the files are
+    detected, the detected delimiters and quoting characters are updated
+    to the attribute dicts.
+
+    :file_attributes: List of attribute dicts of the CSV files, as given
+                      to read_csv_header()
+    :jobs: Number of processes for reading the headers
+    :returns: List of headers in the order of the files
+    :raises: ValueError naming the CSV file, if a header can not be read
+    """
+    if jobs > 1 and len(file_attributes) > 1:
+        chunksize = max(1, min(256, len(file_attributes) // (jobs * 4)))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_read_csv_header, file_attributes,
+                                        chunksize=chunksize))
+    else:
+        results = [_read_csv_header(attributes)
+                   for attributes in file_attributes]
+
+    headers = []
+    for (attributes, (header, dialect)) in zip(file_attributes, results):
+        attributes.update(dialect)
+        headers.append(header)
+    return headers
+
+
 class AddmlCreator(MetsSectionCreator):
     """Subclass of MetsSectionCreator, which generates ADDML metadata
     for CSV files.
@@ -126,13 +200,16 @@ class AddmlCreator(MetsSectionCreator):
         Initialize ADDML creator.
 
         :workspace: Output path
+        :filerel: Path of the file for the references, if only one file
+                  is added
         """
         super().__init__(workspace)
         self.etrees = {}
         self.filenames = {}
+        self.filerels = {}
         self.filerel = filerel
 
-    def add_addml_md(self, attributes):
+    def add_addml_md(self, attributes, header=None):
 
         """Append metadata to etrees and filenames dicts.
         All the metadata given as the parameters uniquely defines
@@ -151,24 +228,32 @@ class AddmlCreator(MetsSectionCreator):
                      charset: Charset used in the CSV file
                      record_separator: Char used for separating CSV file fields
                      quoting_char: Quotation char used in the CSV file
+                     filename: Path of the file for the references, if
+                               not given in the constructor
+        :header: Header of the CSV file, if already read
         :returns: None
         """
-        header = csv_header(attributes)
+        if header is None:
+            header = csv_header(attributes)
         headerstr = attributes["delimiter"].join(header)
         key = (attributes["delimiter"], headerstr, attributes["charset"],
                attributes["record_separator"], attributes["quoting_char"])
+        filerel = self.filerel or attributes.get("filename") or \
+            attributes["csv_file"]
 
         # If similar metadata already exists,
         # only append filename to self.filenames
         if key in self.etrees:
             self.filenames[key].append(attributes["csv_file"])
+            self.filerels[key].append(filerel)
             return
 
         # If similar metadata does not exist, create it
-        metadata = create_addml_metadata(**attributes)
+        metadata = create_addml_metadata(header=header, **attributes)
 
         self.etrees[key] = metadata
         self.filenames[key] = [attributes["csv_file"]]
+        self.filerels[key] = [filerel]
 
     # pylint: disable=too-many-arguments
     def write(self, mdtype="OTHER", mdtypeversion="8.3", othermdtype="ADDML",
@@ -177,29 +262,40 @@ class AddmlCreator(MetsSectionCreator):
         """
         Write all the METS XML files and md-reference file.
         Base class write is overwritten to handle the references
-        correctly and add flatFile fields to METS XML files.
+        correctly and add flatFile elements to METS XML files. The
+        flatFile elements are added to the XML tree before it is
+        serialized, or to the tree of an existing METS XML file.
         """
 
         for key in self.etrees:
             metadata = self.etrees[key]
             filenames = self.filenames[key]
 
-            # Create METS XML file
-            amd_id, amd_fname = \
-                self.write_md(metadata, mdtype, mdtypeversion, othermdtype)
+            # The digest is generated without the flatFile elements, so
+            # that files with similar metadata share the METS XML file
+            digest = generate_digest(metadata)
+            amd_fname = os.path.join(
+                self.workspace,
+                encode_path("%s-%s-amd.xml" % (digest, othermdtype)))
+
+            if os.path.exists(amd_fname):
+                # Add the flatFile elements to the existing METS XML file
+                parser = ET.XMLParser(remove_blank_text=True)
+                mets_root = ET.parse(amd_fname, parser=parser).getroot()
+                add_flat_files(mets_root, filenames)
+                with open(amd_fname, 'wb') as outfile:
+                    outfile.write(xml_helpers.utils.serialize(mets_root))
+                amd_id = "_%s" % digest
+            else:
+                # Create METS XML file with all the flatFile elements
+                add_flat_files(metadata, filenames)
+                amd_id, amd_fname = self.write_md(
+                    metadata, mdtype, mdtypeversion, othermdtype,
+                    digest=digest)
 
             # Add all the files to references
-            for filename in filenames:
-                self.add_reference(
-                    amd_id, self.filerel if self.filerel else filename
-                )
-
-            # Append all the flatFile elements to the METS XML file
-            append = [
-                flat_file_str(encode_path(filename), "ref001")
-                for filename in filenames
-            ]
-            append_lines(amd_fname, "<addml:flatFiles>", append)
+            for filerel in self.filerels[key]:
+                self.add_reference(amd_id, filerel)
 
         # Write md-references
         self.write_references(ref_file=ref_file)
@@ -208,94 +304,143 @@ class AddmlCreator(MetsSectionCreator):
         self.__init__(self.workspace)
 
 
-def flat_file_str(fname, def_ref):
+def add_flat_files(root, filenames, def_ref="ref001"):
     """
-    Return addml:flatFile xml element as a string,
-    which can be appended to the xml file.
+    Add addml:flatFile elements to the addml:flatFiles element of the
+    given XML tree, after the existing flatFile elements. Files that
+    already have a flatFile element are skipped.
 
-    :fname: Name attribute of the flatFile element
-    :def_ref: definitionReference of the flatFile element
-    :returns: flatFile element string
+    :root: ADDML metadata or METS XML root element
+    :filenames: Names of the files
+    :def_ref: definitionReference of the flatFile elements
+    :returns: None
     """
+    flat_files = root.find(".//" + addml.addml_ns("flatFiles"))
+    existing = flat_files.findall(addml.addml_ns("flatFile"))
+    names = {elem.get("name") for elem in existing}
+    index = flat_files.index(existing[-1]) + 1 if existing else 0
 
-    flat_file = '<addml:flatFile name="{}" definitionReference="{}"/>\n'.\
-        format(fname, def_ref)
-
-    return flat_file
+    for filename in filenames:
+        name = encode_path(filename)
+        if name in names:
+            continue
+        names.add(name)
+        flat_files.insert(
+            index, addml.definition_elems("flatFile", name, def_ref))
+        index += 1
 
 
 def _open_csv_file(file_path, charset):
     """
-    Open the file in mode dependent on the python version.
+    Open the CSV file for the csv module.
 
     :file_path: CSV file path
     :charset: Charset of the CSV file
     :returns: handle to the newly-opened file
     :raises: IOError if the file cannot be read
     """
-    return open(file_path, encoding=charset)
+    return open(file_path, encoding=charset, newline='',
+                buffering=CSV_SAMPLE_SIZE)
 
 
-def csv_header(attributes):
+def sniff_csv_dialect(csv_file, delimiter, quoting_char):
     """
-    Returns header of CSV file if there is one.
-    Otherwise generates a header and returns it
+    Detect the delimiter and quoting character of a CSV file from a
+    sample at the beginning of the file. The file is rewound after
+    reading the sample.
+
+    :csv_file: Open CSV file
+    :delimiter: Delimiter used if it can not be detected
+    :quoting_char: Quoting character used if the sample has no quoted
+                   fields
+    :returns: Dict of delimiter and quoting_char
+    """
+    sample = csv_file.read(CSV_SAMPLE_SIZE)
+    csv_file.seek(0)
+    # Leave out the last line, which may be cut in the middle
+    if len(sample) == CSV_SAMPLE_SIZE and '\n' in sample:
+        sample = sample[:sample.rindex('\n') + 1]
+    try:
+        dialect = csv.Sniffer().sniff(sample)
+    except csv.Error:
+        return {"delimiter": delimiter, "quoting_char": quoting_char}
+    # The sniffer gives a double quote also for samples without quotes
+    if not dialect.quotechar or dialect.quotechar not in sample:
+        return {"delimiter": dialect.delimiter, "quoting_char": quoting_char}
+    return {"delimiter": dialect.delimiter,
+            "quoting_char": dialect.quotechar}
+
+
+def _read_csv_header(attributes):
+    """
+    Read the header of a CSV file with read_csv_header(). The errors are
+    raised as ValueErrors naming the file, also from the worker processes
+    of read_csv_headers().
+
+    :attributes: Attributes as given to read_csv_header()
+    :returns: Tuple of header and dialect as returned by read_csv_header()
+    :raises: ValueError if the header can not be read
+    """
+    try:
+        return read_csv_header(attributes)
+    except StopIteration:
+        raise ValueError("Failed to read the header of CSV file %s: The "
+                         "file is empty" % attributes["csv_file"]) from None
+    except (ValueError, LookupError, OSError, csv.Error) as error:
+        raise ValueError("Failed to read the header of CSV file %s: %s" % (
+            attributes["csv_file"], error)) from error
+
+
+def read_csv_header(attributes):
+    """
+    Returns header of CSV file and the dialect used for reading it. The
+    header is generated, if the file does not have one.
+
+    The dialect is given to the CSV reader as parameters instead of
+    registering it, and the attributes are not modified, so headers can
+    be read concurrently.
 
     :attributes: The following keys:
                  headername: Default header name if file does not have header
                  csv_file: CSV file path
                  delimiter: Field delimiter in CSV
+                 quoting_char: Quotation char used in the CSV file
                  charset: Character encoding of CSV file
                  isheader: True id file has a header, False otherwise
-                 returns: Header list of CSV columns
+                 sniff: True for detecting the delimiter and quoting
+                        character from the file
+    :returns: Tuple of header list of CSV columns and dict of delimiter
+              and quoting_char used
     """
-    attributes["headername"] = attributes.get("headername", "header")
-    csv_file = _open_csv_file(attributes["csv_file"], attributes["charset"])
-    csv.register_dialect(
-        "new_dialect",
-        # 'delimiter' accepts only byte strings on Python 2 and
-        # only Unicode strings on Python 3
-        delimiter=str(attributes["delimiter"])
-    )
-
-    first_row = next(csv.reader(csv_file, dialect="new_dialect"))
-    header = first_row
-    csv_file.close()
+    headername = attributes.get("headername", "header")
+    dialect = {"delimiter": attributes["delimiter"],
+               "quoting_char": attributes.get("quoting_char")}
+
+    with _open_csv_file(attributes["csv_file"],
+                        attributes["charset"]) as csv_file:
+        if attributes.get("sniff"):
+            dialect = sniff_csv_dialect(csv_file, **dialect)
+        params = {"delimiter": str(dialect["delimiter"])}
+        if dialect["quoting_char"] and len(dialect["quoting_char"]) == 1:
+            params["quotechar"] = dialect["quoting_char"]
+        header = next(csv.reader(csv_file, **params))
 
     if not attributes["isheader"]:
-        header_count = len(header)
-        header = []
-        for i in range(header_count):
-            header.append("{}{}".format(attributes["headername"], i + 1))
+        header = ["{}{}".format(headername, i + 1)
+                  for i in range(len(header))]
 
-    return header
+    return (header, dialect)
 
 
-def append_lines(fname, xml_elem, append):
-    """Append all the lines in list append to file fname below
-    the line with xml_elem.
-
-    :fname: File name
-    :xml_elem: Element below which to append
-    :append: List of lines to append
-    :returns: None
+def csv_header(attributes):
     """
+    Returns header of CSV file if there is one.
+    Otherwise generates a header and returns it
 
-    # Read all the lines into memory
-    with open(fname) as f_in:
-        lines = f_in.readlines()
-
-    # Overwrite the file appending line_content
-    with open(fname, 'w') as f_out:
-
-        for line in lines:
-            f_out.write(line)
-
-            if line.strip() == xml_elem:
-                indent = len(line) - len(line.lstrip()) + 2
-
-                for new_line in append:
-                    f_out.write(" " * indent + new_line)
+    :attributes: Attributes as given to read_csv_header()
+    :returns: Header list of CSV columns
+    """
+    return read_csv_header(attributes)[0]
 
 
 # pylint: disable=too-many-locals
@@ -321,10 +466,11 @@ def create_addml_metadata(**attributes):
                  charset: Charset used in the CSV file
                  record_separator: Char used for separating CSV file fields
                  quoting_char: Quotation char used in the CSV file
+                 header: Header of the CSV file, if already read
     :returns: ADDML metadata XML element
     """
     attributes = _attribute_values(attributes)
-    headers = csv_header(attributes)
+    headers = attributes.get("header") or csv_header(attributes)
 
     description = ET.Element(addml.addml_ns('description'))
     reference = ET.Element(addml.addml_ns('reference'))
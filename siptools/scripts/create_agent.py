@@ -12,6 +12,11 @@ from siptools.xml.premis import PREMIS_AGENT_TYPES
 
 click.disable_unicode_literals_warning = True
 
+# Agent collection file suffixes. Agents are appended to the JSON lines
+# file; older versions wrote a JSON list.
+AGENT_FILE_SUFFIX = '-AGENTS-amd.jsonl'
+LEGACY_AGENT_FILE_SUFFIX = '-AGENTS-amd.json'
+
 
 @click.command()
 @click.argument('agent_name', required=True, type=str)
@@ -46,15 +51,15 @@ click.disable_unicode_literals_warning = True
 @click.option('--create_agent_file',
               type=str, required=True,
               metavar='<CREATE AGENT FILE>',
-              help=('The name of the JSON file that collects all agents '
-                    'related to the event in question'))
+              help=('The name of the JSON lines file that collects all '
+                    'agents related to the event in question'))
 # pylint: disable=too-many-arguments
 def main(**kwargs):
     """The script collects provenance metadata for the package. The
     metadata consist of an agent and its relation to an event.  The
     script collects the metadata and the linking information for the
-    event to a JSON file, that is read by the subsequent premis-event
-    script.
+    event to a JSON lines file, that is read by the subsequent
+    premis-event script.
 
     If used, this script must be run prior to the premis-event script,
     since no actual XML data is written in this script and the agent
@@ -113,11 +118,12 @@ def create_agent(**kwargs):
     The script collects provenance metadata for the package. The metadata
     consists of information about the agent and linking information to
     the event that the agent relates to. The result of this function is
-    a JSON file containing metadata about the agent and its role in
-    relation to the event.
-    If the given JSON file exists, the new agent metadata is appended
-    to the existing data, allowing for multiple agents to be related to
-    the same event.
+    a JSON lines file containing metadata about the agent and its role
+    in relation to the event.
+    The new agent metadata is appended as a line to the file, allowing
+    for multiple agents to be related to the same event. The existing
+    agents are not read, so collecting agents takes linear time and
+    concurrent writers do not overwrite each other.
 
     :kwargs: Given arguments
              agent_name: agent name
@@ -150,17 +156,11 @@ def create_agent(**kwargs):
 
     output_path = os.path.join(
         attributes["workspace"],
-        attributes["create_agent_file"] + '-AGENTS-amd.json')
-
-    agents_list = []
-    if os.path.exists(output_path):
-        with open(output_path) as in_file:
-            agents_list = json.load(in_file)
+        attributes["create_agent_file"] + AGENT_FILE_SUFFIX)
 
-    agents_list.append(agent_dict)
-
-    with open(output_path, 'w') as outfile:
-        json.dump(agents_list, outfile, indent=4)
+    # The line is written with one write call
+    with open(output_path, 'a') as outfile:
+        outfile.write(json.dumps(agent_dict) + '\n')
 
     print(
         "Collected agent metadata with identifier %s" %
@@ -169,6 +169,44 @@ def create_agent(**kwargs):
     return attributes["agent_identifier"][1]
 
 
+def agent_files(workspace, create_agent_file):
+    """
+    Return the existing agent collection files of an event.
+
+    :workspace: Workspace path
+    :create_agent_file: The name of the agent collection
+    :returns: List of paths of the JSON lines file and the JSON file of
+              older versions, if they exist
+    """
+    paths = [os.path.join(workspace, create_agent_file + suffix)
+             for suffix in (AGENT_FILE_SUFFIX, LEGACY_AGENT_FILE_SUFFIX)]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def read_agents(workspace, create_agent_file):
+    """
+    Iterate the agents collected by create_agent(). Identical agents
+    collected several times are given once.
+
+    :workspace: Workspace path
+    :create_agent_file: The name of the agent collection
+    :returns: Generator of agent dicts
+    """
+    seen = set()
+    for path in agent_files(workspace, create_agent_file):
+        with open(path) as in_file:
+            if path.endswith(LEGACY_AGENT_FILE_SUFFIX):
+                agents = json.load(in_file)
+            else:
+                agents = (json.loads(line) for line in in_file
+                          if line.strip())
+            for agent in agents:
+                key = json.dumps(agent, sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    yield agent
+
+
 if __name__ == '__main__':
     RETVAL = main()  # pylint: disable=no-value-for-parameter
     sys.exit(RETVAL)
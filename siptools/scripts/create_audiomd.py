@@ -16,6 +16,13 @@ FILEDATA_KEYS = ['audio_data_encoding', 'bits_per_sample',
 
 AUDIOINFO_KEYS = ['duration', 'num_channels']
 
+CODEC_KEYS = ['codec_creator_app', 'codec_creator_app_version',
+              'codec_name', 'codec_quality']
+
+# Stream metadata keys used in the AudioMD metadata, in the order of the
+# normalized metadata keys
+AUDIOMD_KEYS = FILEDATA_KEYS + CODEC_KEYS + AUDIOINFO_KEYS
+
 ALLOW_UNAV = ['audio_data_encoding', 'codec_creator_app',
               'codec_creator_app_version', 'codec_name',
               'duration', 'num_channels']
@@ -72,31 +79,48 @@ class AudiomdCreator(MetsSectionCreator):
     files.
     """
 
-    def add_audiomd_md(self, filepath, filerel=None):
+    def __init__(self, workspace):
+        """
+        Initialize AudioMD creator.
+
+        :workspace: Output path
+        """
+        super().__init__(workspace)
+        self.etrees = {}
+        self.filerels = {}
+
+    def add_audiomd_md(self, filepath, filerel=None, streams=None):
         """Create audioMD metadata for a audio file and append it
-        to self.md_elements.
+        to self.etrees and self.filerels.
 
         If a file is not a video container, then the audio stream metadata is
         processed in file level. Video container includes streams which need
         to be processed separately one at a time.
 
+        The streams are grouped by the normalized key of the stream
+        metadata used in AudioMD, so that the AudioMD metadata of each
+        distinct key is created and written only once, and only the
+        references are added for the other streams.
+
         :filepath: Audio file path
         :filerel: Audio file path relative to base path
+        :streams: Metadata dict of streams, if already read
         """
-
-        # Create audioMD metadata
-        audiomd_dict = create_audiomd_metadata(
-            filepath, filerel, self.workspace
-        )
-
-        if '0' in audiomd_dict and len(audiomd_dict) == 1:
-            self.add_md(metadata=audiomd_dict['0'],
-                        filename=(filerel if filerel else filepath))
-        else:
-            for index, audio in audiomd_dict.items():
-                self.add_md(metadata=audio,
-                            filename=(filerel if filerel else filepath),
-                            stream=index)
+        audiomd_keys = audiomd_stream_keys(
+            filepath, filerel, self.workspace, streams=streams)
+        if audiomd_keys is None:
+            return
+
+        # A file with only one stream is referenced in file level
+        if '0' in audiomd_keys and len(audiomd_keys) == 1:
+            audiomd_keys = {None: audiomd_keys['0']}
+
+        for index, key in audiomd_keys.items():
+            if key not in self.etrees:
+                self.etrees[key] = _audiomd_element(key)
+                self.filerels[key] = []
+            self.filerels[key].append(
+                (filerel if filerel else filepath, index))
 
     # pylint: disable=too-many-arguments
     def write(self, mdtype="OTHER", mdtypeversion="2.0",
@@ -104,12 +128,21 @@ class AudiomdCreator(MetsSectionCreator):
               file_metadata_dict=None,
               ref_file="create-audiomd-md-references.jsonl"):
         """
-        Write AudioMD metadata.
+        Write AudioMD metadata. Base class write is overwritten to write
+        each distinct AudioMD metadata once and add the references of all
+        the streams sharing it.
         """
-        super().write(
-            mdtype=mdtype, mdtypeversion=mdtypeversion,
-            othermdtype=othermdtype, ref_file=ref_file
-        )
+        for key, metadata in self.etrees.items():
+            md_id, _ = self.write_md(metadata, mdtype, mdtypeversion,
+                                     othermdtype=othermdtype)
+            for (filename, stream) in self.filerels[key]:
+                self.add_reference(md_id, filename, stream)
+
+        # Write md-references
+        self.write_references(ref_file=ref_file)
+
+        # Clear etrees and filerels
+        self.__init__(self.workspace)
 
 
 def create_audiomd_metadata(filename, filerel=None, workspace=None,
@@ -122,33 +155,60 @@ def create_audiomd_metadata(filename, filerel=None, workspace=None,
     :streams: Metadata dict of streams. Will be created if None.
     :returns: Dict of AudioMD XML sections.
     """
+    audiomd_keys = audiomd_stream_keys(filename, filerel, workspace, streams)
+    if audiomd_keys is None:
+        return None
+
+    return {index: _audiomd_element(key)
+            for index, key in audiomd_keys.items()}
+
+
+def audiomd_stream_keys(filename, filerel=None, workspace=None,
+                        streams=None):
+    """Create the normalized AudioMD metadata keys of the audio streams
+    of a file. Streams with equal keys have identical AudioMD metadata.
+
+    :filename: Audio file path
+    :filerel: Audio file path relative to base path
+    :workspace: Workspace path
+    :streams: Metadata dict of streams. Will be created if None.
+    :returns: Dict of metadata keys by the stream indexes, or None if
+              the file has no audio streams
+    """
     if streams is None:
         (streams, _, _) = scrape_file(filepath=filename,
                                       filerel=filerel,
                                       workspace=workspace,
                                       skip_well_check=True)
 
-    audiomd_dict = {}
+    audiomd_keys = {}
     for index, stream_md in streams.items():
         if stream_md['stream_type'] != 'audio':
             continue
         stream_md = fix_missing_metadata(stream_md, filename, ALLOW_UNAV,
                                          ALLOW_ZERO)
         stream_md = _fix_data_rate(stream_md)
-        file_data_elem = _get_file_data(stream_md)
-        audio_info_elem = _get_audio_info(stream_md)
-
-        audiomd_elem = audiomd.create_audiomd(
-            file_data=file_data_elem,
-            audio_info=audio_info_elem
-        )
-        audiomd_dict[str(index)] = audiomd_elem
+        audiomd_keys[str(index)] = tuple(
+            stream_md[key] for key in AUDIOMD_KEYS)
 
-    if not audiomd_dict:
+    if not audiomd_keys:
         print('The file has no audio streams. No AudioMD metadata created.')
         return None
 
-    return audiomd_dict
+    return audiomd_keys
+
+
+def _audiomd_element(key):
+    """Creates the AudioMD XML section of a normalized metadata key.
+
+    :key: Metadata key tuple of the values of AUDIOMD_KEYS
+    :returns: AudioMD XML section
+    """
+    stream_md = dict(zip(AUDIOMD_KEYS, key))
+    return audiomd.create_audiomd(
+        file_data=_get_file_data(stream_md),
+        audio_info=_get_audio_info(stream_md)
+    )
 
 
 def _fix_data_rate(stream_dict):
@@ -185,10 +245,7 @@ def _get_file_data(stream_dict):
         camel_key = keyparts[0] + ''.join(x.title() for x in keyparts[1:])
         params[camel_key] = stream_dict[key]
 
-    compression = (stream_dict['codec_creator_app'],
-                   stream_dict['codec_creator_app_version'],
-                   stream_dict['codec_name'],
-                   stream_dict['codec_quality'])
+    compression = [stream_dict[key] for key in CODEC_KEYS]
 
     params['compression'] = audiomd.amd_compression(*compression)
 
@@ -1,14 +1,17 @@
 """Command line tool for creating MIX metadata."""
 
+import glob
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 
 import nisomix
 from file_scraper.defaults import UNAV
 from siptools.mdcreator import MetsSectionCreator
-from siptools.utils import scrape_file
+from siptools.utils import (collect_files, load_scraper_json,
+                            scrape_file, scraper_json_files)
 
 click.disable_unicode_literals_warning = True
 
@@ -16,6 +19,11 @@ SAMPLES_PER_PIXEL = {'1': '1', 'L': '1', 'P': '1', 'RGB': '3', 'YCbCr': '3',
                      'LAB': '3', 'HSV': '3', 'RGBA': '4', 'CMYK': '4',
                      'I': '1', 'F': '1'}
 
+# Stream metadata keys used in the MIX metadata, in the order of the
+# normalized metadata keys
+MIX_KEYS = ['compression', 'byte_order', 'icc_profile_name', 'colorspace',
+            'width', 'height', 'bps_value', 'bps_unit', 'samples_per_pixel']
+
 
 class MixGenerationError(ValueError):
     """Exception raised when mix metadata generation fails."""
@@ -25,12 +33,12 @@ class MixGenerationError(ValueError):
         self.filename = filename
 
     def __str__(self):
-        return self.message + self.filename
+        return super().__str__() + self.filename
 
 
 @click.command()
 @click.argument(
-    'filename', type=str)
+    'filenames', nargs=-1, type=str)
 @click.option(
     '--workspace', type=click.Path(exists=True),
     default='./workspace/',
@@ -42,58 +50,185 @@ class MixGenerationError(ValueError):
     metavar='<BASE PATH>',
     help="Source base path of digital objects. If used, give path to "
          "the file in relation to this base path.")
-def main(filename, workspace, base_path):
-    """Write MIX metadata for an image file.
-
-    FILENAME: Relative path to the file from current directory or from
-              --base_path.
+@click.option(
+    '--imported', is_flag=True,
+    help="Create MIX metadata for all image files imported to the "
+         "workspace with import-object")
+@click.option(
+    '--include', 'include', type=str, multiple=True,
+    metavar='<GLOB>',
+    help="File name pattern of the image files to include from the "
+         "given directories. May be used multiple times. Defaults to *")
+@click.option(
+    '--jobs', type=click.IntRange(min=1), default=1,
+    metavar='<JOBS>',
+    help="Number of processes for reading the stream metadata. "
+         "Defaults to 1")
+# pylint: disable=too-many-arguments
+def main(filenames, workspace, base_path, imported, include, jobs):
+    """Write MIX metadata for image files.
+
+    FILENAMES: Relative paths to the files, directories or glob patterns
+               from current directory or from --base_path. The files
+               matching --include are read from the directories.
     """
-    if not os.path.exists(os.path.join(base_path, filename)):
-        raise click.UsageError("File does not exist")
-
-    create_mix(filename, workspace, base_path)
+    if not filenames and not imported:
+        raise click.UsageError("Give FILENAMES or --imported")
+    for filename in filenames:
+        path = os.path.join(base_path, filename)
+        if not os.path.exists(path) and not (
+                glob.has_magic(filename) and glob.glob(path)):
+            raise click.UsageError("File does not exist: %s" % filename)
+
+    create_mix(filenames=filenames, workspace=workspace,
+               base_path=base_path, imported=imported,
+               include=include or ("*",), jobs=jobs)
 
     return 0
 
 
-def create_mix(filename, workspace="./workspace/", base_path="."):
+# pylint: disable=too-many-arguments
+def create_mix(filename=None, workspace="./workspace/", base_path=".",
+               filenames=(), imported=False, include=("*",), jobs=1):
     """
-    Write MIX metadata for an image file.
+    Write MIX metadata for image files.
+
+    The stream metadata of the files imported with import_object is read
+    from the scraper JSON files, and other files are scraped. The stream
+    metadata is read in parallel processes, if jobs is greater than one.
+    Files that are not images are skipped and reported, and all metadata
+    is written with one write of the references. No metadata is written,
+    if the metadata of a file can not be created.
 
     :filename: Image file path relative to base path
     :workspace: Workspace path
     :base_path: Base path
+    :filenames: Image files, directories or glob patterns relative to
+                base path, used with or instead of filename
+    :imported: True for including all files imported to the workspace
+    :include: File name patterns of the image files in the directories
+    :jobs: Number of processes for reading the stream metadata
+    :raises: MixGenerationError naming the files whose MIX metadata can
+             not be created
     """
+    filenames = tuple(filenames)
+    if filename is not None:
+        filenames = (filename,) + filenames
 
-    filerel = os.path.normpath(filename)
-    filepath = os.path.normpath(os.path.join(base_path, filename))
+    json_files = scraper_json_files(workspace)
+    filerels = list(collect_files(filenames, base_path, include))
+    if imported:
+        filerels += sorted(set(json_files) - set(filerels))
+
+    files = [(os.path.normpath(os.path.join(base_path, filerel)),
+              json_files.get(filerel))
+             for filerel in filerels]
+    all_streams = read_image_streams(files, jobs)
 
     creator = MixCreator(workspace)
-    creator.add_mix_md(filepath, filerel)
+    failed = []
+    for (filerel, (filepath, _), streams) in zip(filerels, files,
+                                                 all_streams):
+        if not is_image(streams):
+            print("This is not an image file. No MIX metadata created: "
+                  "%s" % filerel)
+            continue
+        try:
+            creator.add_mix_md(filepath, filerel, streams=streams)
+        except MixGenerationError as error:
+            # The errors name the files themselves
+            failed.append(str(error))
+    if failed:
+        raise MixGenerationError(
+            "MIX metadata could not be created for %d file(s):\n"
+            % len(failed), "\n".join(failed))
     creator.write()
 
 
+def read_image_streams(files, jobs=1):
+    """
+    Read the stream metadata of files. The metadata is loaded from the
+    scraper JSON file, if given, and the file is scraped otherwise.
+
+    :files: List of tuples of the file path and the scraper JSON file
+            path or None
+    :jobs: Number of processes for reading the metadata
+    :returns: List of stream metadata dicts in the order of the files
+    """
+    if jobs > 1 and len(files) > 1:
+        chunksize = max(1, min(256, len(files) // (jobs * 4)))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(_read_streams, files,
+                                     chunksize=chunksize))
+    return [_read_streams(file_) for file_ in files]
+
+
+def _read_streams(file_):
+    """Read the stream metadata of a (filepath, json_name) tuple. The
+    errors are raised as ValueErrors naming the file.
+    """
+    (filepath, json_name) = file_
+    try:
+        if json_name:
+            return load_scraper_json(json_name)
+        (streams, _, _) = scrape_file(filepath=filepath,
+                                      skip_well_check=True,
+                                      skip_json=True)
+    except (ValueError, OSError) as error:
+        raise ValueError("Failed to read the stream metadata of %s: %s" % (
+            filepath, error)) from error
+    return streams
+
+
+def is_image(streams):
+    """Return True if all the given streams are images."""
+    return bool(streams) and all(
+        stream_md['stream_type'] == 'image'
+        for stream_md in streams.values())
+
+
 class MixCreator(MetsSectionCreator):
     """
     Subclass of MetsSectionCreator, which generates MIX metadata for image
     files.
     """
 
-    def add_mix_md(self, filepath, filerel=None):
+    def __init__(self, workspace):
+        """
+        Initialize MIX creator.
+
+        :workspace: Output path
+        """
+        super().__init__(workspace)
+        self.etrees = {}
+        self.filerels = {}
+
+    def add_mix_md(self, filepath, filerel=None, streams=None):
         """Creates  MIX metadata for an image file and append it
-        to self.md_elements
+        to self.etrees and self.filerels.
+
+        The streams are grouped by the normalized key of the stream
+        metadata used in MIX, so that the MIX metadata of each distinct
+        key is created and written only once, and only the references
+        are added for the other streams.
 
         :filepath: path to image file
         :filerel: relative path to image file to write to reference file
+        :streams: Metadata dict of streams, if already read
         :returns: None
         """
-
-        # Create MIX metadata
-        mix_dict = create_mix_metadata(filepath, filerel, self.workspace)
-        for index, mix in mix_dict.items():
-            self.add_md(metadata=mix,
-                        filename=(filerel if filerel else filepath),
-                        stream=(index if len(mix_dict) > 1 else None))
+        mix_keys = mix_stream_keys(filepath, filerel, self.workspace,
+                                   streams=streams)
+        if mix_keys is None:
+            return
+
+        for index, key in mix_keys.items():
+            if key not in self.etrees:
+                self.etrees[key] = _mix_element(key)
+                self.filerels[key] = []
+            self.filerels[key].append(
+                (filerel if filerel else filepath,
+                 index if len(mix_keys) > 1 else None))
 
     # Change the default write parameters
     # pylint: disable=too-many-arguments
@@ -101,12 +236,21 @@ class MixCreator(MetsSectionCreator):
               section=None, stdout=False, file_metadata_dict=None,
               ref_file="create-mix-md-references.jsonl"):
         """
-        Write MIX metadata.
+        Write MIX metadata. Base class write is overwritten to write
+        each distinct MIX metadata once and add the references of all
+        the streams sharing it.
         """
-        super().write(
-            mdtype=mdtype, mdtypeversion=mdtypeversion,
-            othermdtype=othermdtype, ref_file=ref_file
-        )
+        for key, metadata in self.etrees.items():
+            md_id, _ = self.write_md(metadata, mdtype, mdtypeversion,
+                                     othermdtype=othermdtype)
+            for (filename, stream) in self.filerels[key]:
+                self.add_reference(md_id, filename, stream)
+
+        # Write md-references
+        self.write_references(ref_file=ref_file)
+
+        # Clear etrees and filerels
+        self.__init__(self.workspace)
 
 
 def check_missing_metadata(stream, filename):
@@ -139,13 +283,31 @@ def create_mix_metadata(filename, filerel=None, workspace=None, streams=None):
     :streams: Metadata dict of streams. Will be created if None.
     :returns: Dict of MIX XML elements
     """
+    mix_keys = mix_stream_keys(filename, filerel, workspace, streams)
+    if mix_keys is None:
+        return None
+
+    return {index: _mix_element(key) for index, key in mix_keys.items()}
+
+
+def mix_stream_keys(filename, filerel=None, workspace=None, streams=None):
+    """Create the normalized MIX metadata keys of the streams of an
+    image file. Streams with equal keys have identical MIX metadata.
+
+    :filename: Image file name
+    :filerel: Image file name relative to base path
+    :workspace: Workspace path
+    :streams: Metadata dict of streams. Will be created if None.
+    :returns: Dict of metadata keys by the stream indexes, or None if
+              the file is not an image
+    """
     if streams is None:
         (streams, _, _) = scrape_file(filepath=filename,
                                       filerel=filerel,
                                       workspace=workspace,
                                       skip_well_check=True)
 
-    mix_dict = {}
+    mix_keys = {}
 
     for index, stream_md in streams.items():
         check_missing_metadata(stream_md, filename)
@@ -154,9 +316,9 @@ def create_mix_metadata(filename, filerel=None, workspace=None, streams=None):
             print("This is not an image file. No MIX metadata created.")
             return None
 
-        mix_dict[str(index)] = _create_mix_item(stream_md, filename)
+        mix_keys[str(index)] = _mix_key(stream_md, filename)
 
-    return mix_dict
+    return mix_keys
 
 
 def _create_mix_item(stream_md, filename):
@@ -166,26 +328,48 @@ def _create_mix_item(stream_md, filename):
     :filename: Image file name
     :returns: MIX XML metadata of a single image
     """
-    mix_compression = nisomix.compression(
-        compression_scheme=stream_md["compression"])
+    return _mix_element(_mix_key(stream_md, filename))
+
+
+def _mix_key(stream_md, filename):
+    """
+    Create the normalized metadata key of a single image. The key is a
+    tuple of the values of MIX_KEYS, where a missing byte order is None.
+
+    :stream_md: Item from metadata stream dict
+    :filename: Image file name
+    :returns: Metadata key tuple
+    """
+    values = dict(stream_md)
     if 'byte_order' not in stream_md:
         if stream_md['mimetype'] == 'image/tiff':
             raise MixGenerationError(
                 'Byte order missing from TIFF image file ', filename
             )
-        byte_order = None
-    else:
-        byte_order = stream_md["byte_order"]
+        values['byte_order'] = None
 
-    if stream_md['icc_profile_name'] is not UNAV:
+    return tuple(values[key] for key in MIX_KEYS)
+
+
+def _mix_element(key):
+    """
+    Create MIX metadata of a normalized metadata key.
+    :key: Metadata key tuple from _mix_key()
+    :returns: MIX XML metadata of a single image
+    """
+    stream_md = dict(zip(MIX_KEYS, key))
+    mix_compression = nisomix.compression(
+        compression_scheme=stream_md["compression"])
+
+    if stream_md['icc_profile_name'] != UNAV:
         color_profile = [nisomix.color_profile(
             icc_name=stream_md['icc_profile_name'])]
     else:
         color_profile = None
 
     basic_do_info = nisomix.digital_object_information(
-        byte_order=byte_order, child_elements=[mix_compression])
-
+        byte_order=stream_md["byte_order"],
+        child_elements=[mix_compression])
     photom_interpret = nisomix.photometric_interpretation(
         color_space=stream_md["colorspace"],
         child_elements=color_profile)
@@ -16,6 +16,15 @@ FILEDATA_KEYS = [
     'frame_rate', 'data_rate', 'bits_per_sample', 'data_rate_mode', 'color',
     'signal_format', 'sound', 'duration', 'sampling']
 
+CODEC_KEYS = ['codec_creator_app', 'codec_creator_app_version',
+              'codec_name', 'codec_quality']
+
+FRAME_KEYS = ['width', 'height', 'par', 'dar']
+
+# Stream metadata keys used in the VideoMD metadata, in the order of the
+# normalized metadata keys
+VIDEOMD_KEYS = FILEDATA_KEYS + CODEC_KEYS + FRAME_KEYS
+
 ALLOW_UNAV = ['duration', 'codec_creator_app', 'codec_creator_app_version',
               'codec_name', 'dar', 'sampling', 'signal_format']
 ALLOW_ZERO = ['data_rate', 'bits_per_sample', 'frame_rate', 'width',
@@ -71,39 +80,70 @@ class VideomdCreator(MetsSectionCreator):
     for video files.
     """
 
-    def add_videomd_md(self, filepath, filerel=None):
-        """Create videoMD metadata and append it to self.md_elements.
+    def __init__(self, workspace):
+        """
+        Initialize VideoMD creator.
+
+        :workspace: Output path
+        """
+        super().__init__(workspace)
+        self.etrees = {}
+        self.filerels = {}
+
+    def add_videomd_md(self, filepath, filerel=None, streams=None):
+        """Create videoMD metadata and append it to self.etrees and
+        self.filerels.
 
         If a file is not a video container, then the video stream metadata is
         processed in file level. Video container includes streams which need
         to be processed separately one at a time.
 
+        The streams are grouped by the normalized key of the stream
+        metadata used in VideoMD, so that the VideoMD metadata of each
+        distinct key is created and written only once, and only the
+        references are added for the other streams.
+
         :filepath: Video file path
         :filerel: Video file path relative to base path
+        :streams: Metadata dict of streams, if already read
         """
-
-        # Create videoMD metadata
-        videomd_dict = create_videomd_metadata(
-            filepath, filerel, self.workspace
-        )
-        if '0' in videomd_dict and len(videomd_dict) == 1:
-            self.add_md(metadata=videomd_dict['0'],
-                        filename=(filerel if filerel else filepath))
-        else:
-            for index, video in videomd_dict.items():
-                self.add_md(metadata=video,
-                            filename=(filerel if filerel else filepath),
-                            stream=index)
+        videomd_keys = videomd_stream_keys(
+            filepath, filerel, self.workspace, streams=streams)
+        if videomd_keys is None:
+            return
+
+        # A file with only one stream is referenced in file level
+        if '0' in videomd_keys and len(videomd_keys) == 1:
+            videomd_keys = {None: videomd_keys['0']}
+
+        for index, key in videomd_keys.items():
+            if key not in self.etrees:
+                self.etrees[key] = _videomd_element(key)
+                self.filerels[key] = []
+            self.filerels[key].append(
+                (filerel if filerel else filepath, index))
 
     # pylint: disable=too-many-arguments
     def write(self, mdtype="OTHER", mdtypeversion="2.0",
               othermdtype="VideoMD", section=None, stdout=False,
               file_metadata_dict=None,
               ref_file="create-videomd-md-references.jsonl"):
-        super().write(
-            mdtype=mdtype, mdtypeversion=mdtypeversion,
-            othermdtype=othermdtype, ref_file=ref_file
-        )
+        """
+        Write VideoMD metadata. Base class write is overwritten to write
+        each distinct VideoMD metadata once and add the references of all
+        the streams sharing it.
+        """
+        for key, metadata in self.etrees.items():
+            md_id, _ = self.write_md(metadata, mdtype, mdtypeversion,
+                                     othermdtype=othermdtype)
+            for (filename, stream) in self.filerels[key]:
+                self.add_reference(md_id, filename, stream)
+
+        # Write md-references
+        self.write_references(ref_file=ref_file)
+
+        # Clear etrees and filerels
+        self.__init__(self.workspace)
 
 
 def create_videomd_metadata(filename, filerel=None, workspace=None,
@@ -116,30 +156,57 @@ def create_videomd_metadata(filename, filerel=None, workspace=None,
     :streams: Metadata dict of streams. Will be created if None.
     :returns: List of VideoMD XML sections.
     """
+    videomd_keys = videomd_stream_keys(filename, filerel, workspace, streams)
+    if videomd_keys is None:
+        return None
+
+    return {index: _videomd_element(key)
+            for index, key in videomd_keys.items()}
+
+
+def videomd_stream_keys(filename, filerel=None, workspace=None,
+                        streams=None):
+    """Create the normalized VideoMD metadata keys of the video streams
+    of a file. Streams with equal keys have identical VideoMD metadata.
+
+    :filename: Video file path
+    :filerel: Video file path relative to base path
+    :workspace: Workspace path
+    :streams: Metadata dict of streams. Will be created if None.
+    :returns: Dict of metadata keys by the stream indexes, or None if
+              the file has no video streams
+    """
     if streams is None:
         (streams, _, _) = scrape_file(filepath=filename,
                                       filerel=filerel,
                                       workspace=workspace,
                                       skip_well_check=True)
 
-    videomd_dict = {}
+    videomd_keys = {}
     for index, stream_md in streams.items():
         if stream_md['stream_type'] != 'video':
             continue
 
         stream_md = fix_missing_metadata(stream_md, filename, ALLOW_UNAV,
                                          ALLOW_ZERO)
-        file_data_elem = _get_file_data(stream_md)
+        videomd_keys[str(index)] = tuple(
+            stream_md[key] for key in VIDEOMD_KEYS)
 
-        videomd_elem = videomd.create_videomd(
-            file_data=file_data_elem)
-        videomd_dict[str(index)] = videomd_elem
-
-    if not videomd_dict:
+    if not videomd_keys:
         print('The file has no video streams. No VideoMD metadata created.')
         return None
 
-    return videomd_dict
+    return videomd_keys
+
+
+def _videomd_element(key):
+    """Creates the VideoMD XML section of a normalized metadata key.
+
+    :key: Metadata key tuple of the values of VIDEOMD_KEYS
+    :returns: VideoMD XML section
+    """
+    stream_md = dict(zip(VIDEOMD_KEYS, key))
+    return videomd.create_videomd(file_data=_get_file_data(stream_md))
 
 
 def _get_file_data(stream_dict):
@@ -154,10 +221,7 @@ def _get_file_data(stream_dict):
         camel_key = keyparts[0] + ''.join(x.title() for x in keyparts[1:])
         params[camel_key] = stream_dict[key]
 
-    compression = (stream_dict['codec_creator_app'],
-                   stream_dict['codec_creator_app_version'],
-                   stream_dict['codec_name'],
-                   stream_dict['codec_quality'])
+    compression = [stream_dict[key] for key in CODEC_KEYS]
 
     params['compression'] = videomd.vmd_compression(*compression)
 
@@ -1,12 +1,17 @@
 """Command line tool for importing digital objects."""
 
+import contextlib
 import datetime
 import fnmatch
+import hashlib
 import os
 import platform
+import stat
 import sys
+import tarfile
+import tempfile
+import zipfile
 from uuid import uuid4
-import errno
 
 import click
 
@@ -14,9 +19,10 @@ import file_scraper
 import premis
 from siptools.mdcreator import MetsSectionCreator
 from siptools.utils import scrape_file, calc_checksum
-from siptools.scripts.premis_event import premis_event, create_premis_event
-from siptools.scripts.create_agent import create_agent
-from siptools.utils import generate_digest, encode_path
+from siptools.scripts.premis_event import (premis_event, event_key,
+                                           get_event_catalog,
+                                           event_in_catalog)
+from siptools.scripts.create_agent import agent_files, create_agent
 
 
 click.disable_unicode_literals_warning = True
@@ -32,6 +38,13 @@ UNKNOWN_VERSION = '(:unav)'
 # Supported bit-level preservation types
 SUPPLEMENTARY_TYPES = ["xml_schema"]
 
+# Buffer size for extracting archive members
+ARCHIVE_BUFSIZE = 1024 * 1024
+
+
+class NoFilesError(ValueError):
+    """Exception raised when there are no files to import."""
+
 
 @click.command()
 @click.argument('filepaths', nargs=-1, type=str)
@@ -104,6 +117,13 @@ SUPPLEMENTARY_TYPES = ["xml_schema"]
     help='Used to mark supplementary files, files that are not part of the '
          'contents per se, but are to be included in the SIP. May be used '
          'multiple times, but currently only "xml_schema" type is supported.')
+@click.option(
+    '--archive', type=click.Path(exists=True, dir_okay=False),
+    metavar='<ARCHIVE FILE>',
+    help='Import the files from a tar or zip archive without extracting '
+         'it. FILEPATHS are then files or directories in the archive, and '
+         'all files are imported if FILEPATHS are not given. Each file is '
+         'extracted to a temporary file only for the time of scraping.')
 # pylint: disable=too-many-arguments
 def main(**kwargs):
     """Import files to generate digital objects.
@@ -117,7 +137,10 @@ def main(**kwargs):
     example --checksum and --identifier are file dependent metadata, and
     if these are used, then use the script only for one file.
     """
-    import_object(**kwargs)
+    try:
+        import_object(**kwargs)
+    except NoFilesError as error:
+        raise click.UsageError(str(error))
     return 0
 
 
@@ -146,7 +169,8 @@ def _attribute_values(given_params):
         "event_target": None,
         "stdout": False,
         "bit_level": None,
-        "supplementary": ()
+        "supplementary": (),
+        "archive": None
     }
     for key in given_params:
         if given_params[key]:
@@ -189,39 +213,63 @@ def import_object(**kwargs):
                  stdout: True prints output to stdout
                  bit_level: True marks files for bit-level preservation only
                  supplementary: Object type for supplementary files
+                 archive: Tar or zip archive to import the files from
     """
     attributes = _attribute_values(kwargs)
     date_now = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
 
     # Loop files and create premis objects
-    files = collect_filepaths(dirs=attributes["filepaths"],
-                              base=attributes["base_path"])
+    if attributes["archive"]:
+        files = iter_archive_files(attributes["archive"],
+                                   attributes["filepaths"])
+    else:
+        files = _iter_filepaths(attributes["filepaths"],
+                                attributes["base_path"])
     creator = PremisCreator(attributes["workspace"])
     agents = []
-    for filepath in files:
-
-        # If the given path is an absolute path and base_path is current
-        # path (i.e. not given), relpath will return ../../.. sequences,
-        # if current path is not part of the absolute path. In such case
-        # we will use the absolute path for filerel and omit base_path
-        # relation.
-        if attributes["base_path"] not in ['.']:
-            filerel = os.path.relpath(filepath, attributes["base_path"])
-        else:
-            filerel = filepath
+    grade = None
+    # The files are closed on errors, so that the temporary file of an
+    # archive member is removed at once
+    with contextlib.closing(files):
+        for (filepath, filerel, file_attributes) in files:
+
+            properties = {}
+            if attributes["order"] is not None:
+                properties['order'] = str(attributes["order"])
+            properties["bit_level"] = attributes["bit_level"]
+            properties["supplementary"] = attributes["supplementary"]
+
+            object_attributes = dict(attributes)
+            for key, value in file_attributes.items():
+                if not object_attributes[key]:
+                    object_attributes[key] = value
 
-        properties = {}
-        if attributes["order"] is not None:
-            properties['order'] = str(attributes["order"])
-        properties["bit_level"] = attributes["bit_level"]
-        properties["supplementary"] = attributes["supplementary"]
-
-        (streams, scraper_info) = creator.add_premis_md(
-            filepath, attributes, filerel=filerel, properties=properties)
-        for index in scraper_info:
-            agents.append(_parse_scraper_tools(scraper_info[index]))
-
-        grade = streams[0]['properties']['grade']
+            try:
+                (streams, scraper_info) = creator.add_premis_md(
+                    filepath, object_attributes, filerel=filerel,
+                    properties=properties)
+            except (ValueError, OSError) as error:
+                if not attributes["archive"]:
+                    raise
+                # Report the file in the archive instead of the temporary
+                # file
+                raise ValueError(
+                    'Failed to import %s from archive %s: %s' % (
+                        filerel, attributes["archive"],
+                        str(error).replace(filepath, filerel))) from error
+            for index in scraper_info:
+                agents.append(_parse_scraper_tools(scraper_info[index]))
+
+            grade = streams[0]['properties']['grade']
+
+    if grade is None:
+        if attributes["archive"]:
+            raise NoFilesError(
+                'No files to import in archive %s matching %s' % (
+                    attributes["archive"],
+                    ', '.join(attributes["filepaths"]) or 'any path'))
+        raise NoFilesError('No files to import in %s' % ', '.join(
+            attributes["filepaths"]))
 
     is_native = grade in (
         file_scraper.defaults.BIT_LEVEL,
@@ -538,6 +586,114 @@ def collect_filepaths(dirs=None, pattern='*', base='.'):
     return files
 
 
+def _iter_filepaths(filepaths, base_path):
+    """
+    Iterate the files to import from the file system.
+
+    :filepaths: Files or directories from arguments
+    :base_path: Base path (see --base_path)
+    :returns: Generator of file paths, file paths relative to base path
+              and empty dicts of file specific attributes
+    """
+    for filepath in collect_filepaths(dirs=filepaths, base=base_path):
+
+        # If the given path is an absolute path and base_path is current
+        # path (i.e. not given), relpath will return ../../.. sequences,
+        # if current path is not part of the absolute path. In such case
+        # we will use the absolute path for filerel and omit base_path
+        # relation.
+        if base_path not in ['.']:
+            filerel = os.path.relpath(filepath, base_path)
+        else:
+            filerel = filepath
+
+        yield (filepath, filerel, {})
+
+
+def iter_archive_files(archive, filepaths=None):
+    """
+    Iterate the files to import from a tar or zip archive.
+
+    The archive is read as a stream. Each selected file is extracted to
+    a temporary file, which is removed when the next file is requested.
+    The MD5 checksum of the file is calculated while it is extracted, so
+    the data is read only once. Links and other special files are
+    skipped. Errors in extracting a file are reported with the file
+    path in the archive.
+
+    :archive: Path of a tar file, possibly compressed, or a zip file
+    :filepaths: Files or directories in the archive to import. All files
+                are imported if not given.
+    :returns: Generator of temporary file paths, file paths in the
+              archive and dicts of checksum and date_created attributes
+    :raises: ValueError if a file path in the archive is not relative
+             or points outside the archive, or if a file can not be
+             extracted
+    """
+    selections = [os.path.normpath(path) for path in filepaths or ()]
+
+    for (name, fileobj, mtime) in _iter_archive_members(archive):
+        filerel = os.path.normpath(name)
+        if os.path.isabs(filerel) or filerel.split(os.sep)[0] == '..':
+            raise ValueError('Invalid file path in archive: %s' % name)
+        if selections and not any(
+                selection == '.' or filerel == selection or
+                filerel.startswith(selection + os.sep)
+                for selection in selections):
+            continue
+
+        (handle, spill_path) = tempfile.mkstemp(
+            suffix=os.path.splitext(filerel)[1], prefix='import-object-')
+        try:
+            md5 = hashlib.md5()
+            with os.fdopen(handle, 'wb') as outfile:
+                try:
+                    for data in iter(lambda: fileobj.read(ARCHIVE_BUFSIZE),
+                                     b''):
+                        md5.update(data)
+                        outfile.write(data)
+                except (OSError, EOFError, zipfile.BadZipFile,
+                        tarfile.TarError) as error:
+                    raise ValueError(
+                        'Failed to extract %s from archive %s: %s'
+                        % (name, archive, error)) from error
+            yield (spill_path, filerel, {
+                'checksum': ('MD5', md5.hexdigest()),
+                'date_created': mtime.isoformat()})
+        finally:
+            os.remove(spill_path)
+
+
+def _iter_archive_members(archive):
+    """
+    Iterate the regular files in a tar or zip archive in the order of the
+    archive. Symbolic links and other special files are skipped. Zip
+    entries without a Unix file type in their external attributes are
+    regular files.
+
+    :archive: Path of the archive
+    :returns: Generator of member names, file objects for reading the
+              member data and modification times as datetime
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                file_type = stat.S_IFMT(info.external_attr >> 16)
+                if info.is_dir() or file_type not in (0, stat.S_IFREG):
+                    continue
+                with zip_file.open(info) as fileobj:
+                    yield (info.filename, fileobj,
+                           datetime.datetime(*info.date_time))
+        return
+
+    with tarfile.open(archive, 'r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            yield (member.name, tar.extractfile(member),
+                   datetime.datetime.fromtimestamp(member.mtime))
+
+
 def creation_date(path_to_file):
     """Return creation date for file.
 
@@ -666,15 +822,9 @@ def _create_events(
     if not checksum_event:
         del events['checksum']
 
+    event_catalog = get_event_catalog(workspace)
     for event_name, event in events.items():
-        found_event = _find_event(workspace,
-                                  event['event_type'],
-                                  event['event_datetime'],
-                                  event['event_detail'],
-                                  event['event_outcome'],
-                                  event['event_outcome_detail'])
-
-        if not found_event:
+        if not event_in_catalog(workspace, event_catalog, event_key(event)):
 
             if event_name == 'checksum':
                 create_agent(
@@ -710,37 +860,9 @@ def _create_events(
                          event_target=(event_target, ),
                          create_agent_file='import-object-%s' % event_name)
 
-            agent_file = os.path.join(
-                workspace, "import-object-%s-AGENTS-amd.json" % event_name)
-            try:
+            for agent_file in agent_files(
+                    workspace, 'import-object-%s' % event_name):
                 os.remove(agent_file)
-            except OSError as exc:  # FileNotFoundError on Python 3
-                if exc.errno != errno.ENOENT:
-                    raise
-
-
-def _find_event(workspace,
-                event_type,
-                event_datetime,
-                event_detail,
-                event_outcome,
-                event_outcome_detail):
-    """Helper function to find if a similar event already is created
-    by using the digest of the metadata to see if a file already
-    exist.
-    """
-
-    event = create_premis_event(
-        event_type=event_type,
-        event_datetime=event_datetime,
-        event_detail=event_detail,
-        event_outcome=event_outcome,
-        event_outcome_detail=event_outcome_detail)
-
-    digest = generate_digest(event)
-    expected_filename = encode_path("%s-PREMIS:EVENT-amd.xml" % digest)
-
-    return os.path.exists(os.path.join(workspace, expected_filename))
 
 
 if __name__ == "__main__":
@@ -4,6 +4,7 @@ import glob
 import json
 import os
 import sys
+import tempfile
 from uuid import uuid4
 
 import click
@@ -11,16 +12,30 @@ import lxml.etree
 
 import premis
 from siptools.mdcreator import MetsSectionCreator
+from siptools.scripts.create_agent import agent_files, read_agents
 from siptools.xml.mets import NAMESPACES
 from siptools.xml.premis import PREMIS_EVENT_OUTCOME_TYPES
-from siptools.utils import list2str, read_object_id
+from siptools.utils import list2str, read_md_references, read_object_id
 
 click.disable_unicode_literals_warning = True
 
+# Agent index of the workspace, one JSON line per agent
+AGENT_INDEX = "premis-agent-index.jsonl"
+
+# Event catalog of the workspace, one JSON line per event
+EVENT_CATALOG = "premis-event-catalog.jsonl"
+
+# Event attributes that identify equivalent events in the event catalog
+EVENT_KEY_PARAMS = ["event_type", "event_datetime", "event_detail",
+                    "event_outcome", "event_outcome_detail"]
+
+REQUIRED_EVENT_PARAMS = ["event_type", "event_datetime", "event_detail",
+                         "event_outcome", "event_outcome_detail"]
+
 
 @click.command()
-@click.argument('event_type', required=True, type=str)
-@click.argument('event_datetime', required=True, type=str)
+@click.argument('event_type', required=False, type=str)
+@click.argument('event_datetime', required=False, type=str)
 @click.option('--workspace',
               type=click.Path(exists=True),
               default='./workspace',
@@ -46,17 +61,16 @@ click.disable_unicode_literals_warning = True
                     'digital objects. May be used multiple times. '
                     'Same as: --linking_object target path/to/target_file'))
 @click.option('--event_detail',
-              type=str, required=True,
+              type=str,
               metavar='<EVENT DETAIL>',
               help='Short information about the event')
 @click.option('--event_outcome',
               type=click.Choice(PREMIS_EVENT_OUTCOME_TYPES),
-              required=True,
               metavar='<EVENT OUTCOME>',
               help=('Event outcome type. Possible values are: ' +
                     list2str(PREMIS_EVENT_OUTCOME_TYPES)))
 @click.option('--event_outcome_detail',
-              type=str, required=True,
+              type=str,
               metavar='<EVENT OUTCOME DETAIL>',
               help='Detailed information about the event outcome.')
 @click.option('--agent_name',
@@ -96,15 +110,46 @@ click.disable_unicode_literals_warning = True
 @click.option('--stdout',
               is_flag=True,
               help='Print output to stdout')
+@click.option('--from_jsonl',
+              type=click.Path(exists=True),
+              metavar='<EVENT FILE>',
+              help=('JSON lines file of events to create in one run. Each '
+                    'line is an object of the event arguments and options, '
+                    'e.g. {"event_type": "migration", "event_datetime": '
+                    '"2016-10-13T12:30:55", "event_detail": "Migration", '
+                    '"event_outcome": "success", "event_outcome_detail": '
+                    '"Migrated", "event_target": ["file.txt"]}. The event '
+                    'arguments must not be given when this is used.'))
 # pylint: disable=too-many-arguments
 def main(**kwargs):
     """The script creates provenance metadata for the package. The metadata
     contains event and, if given, also agent of the event.
 
+    The event arguments and the options --event_detail, --event_outcome and
+    --event_outcome_detail are required, unless the events are given with
+    --from_jsonl.
+
     \b
     EVENT_TYPE: Type of the event.
     EVENT_DATETIME: Timestamp of the event.
     """
+    if kwargs["from_jsonl"]:
+        if kwargs["event_type"] or kwargs["event_datetime"]:
+            raise click.UsageError(
+                "EVENT_TYPE and EVENT_DATETIME can not be given with "
+                "--from_jsonl")
+        premis_events_from_jsonl(
+            kwargs["from_jsonl"],
+            workspace=kwargs["workspace"],
+            base_path=kwargs["base_path"],
+            add_object_links=kwargs["add_object_links"],
+            stdout=kwargs["stdout"])
+        return 0
+
+    missing = [name for name in REQUIRED_EVENT_PARAMS if not kwargs[name]]
+    if missing:
+        raise click.UsageError(
+            "Missing arguments or options: %s" % ", ".join(missing))
     premis_event(**kwargs)
     return 0
 
@@ -180,45 +225,74 @@ def premis_event(**kwargs):
     attributes = _attribute_values(kwargs)
     creator = PremisCreator(attributes["workspace"])
 
-    agents = _resolve_agents(**attributes)
-
-    for agent in agents:
+    known_agents = get_premis_agent_identifiers(attributes["workspace"])
+    indexed_agents = dict(known_agents)
+    (agents, event) = _add_event(creator, attributes, known_agents)
 
-        attributes["linking_agents"].add(
-            (agent["agent_identifier"][0],
-             agent["agent_identifier"][1],
-             agent["agent_role"]))
+    # Agents and the event are written with one reference write
+    md_files = creator.write(stdout=attributes["stdout"])
+    update_agent_index(attributes["workspace"], agents, indexed_agents)
+    if not attributes["linking_object_ids"]:
+        update_event_catalog(attributes["workspace"],
+                             [(event_key(attributes), md_files[event])])
 
-        agent = create_premis_agent(**agent)
 
-        agent_creator = PremisCreator(attributes["workspace"])
-        for (directory, event_file, role) in iterate_linking_objects(
-                attributes["base_path"], attributes["linking_objects"]):
-            agent_creator.add_md(agent, event_file, directory=directory)
-        agent_creator.write(mdtype="PREMIS:AGENT",
-                            stdout=attributes["stdout"])
-
-    # Add all objects, both those that are supplied with file paths
-    # and those that are supplied without
-    if attributes["add_object_links"]:
-        for (directory, event_file, role) in iterate_linking_objects(
-                attributes["base_path"], attributes["linking_objects"]):
-            if event_file is not None:
-                linking_object = read_object_id(
-                    event_file, attributes["workspace"])
-                attributes["linking_object_ids"].add(
-                    (linking_object[0], linking_object[1], role))
-
-        for link in attributes["linked_object_ids"]:
-            attributes["linking_object_ids"].add((link[0], link[1], link[2]))
-
-    event = create_premis_event(**attributes)
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-locals
+def premis_events_from_jsonl(event_file, workspace="./workspace/",
+                             base_path=".", add_object_links=False,
+                             stdout=False):
+    """
+    Create the PREMIS events and agents listed in a JSON lines file. All
+    events are created in one run, and the metadata references and the
+    agent index are written once.
 
-    for (directory, event_file, role) in iterate_linking_objects(
-            attributes["base_path"], attributes["linking_objects"]):
-        creator.add_md(event, event_file, directory=directory)
+    Each line of the file is a JSON object with the keyword arguments of
+    premis_event() for one event. The event_type, event_datetime,
+    event_detail, event_outcome and event_outcome_detail keys are
+    required. The other keys default to the given arguments.
 
-    creator.write(mdtype="PREMIS:EVENT", stdout=attributes["stdout"])
+    :event_file: JSON lines file of the events
+    :workspace: Workspace path
+    :base_path: Base path of digital objects
+    :add_object_links: True for adding linking objects
+    :stdout: True prints output to stdout
+    :raises: ValueError if an event in the file is not valid
+    """
+    creator = PremisCreator(workspace)
+    known_agents = get_premis_agent_identifiers(workspace)
+    indexed_agents = dict(known_agents)
+    agent_elements = {}
+    object_refs = {}
+    agents = []
+    events = []
+    count = 0
+
+    with open(event_file) as in_file:
+        for (line_number, line) in enumerate(in_file, 1):
+            if not line.strip():
+                continue
+            params = _jsonl_event_params(line, line_number)
+            params.setdefault("base_path", base_path)
+            params.setdefault("add_object_links", add_object_links)
+            params["workspace"] = workspace
+            attributes = _attribute_values(params)
+            if attributes["add_object_links"] and not object_refs:
+                object_refs = read_md_references(
+                    workspace, "import-object-md-references.jsonl") or {}
+            (event_agents, event) = _add_event(
+                creator, attributes, known_agents, agent_elements,
+                object_refs)
+            agents.extend(event_agents)
+            if not attributes["linking_object_ids"]:
+                events.append((event_key(attributes), event))
+            count += 1
+
+    md_files = creator.write(stdout=stdout)
+    update_agent_index(workspace, agents, indexed_agents)
+    update_event_catalog(workspace, [(key, md_files[event])
+                                     for (key, event) in events])
+    print("Created %d PREMIS events from %s" % (count, event_file))
 
 
 def iterate_linking_objects(base_path, linking_objects):
@@ -280,9 +354,37 @@ class PremisCreator(MetsSectionCreator):
     metadata.
     """
     # pylint: disable=too-many-arguments
-    def write(self, mdtype="PREMIS", mdtypeversion="2.3", othermdtype=None,
+    def write(self, mdtype=None, mdtypeversion="2.3", othermdtype=None,
               section="digiprovmd", stdout=False, file_metadata_dict=None,
               ref_file="premis-event-md-references.jsonl"):
+        """
+        Write the PREMIS metadata and the references. If mdtype is not
+        given, it is PREMIS:AGENT or PREMIS:EVENT by the metadata element,
+        so that both agents and events are written with one reference
+        write. A metadata element added several times is written once.
+
+        :returns: Dict of the written file paths by metadata element, if
+                  mdtype is not given
+        """
+        if mdtype is None:
+            md_ids = {}
+            md_files = {}
+            for (metadata, filename, stream, directory, _) in \
+                    self.md_elements:
+                if id(metadata) not in md_ids:
+                    md_ids[id(metadata)], md_files[metadata] = self.write_md(
+                        metadata,
+                        "PREMIS:%s" % lxml.etree.QName(
+                            metadata).localname.upper(),
+                        mdtypeversion, othermdtype=othermdtype,
+                        section=section, stdout=stdout
+                    )
+                self.add_reference(md_ids[id(metadata)], filename, stream,
+                                   directory)
+            self.write_references(ref_file)
+            self.__init__(self.workspace)
+            return md_files
+
         super().write(
             mdtype=mdtype,
             mdtypeversion=mdtypeversion,
@@ -297,18 +399,80 @@ class PremisCreator(MetsSectionCreator):
 def get_premis_agent_identifiers(workspace):
     """
     Get a dictionary of PREMIS agent name and type pairs and their
-    corresponding agent identifiers
+    corresponding agent identifiers.
+
+    The identifiers are read from the agent index of the workspace. If the
+    workspace has no agent index, e.g. it was created with an older
+    version, the index is first rebuilt from the PREMIS agent files. An
+    existing index is trusted, so agent files written by other means
+    require rebuild_agent_index().
 
     :param workspace: Path to the workspace
 
     :returns: A dictionary with the following tuple-to-tuple mapping
               {(agent_type, agent_name): (agent_ident_type, agent_ident_value)}
     """
+    index_path = os.path.join(workspace, AGENT_INDEX)
+    if not os.path.exists(index_path):
+        return rebuild_agent_index(workspace)
+
+    result = {}
+    with open(index_path) as in_file:
+        for line in in_file:
+            entry = json.loads(line)
+            result[(entry["agent_type"], entry["agent_name"])] = \
+                tuple(entry["agent_identifier"])
+
+    return result
+
+
+def update_agent_index(workspace, agents, known_agents=None):
+    """
+    Append agents to the agent index of the workspace. Agents already in
+    the index are not appended again.
+
+    :param workspace: Path to the workspace
+    :param agents: Iterable of agent dicts with keys agent_type,
+                   agent_name and agent_identifier
+    :param known_agents: Agent identifier dict as returned by
+                         get_premis_agent_identifiers(), or None to read
+                         it from the workspace
+    """
+    if known_agents is None:
+        known_agents = get_premis_agent_identifiers(workspace)
+
+    lines = []
+    for agent in agents:
+        key = (agent["agent_type"], agent["agent_name"])
+        identifier = tuple(agent["agent_identifier"])
+        if known_agents.get(key) == identifier:
+            continue
+        known_agents[key] = identifier
+        lines.append(json.dumps({
+            "agent_type": key[0],
+            "agent_name": key[1],
+            "agent_identifier": list(identifier)
+        }) + '\n')
+
+    if lines:
+        with open(os.path.join(workspace, AGENT_INDEX), 'a') as out_file:
+            out_file.write(''.join(lines))
+
+
+def rebuild_agent_index(workspace):
+    """
+    Rebuild the agent index of the workspace from the PREMIS agent files.
+
+    :param workspace: Path to the workspace
+
+    :returns: Agent identifier dict as returned by
+              get_premis_agent_identifiers()
+    """
     result = {}
 
     search_path = os.path.join(workspace, "*AGENT-amd.xml")
 
-    for path in glob.glob(search_path):
+    for path in sorted(glob.glob(search_path)):
         element = lxml.etree.parse(path).getroot()[0]
         agent = element.find(
             "mets:digiprovMD/mets:mdWrap/mets:xmlData/premis:agent",
@@ -333,6 +497,149 @@ def get_premis_agent_identifiers(workspace):
 
         result[(agent_type, agent_name)] = (id_type, id_value)
 
+    # Concurrent rebuilds write to their own temporary files
+    (handle, tmp_path) = tempfile.mkstemp(
+        prefix='.%s.' % AGENT_INDEX, dir=workspace)
+    with os.fdopen(handle, 'w') as out_file:
+        for (key, identifier) in result.items():
+            json.dump({
+                "agent_type": key[0],
+                "agent_name": key[1],
+                "agent_identifier": list(identifier)
+            }, out_file)
+            out_file.write('\n')
+    os.replace(tmp_path, os.path.join(workspace, AGENT_INDEX))
+
+    return result
+
+
+def event_key(attributes):
+    """
+    Return the event catalog key of an event.
+
+    :param attributes: Event attributes
+    :returns: Tuple of event type, datetime, detail, outcome and outcome
+              detail
+    """
+    return tuple(attributes[name] for name in EVENT_KEY_PARAMS)
+
+
+def get_event_catalog(workspace):
+    """
+    Get the catalog of the PREMIS events in the workspace that have no
+    linking objects. Equivalent events differ only by their identifiers
+    and linking agents, so they are written to the same file.
+
+    Each catalog entry names its event file. The files are not checked
+    here, use event_in_catalog() for looking up an event. If the
+    workspace has no event catalog, it is first rebuilt from the PREMIS
+    event files.
+
+    :param workspace: Path to the workspace
+
+    :returns: A dict of event file names by event keys as returned by
+              event_key()
+    """
+    catalog_path = os.path.join(workspace, EVENT_CATALOG)
+    if not os.path.exists(catalog_path):
+        return rebuild_event_catalog(workspace)
+
+    result = {}
+    with open(catalog_path) as in_file:
+        for line in in_file:
+            entry = json.loads(line)
+            result[tuple(entry[:-1])] = entry[-1]
+
+    return result
+
+
+def event_in_catalog(workspace, catalog, key):
+    """
+    Check whether an event is in the event catalog and its event file
+    still exists.
+
+    :param workspace: Path to the workspace
+    :param catalog: Event catalog as returned by get_event_catalog()
+    :param key: Event key as returned by event_key()
+    :returns: True if the event exists in the workspace
+    """
+    return key in catalog and os.path.exists(
+        os.path.join(workspace, catalog[key]))
+
+
+def update_event_catalog(workspace, events, catalog=None):
+    """
+    Append events to the event catalog of the workspace. Events already
+    in the catalog are not appended again, unless their event files have
+    been removed.
+
+    :param workspace: Path to the workspace
+    :param events: Iterable of event keys as returned by event_key() and
+                   the paths of their event files
+    :param catalog: Event catalog as returned by get_event_catalog(), or
+                    None to read it from the workspace
+    """
+    if catalog is None:
+        catalog = get_event_catalog(workspace)
+
+    lines = []
+    for (key, event_file) in events:
+        if not event_in_catalog(workspace, catalog, key):
+            catalog[key] = os.path.basename(event_file)
+            lines.append(json.dumps(list(key) + [catalog[key]]) + '\n')
+
+    if lines:
+        with open(os.path.join(workspace, EVENT_CATALOG), 'a') as out_file:
+            out_file.write(''.join(lines))
+
+
+def rebuild_event_catalog(workspace):
+    """
+    Rebuild the event catalog of the workspace from the PREMIS event
+    files.
+
+    :param workspace: Path to the workspace
+
+    :returns: Event catalog as returned by get_event_catalog()
+    """
+    result = {}
+    lines = []
+
+    search_path = os.path.join(workspace, "*EVENT-amd.xml")
+
+    for path in sorted(glob.glob(search_path)):
+        element = lxml.etree.parse(path).getroot()[0]
+        event = element.find(
+            "mets:digiprovMD/mets:mdWrap/mets:xmlData/premis:event",
+            namespaces=NAMESPACES
+        )
+        if event.find("premis:linkingObjectIdentifier",
+                      namespaces=NAMESPACES) is not None:
+            continue
+
+        key = tuple(
+            event.findtext(xpath, namespaces=NAMESPACES) for xpath in (
+                "premis:eventType",
+                "premis:eventDateTime",
+                "premis:eventDetail",
+                "premis:eventOutcomeInformation/premis:eventOutcome",
+                "premis:eventOutcomeInformation/premis:eventOutcomeDetail/"
+                "premis:eventOutcomeDetailNote"
+            )
+        )
+        # The entries are written in the order of the event files, as
+        # the keys may contain None and are not sortable
+        if key not in result:
+            result[key] = os.path.basename(path)
+            lines.append(json.dumps(list(key) + [result[key]]) + '\n')
+
+    # Concurrent rebuilds write to their own temporary files
+    (handle, tmp_path) = tempfile.mkstemp(
+        prefix='.%s.' % EVENT_CATALOG, dir=workspace)
+    with os.fdopen(handle, 'w') as out_file:
+        out_file.write(''.join(lines))
+    os.replace(tmp_path, os.path.join(workspace, EVENT_CATALOG))
+
     return result
 
 
@@ -419,6 +726,113 @@ def create_premis_event(**attributes):
     return premis_event_elem
 
 
+# pylint: disable=too-many-arguments
+def _add_event(creator, attributes, known_agents, agent_elements=None,
+               object_refs=None):
+    """Add the PREMIS event and its agents to the creator.
+
+    :creator: PremisCreator
+    :attributes: Event attributes from _attribute_values()
+    :known_agents: Agent identifier dict, updated with the agents of the
+                   event
+    :agent_elements: Dict of the created agent elements for reusing them,
+                     or None
+    :object_refs: Import-object metadata references, or None to read them
+                  from the workspace
+    :returns: Tuple of the list of the agent dicts of the event and the
+              event element
+    """
+    if agent_elements is None:
+        agent_elements = {}
+    agents = _resolve_agents(known_agents=known_agents, **attributes)
+    linking_objects = list(iterate_linking_objects(
+        attributes["base_path"], attributes["linking_objects"]))
+
+    for agent in agents:
+        attributes["linking_agents"].add(
+            (agent["agent_identifier"][0],
+             agent["agent_identifier"][1],
+             agent["agent_role"]))
+        known_agents[(agent["agent_type"], agent["agent_name"])] = \
+            tuple(agent["agent_identifier"])
+
+        key = (tuple(agent["agent_identifier"]), agent["agent_name"],
+               agent["agent_type"], agent["agent_note"])
+        if key not in agent_elements:
+            agent_elements[key] = create_premis_agent(**agent)
+
+        for (directory, event_file, role) in linking_objects:
+            creator.add_md(agent_elements[key], event_file,
+                           directory=directory)
+
+    # Add all objects, both those that are supplied with file paths
+    # and those that are supplied without
+    if attributes["add_object_links"]:
+        for (directory, event_file, role) in linking_objects:
+            if event_file is not None:
+                linking_object = read_object_id(
+                    event_file, attributes["workspace"], object_refs)
+                attributes["linking_object_ids"].add(
+                    (linking_object[0], linking_object[1], role))
+
+        for link in attributes["linked_object_ids"]:
+            attributes["linking_object_ids"].add((link[0], link[1], link[2]))
+
+    event = create_premis_event(**attributes)
+
+    for (directory, event_file, role) in linking_objects:
+        creator.add_md(event, event_file, directory=directory)
+
+    return (agents, event)
+
+
+def _jsonl_event_params(line, line_number):
+    """Parse the event parameters of a JSON lines event file line.
+
+    :line: Line of the event file
+    :line_number: Line number for the error messages
+    :returns: Dict of the event parameters
+    :raises: ValueError if the event is not valid
+    """
+    try:
+        params = json.loads(line)
+    except ValueError as exc:
+        raise ValueError(
+            "Invalid JSON on line %d of the event file: %s"
+            % (line_number, exc))
+    if not isinstance(params, dict):
+        raise ValueError(
+            "Line %d of the event file is not a JSON object" % line_number)
+
+    missing = [name for name in REQUIRED_EVENT_PARAMS
+               if not params.get(name)]
+    if missing:
+        raise ValueError(
+            "Event on line %d is missing: %s"
+            % (line_number, ", ".join(missing)))
+    if params["event_outcome"] not in PREMIS_EVENT_OUTCOME_TYPES:
+        raise ValueError(
+            "Invalid event outcome on line %d: %s"
+            % (line_number, params["event_outcome"]))
+
+    if isinstance(params.get("event_target"), str):
+        params["event_target"] = [params["event_target"]]
+    for (key, length) in (("event_target", None),
+                          ("linking_objects", 2),
+                          ("linked_object_ids", 3)):
+        values = params.get(key) or ()
+        if length and any(len(value) != length for value in values):
+            raise ValueError(
+                "Each %s on line %d must have %d values"
+                % (key, line_number, length))
+        params[key] = tuple(tuple(value) if length else value
+                            for value in values)
+    if params.get("agent_identifier"):
+        params["agent_identifier"] = tuple(params["agent_identifier"])
+
+    return params
+
+
 def _resolve_agents(**attributes):
     """Resolves linked agents that can be added to the event in a few
     different ways and outputs the agent information as json.
@@ -429,24 +843,24 @@ def _resolve_agents(**attributes):
     and agent_type options are used.
     If the agent_identifier is provided, that identifier is used,
     otherwise a UUID identifier is created.
+
+    Existing agent identifiers are reused. They are given in the
+    known_agents attribute or read from the workspace.
     """
     agent_list = []
 
-    agents_filepath = os.path.join(
-        attributes["workspace"],
-        attributes["create_agent_file"] + '-AGENTS-amd.json')
-
     # Get existing agent identifiers for reuse
-    premis_agent_identifiers = get_premis_agent_identifiers(
-        attributes["workspace"]
-    )
-
-    if attributes["create_agent_file"] and os.path.exists(agents_filepath):
+    premis_agent_identifiers = attributes.get("known_agents")
+    if premis_agent_identifiers is None:
+        premis_agent_identifiers = get_premis_agent_identifiers(
+            attributes["workspace"]
+        )
 
-        with open(agents_filepath) as in_file:
-            agents = json.load(in_file)
+    if attributes["create_agent_file"] and agent_files(
+            attributes["workspace"], attributes["create_agent_file"]):
 
-        for agent in agents:
+        for agent in read_agents(attributes["workspace"],
+                                 attributes["create_agent_file"]):
             attributes["agent_name"] = agent["agent_name"]
             if 'agent_version' in agent:
                 attributes["agent_name"] = agent["agent_name"] + \
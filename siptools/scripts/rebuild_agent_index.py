@@ -0,0 +1,35 @@
+"""Command line tool for rebuilding the PREMIS agent index of a workspace"""
+
+import sys
+
+import click
+
+from siptools.scripts.premis_event import rebuild_agent_index
+
+click.disable_unicode_literals_warning = True
+
+
+@click.command()
+@click.option('--workspace',
+              type=click.Path(exists=True),
+              default='./workspace',
+              metavar='<WORKSPACE PATH>',
+              help=("Workspace directory of the PREMIS agent files. "
+                    "Defaults to ./workspace/"))
+def main(workspace):
+    """Rebuild the PREMIS agent index of the workspace from the PREMIS
+    agent files. The index is used by premis-event to reuse the
+    identifiers of existing agents. Workspaces created with older versions
+    have no index, and agent files written by other means are not in the
+    index until it is rebuilt.
+    """
+    agents = rebuild_agent_index(workspace)
+    print("Indexed %d PREMIS agents in workspace %s" % (
+        len(agents), workspace))
+
+    return 0
+
+
+if __name__ == '__main__':
+    RETVAL = main()  # pylint: disable=no-value-for-parameter
+    sys.exit(RETVAL)
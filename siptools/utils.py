@@ -1,12 +1,15 @@
 """Utilities for siptools."""
 
 import copy
+import errno
+import fnmatch
+import glob
 import hashlib
 import os
 import json
+import shutil
 import sys
-from uuid import uuid4
-from collections import defaultdict
+from uuid import NAMESPACE_URL, uuid4, uuid5
 
 import lxml.etree
 import mets
@@ -16,6 +19,20 @@ import file_scraper.scraper
 
 from urllib.parse import quote_plus, unquote_plus
 
+from siptools.xml.mets import NAMESPACES
+
+
+COPY_MODES = ['copy', 'reflink', 'hardlink', 'symlink']
+
+# Files smaller than this are copied with shutil.copyfile()
+COPY_FILE_RANGE_MIN_SIZE = 1024 * 1024
+
+# ioctl request for cloning a file, from linux/fs.h
+FICLONE = 0x40049409
+
+# Errors raised when the file system does not support a copy method
+UNSUPPORTED_COPY_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP,
+                           errno.EINVAL, errno.ENOTTY, errno.EPERM)
 
 SUPPLEMENTARY_TYPES = {
     'main': 'fi-dpres-supplementary',
@@ -78,17 +95,82 @@ def read_json_streams(filerel, workspace):
         except KeyError:
             amdrefs = []
 
-        json_name = None
-        for amdref in amdrefs:
-            json_name = os.path.join(
-                workspace, f'{amdref[1:]}-scraper.json')
-            if json_name and os.path.isfile(json_name):
-                break
+        json_name = _scraper_json_name(amdrefs, workspace)
         if json_name:
             return load_scraper_json(json_name)
     return None
 
 
+def scraper_json_files(workspace):
+    """Find the scraper JSON files of all imported digital objects.
+
+    The references of import_object are read only once, so that the
+    stream metadata of many files can be loaded without reading the
+    references for each file.
+
+    :workspace: Workspace path
+    :returns: Dict of JSON file paths by the digital object paths
+              relative to base path
+    """
+    refs = read_md_references(workspace,
+                              'import-object-md-references.jsonl') or {}
+    json_files = {}
+    for (path, ref) in refs.items():
+        if ref.get('path_type', 'file') != 'file':
+            continue
+        json_name = _scraper_json_name(ref.get('md_ids', []), workspace)
+        if json_name:
+            json_files[path] = json_name
+    return json_files
+
+
+def _scraper_json_name(amdrefs, workspace):
+    """Return the path of the first existing scraper JSON file of the
+    given metadata references, or None.
+    """
+    for amdref in amdrefs:
+        json_name = os.path.join(workspace, f'{amdref[1:]}-scraper.json')
+        if os.path.isfile(json_name):
+            return json_name
+    return None
+
+
+def collect_files(filenames, base_path=".", include=("*",)):
+    """
+    Iterate the files of the given files, directories and glob patterns.
+    The files of the directories are matched against the include
+    patterns and iterated in sorted order. Given files are always
+    included.
+
+    :filenames: Files, directories or glob patterns relative to the base
+                path
+    :base_path: Base path of the digital objects
+    :include: File name patterns of the files in the directories
+    :returns: Generator of file paths relative to the base path
+    """
+    for filename in filenames:
+        path = os.path.join(base_path, filename)
+        if glob.has_magic(filename) and not os.path.exists(path):
+            paths = [os.path.relpath(match, base_path)
+                     for match in sorted(glob.glob(path))]
+        else:
+            paths = [filename]
+
+        for filerel in paths:
+            path = os.path.join(base_path, filerel)
+            if not os.path.isdir(path):
+                yield os.path.normpath(filerel)
+                continue
+
+            for (dirpath, dirnames, files) in os.walk(path):
+                dirnames.sort()
+                reldir = os.path.relpath(dirpath, base_path)
+                for name in sorted(files):
+                    if any(fnmatch.fnmatch(name, pattern)
+                           for pattern in include):
+                        yield os.path.normpath(os.path.join(reldir, name))
+
+
 # pylint: disable=too-many-arguments
 def scrape_file(filepath, filerel=None, workspace=None, mimetype=None,
                 version=None, charset=None, skip_well_check=False,
@@ -274,33 +356,6 @@ def encode_id(text):
     return '_{}'.format(hashlib.md5(text.encode("utf-8")).hexdigest())
 
 
-def tree():
-    """Create tree dictionary data structure.
-
-    Tree is a dict whose default values are trees. See
-    https://gist.github.com/hrldcpr/2012250 for more information.
-
-    :returns: Tree dictionary data structure
-    """
-    return defaultdict(tree)
-
-
-def add(treedict, path):
-    """
-    Add new nodes in given path to tree.
-
-    :treedict: Tree dictionary
-    :path: Path to add
-    :returns: Updated tree
-    """
-    root = None
-    for node in path:
-        treedict = treedict[node]
-        root = treedict
-
-    return root
-
-
 def copy_etree(etree):
     """Copy etree recursively.
 
@@ -517,15 +572,29 @@ def get_md_references(refs_dict, path=None, stream=None, directory=None):
     return set(md_ids)
 
 
-def read_object_id(path, workspace):
+def sorted_md_ids(md_ids):
+    """Return metadata identifiers as a sorted list, so that the ID
+    reference attributes are written in the same order in every build.
+
+    :md_ids: Set of metadata identifiers or None
+    :returns: Sorted list of metadata identifiers or None
+    """
+    if md_ids is None:
+        return None
+    return sorted(md_ids)
+
+
+def read_object_id(path, workspace, object_refs=None):
     """Find PREMIS Object ID of a given file.
 
     :path: Path of file related to current path or base path.
     :workspace: Workspace path
+    :object_refs: Import-object metadata references, if already read
     :returns: Tuple of ID type and value
     """
-    object_refs = read_md_references(
-        workspace, "import-object-md-references.jsonl")
+    if not object_refs:
+        object_refs = read_md_references(
+            workspace, "import-object-md-references.jsonl")
     premis_file = "%s-PREMIS%%3AOBJECT-amd.xml" \
         % object_refs[path]["md_ids"][0][1:]
     root = lxml.etree.parse(os.path.join(workspace, premis_file))
@@ -533,6 +602,135 @@ def read_object_id(path, workspace):
         premis.parse_identifier(root))
 
 
+def read_fixity(path, workspace, object_refs=None):
+    """Find the PREMIS fixity recorded for a given file.
+
+    :path: Path of file related to current path or base path.
+    :workspace: Workspace path
+    :object_refs: Import-object metadata references, if already read
+    :returns: Tuple of message digest algorithm and message digest, or
+              None if no fixity is recorded for the file
+    """
+    if object_refs is None:
+        object_refs = read_md_references(
+            workspace, "import-object-md-references.jsonl")
+    if not object_refs or path not in object_refs:
+        return None
+
+    for md_id in object_refs[path]["md_ids"]:
+        premis_file = os.path.join(
+            workspace, "%s-PREMIS%%3AOBJECT-amd.xml" % md_id[1:])
+        if not os.path.isfile(premis_file):
+            continue
+        fixity = lxml.etree.parse(premis_file).find(
+            './/{%s}fixity' % NAMESPACES['premis'])
+        if fixity is not None:
+            return (
+                fixity.findtext('{%s}messageDigestAlgorithm'
+                                % NAMESPACES['premis']),
+                fixity.findtext('{%s}messageDigest' % NAMESPACES['premis']))
+    return None
+
+
+def copy_file(source, target, copy_mode='copy'):
+    """Copy a file to the target path.
+
+    The copy modes are:
+
+        * copy: Copy the data. Files of at least COPY_FILE_RANGE_MIN_SIZE
+          bytes are copied with os.copy_file_range(), which lets the
+          file system share the data blocks or copy them on the server
+          side, if it can.
+        * reflink: Clone the file, so that the copy shares the data blocks
+          with the source until either is modified (e.g. XFS and Btrfs).
+        * hardlink: Create a hard link to the source.
+        * symlink: Create a symbolic link to the absolute source path.
+
+    Like ``cp --reflink=auto``, reflink and hardlink modes copy the data
+    if the file system does not support them or the source and target
+    are in different file systems. An existing target is replaced,
+    unless the target path is the source file itself.
+
+    :source: Source file path
+    :target: Target file path
+    :copy_mode: One of COPY_MODES
+    """
+    if copy_mode not in COPY_MODES:
+        raise ValueError('Unknown copy mode: %s' % copy_mode)
+    if os.path.lexists(target):
+        if not os.path.islink(target) and \
+                os.path.realpath(target) == os.path.realpath(source):
+            return
+        os.remove(target)
+
+    if copy_mode == 'symlink':
+        os.symlink(os.path.abspath(source), target)
+        return
+    if copy_mode == 'hardlink':
+        try:
+            os.link(source, target)
+            return
+        except OSError as exception:
+            if exception.errno not in UNSUPPORTED_COPY_ERRNOS + (
+                    errno.EMLINK,):
+                raise
+    elif copy_mode == 'reflink':
+        if _clone_file(source, target):
+            return
+
+    _copy_file_data(source, target)
+
+
+def _clone_file(source, target):
+    """Clone a file with the FICLONE ioctl.
+
+    :source: Source file path
+    :target: Target file path
+    :returns: True if the file was cloned, False if the file system
+              does not support cloning
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    with open(source, 'rb') as infile, open(target, 'wb') as outfile:
+        try:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+            return True
+        except OSError as exception:
+            if exception.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+    return False
+
+
+def _copy_file_data(source, target):
+    """Copy the data of a file.
+
+    :source: Source file path
+    :target: Target file path
+    """
+    if not hasattr(os, 'copy_file_range') or \
+            os.path.getsize(source) < COPY_FILE_RANGE_MIN_SIZE:
+        shutil.copyfile(source, target)
+        return
+
+    with open(source, 'rb') as infile, open(target, 'wb') as outfile:
+        remaining = os.fstat(infile.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(
+                    infile.fileno(), outfile.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            return
+        except OSError as exception:
+            if exception.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+    shutil.copyfile(source, target)
+
+
 def get_file_properties(path, all_amd_refs, workspace):
     """Return file properties from the json data file.
 
@@ -615,12 +813,38 @@ def iter_supplementary(file_properties):
     return supplementary_files, supplementary_types
 
 
+def file_identifier(path, deterministic_ids=False, objid=None):
+    """Return an identifier for the file element of a file.
+
+    By default the identifier is random. Deterministic identifiers are
+    name based UUIDs derived from the encoded path of the file, and
+    from the object identifier of the package if it is given, so that
+    repeated builds of the same workspace get the same identifiers.
+
+    :path: File path
+    :deterministic_ids: True to derive the identifier from the path
+    :objid: Object identifier of the package, used with
+            deterministic identifiers only
+    :returns: File identifier
+    """
+    if not deterministic_ids:
+        return f'_{uuid4()}'
+
+    namespace = NAMESPACE_URL
+    if objid:
+        namespace = uuid5(NAMESPACE_URL, objid)
+    return f"_{uuid5(namespace, 'file://' + encode_path(path, safe='/'))}"
+
+
+# pylint: disable=too-many-arguments
 def add_file_to_filesec(all_amd_refs,
                         object_refs,
                         path,
                         filegrp,
                         properties=None,
-                        supplementary_type=None):
+                        supplementary_type=None,
+                        deterministic_ids=False,
+                        objid=None):
     """Add file element to fileGrp element given as parameter.
 
     If the file group is for content files, but the file has a
@@ -638,9 +862,14 @@ def add_file_to_filesec(all_amd_refs,
     :param properties: Properties for single file.
     :param supplementary_type: Which supplementary type the files belong
                                to.
+    :param deterministic_ids: True to derive the file identifier from
+                              the path, see file_identifier()
+    :param objid: Object identifier of the package for deterministic
+                  file identifiers
     :returns: unique identifier of file element
     """
-    fileid = f'_{uuid4()}'
+    fileid = file_identifier(path, deterministic_ids=deterministic_ids,
+                             objid=objid)
 
     # Create list of IDs of amdID elements
     amdids = get_md_references(refs_dict=all_amd_refs, path=path)
@@ -670,7 +899,7 @@ def add_file_to_filesec(all_amd_refs,
     # Create XML element and add it to fileGrp
     file_el = mets.file_elem(
         fileid,
-        admid_elements=set(amdids),
+        admid_elements=sorted_md_ids(amdids),
         loctype='URL',
         xlink_href='file://%s' % encode_path(path, safe='/'),
         xlink_type='simple',
@@ -684,7 +913,8 @@ def add_file_to_filesec(all_amd_refs,
             stream_ids = get_md_references(refs_dict=all_amd_refs,
                                            path=path,
                                            stream=stream)
-            stream_el = mets.stream(admid_elements=stream_ids)
+            stream_el = mets.stream(
+                admid_elements=sorted_md_ids(stream_ids))
             file_el.append(stream_el)
 
     filegrp.append(file_el)
@@ -714,12 +944,15 @@ def add_file_div(fptr,
     return None
 
 
+# pylint: disable=too-many-arguments
 def create_filegrp(file_ids,
                    supplementary_files,
                    all_amd_refs,
                    object_refs,
                    file_properties,
-                   supplementary_type=None):
+                   supplementary_type=None,
+                   deterministic_ids=False,
+                   objid=None):
     """Create a mets fileGrp.
 
     :param file_ids: A dict of file paths and identifiers.
@@ -733,6 +966,10 @@ def create_filegrp(file_ids,
     :param file_properties: Dictionary collection of file properties.
     :param supplementary_type: Which supplementary type the files belong
                                to.
+    :param deterministic_ids: True to derive the file identifiers from
+                              the paths, see file_identifier()
+    :param objid: Object identifier of the package for deterministic
+                  file identifiers
     :returns: A tuple of METS XML Element tree including file group
               element and a dict of file paths and identifiers
     """
@@ -750,7 +987,9 @@ def create_filegrp(file_ids,
                                      path=path,
                                      filegrp=filegrp,
                                      supplementary_type=supplementary_type,
-                                     properties=file_properties[path])
+                                     properties=file_properties[path],
+                                     deterministic_ids=deterministic_ids,
+                                     objid=objid)
         if fileid:
             file_ids[path] = fileid
     return filegrp, file_ids
@@ -106,3 +106,33 @@ def run_cli():
         return result
 
     return _run_cli
+
+
+@pytest.fixture(scope="function")
+def write_references_spy(monkeypatch):
+    """Records the reference writes of metadata creators
+
+    :monkeypatch: Pytest monkeypatch fixture
+    :returns: Function that patches the write_references method of the
+              given MetsSectionCreator subclass and returns the list of
+              the reference files written
+    """
+    def _spy(creator_class):
+        """
+        Patch the reference writes of the creator class
+
+        :param creator_class: MetsSectionCreator subclass
+        :returns: List of the written reference files, in write order
+        """
+        calls = []
+        write_references = creator_class.write_references
+
+        def _write_references(self, ref_file):
+            calls.append(ref_file)
+            write_references(self, ref_file)
+
+        monkeypatch.setattr(creator_class, 'write_references',
+                            _write_references)
+        return calls
+
+    return _spy
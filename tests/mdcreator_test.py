@@ -146,6 +146,38 @@ def test_add_mdreference(testpath, references, expected):
                 assert stream_id in created_references[path]['streams'][stream]
 
 
+def test_write_references_existing(testpath):
+    """Test that write_references merges the references with the
+    existing entries of the reference file, keeps the other entries and
+    writes each path once.
+    """
+    for (md_id, filepath) in (('abcd1234', 'path/to/file1'),
+                              ('abcd5678', 'path/to/file2')):
+        md_creator = MetsSectionCreator(testpath)
+        md_creator.add_reference(md_id=md_id, filepath=filepath)
+        md_creator.write_references('md-references.jsonl')
+
+    md_creator = MetsSectionCreator(testpath)
+    md_creator.add_reference(md_id='efgh1234', filepath='path/to/file1')
+    md_creator.add_reference(md_id='efgh5678', filepath='path/to/file3',
+                             stream='1')
+    md_creator.add_reference(md_id='abcd1234', filepath='path/to/file1')
+    md_creator.write_references('md-references.jsonl')
+
+    with open(os.path.join(testpath, 'md-references.jsonl')) as in_file:
+        paths = [list(json.loads(line))[0] for line in in_file]
+    assert sorted(paths) == ['path/to/file1', 'path/to/file2',
+                             'path/to/file3']
+
+    references = read_md_references(testpath, 'md-references.jsonl')
+    assert sorted(references['path/to/file1']['md_ids']) == [
+        'abcd1234', 'efgh1234']
+    assert references['path/to/file2']['md_ids'] == ['abcd5678']
+    assert references['path/to/file3']['streams'] == {'1': ['efgh5678']}
+    assert not os.path.exists(
+        os.path.join(testpath, 'md-references.jsonl.tmp'))
+
+
 def test_get_md_references():
     """Test get_md_references function. Reads the administrative MD IDs from
     a file.
@@ -0,0 +1,132 @@
+"""Tests for ``siptools.schema_utils`` module"""
+
+import os
+import shutil
+
+import pytest
+import lxml.etree as ET
+
+import siptools.schema_utils as schema_utils
+
+MAIN_SCHEMA = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:a="urn:a" xmlns:b="urn:b" targetNamespace="urn:a"
+    elementFormDefault="qualified">
+  <xs:import namespace="urn:b" schemaLocation="sub/b.xsd"/>
+  <xs:include schemaLocation="http://example.com/schemas/types.xsd"/>
+  <xs:element name="root">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element ref="b:item" maxOccurs="unbounded"/>
+      </xs:sequence>
+      <xs:attribute name="n" type="a:small"/>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+
+TYPES_SCHEMA = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="urn:a">
+  <xs:simpleType name="small">
+    <xs:restriction base="xs:int"><xs:maxInclusive value="5"/></xs:restriction>
+  </xs:simpleType>
+</xs:schema>"""
+
+ITEM_SCHEMA = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="urn:b">
+  <xs:element name="item" type="xs:string"/>
+</xs:schema>"""
+
+CATALOG = """<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">
+  <rewriteURI uriStartString="http://example.com/schemas/"
+              rewritePrefix="schemas/"/>
+</catalog>"""
+
+
+def _write(path, content):
+    """Write content to a file, creating the directory."""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+
+
+@pytest.fixture(scope='function')
+def schemas(testpath):
+    """Create a schema with an import and an include, and a catalog
+    mapping the schema URLs to the schema files.
+    """
+    _write(os.path.join(testpath, 'schemas', 'main.xsd'), MAIN_SCHEMA)
+    _write(os.path.join(testpath, 'schemas', 'types.xsd'), TYPES_SCHEMA)
+    _write(os.path.join(testpath, 'schemas', 'sub', 'b.xsd'), ITEM_SCHEMA)
+    _write(os.path.join(testpath, 'catalog.xml'), CATALOG)
+    return testpath
+
+
+def test_get_schema(schemas, monkeypatch):
+    """Test that the schema is resolved with the catalog, cached, and
+    compiled from the cache after the schema files are gone.
+    """
+    monkeypatch.setattr(schema_utils, '_SCHEMAS', {})
+    cache_dir = os.path.join(schemas, 'cache')
+    catalog = os.path.join(schemas, 'catalog.xml')
+    location = 'http://example.com/schemas/main.xsd'
+
+    schema = schema_utils.get_schema(location, catalog, cache_dir)
+    assert schema is schema_utils.get_schema(location, catalog, cache_dir)
+
+    valid = ET.fromstring(
+        '<root xmlns="urn:a" xmlns:b="urn:b" n="3"><b:item/></root>')
+    invalid = ET.fromstring(
+        '<root xmlns="urn:a" xmlns:b="urn:b" n="9"><b:item/></root>')
+    schema_utils.validate_mets(valid, schema)
+    with pytest.raises(ValueError) as error:
+        schema_utils.validate_mets(invalid, schema)
+    assert 'maximum value allowed' in str(error.value)
+
+    shutil.rmtree(os.path.join(schemas, 'schemas'))
+    monkeypatch.setattr(schema_utils, '_SCHEMAS', {})
+    schema = schema_utils.get_schema(location, catalog, cache_dir)
+    schema_utils.validate_mets(valid, schema)
+
+
+def test_resolve_uri(schemas):
+    """Test resolving URIs with the catalog mappings."""
+    mappings = schema_utils.read_catalog(os.path.join(schemas, 'catalog.xml'))
+    assert schema_utils.resolve_uri(
+        'http://example.com/schemas/sub/b.xsd', mappings) == \
+        os.path.join(schemas, 'schemas', 'sub/b.xsd')
+    assert schema_utils.resolve_uri(
+        'http://example.org/other.xsd', mappings) == \
+        'http://example.org/other.xsd'
+
+
+def test_get_schema_modified(schemas, monkeypatch):
+    """Test that the cached schema is resolved again after a schema file
+    or the catalog has been modified.
+    """
+    monkeypatch.setattr(schema_utils, '_SCHEMAS', {})
+    cache_dir = os.path.join(schemas, 'cache')
+    catalog = os.path.join(schemas, 'catalog.xml')
+    location = 'http://example.com/schemas/main.xsd'
+    document = ET.fromstring(
+        '<root xmlns="urn:a" xmlns:b="urn:b" n="9"><b:item/></root>')
+
+    schema = schema_utils.get_schema(location, catalog, cache_dir)
+    with pytest.raises(ValueError):
+        schema_utils.validate_mets(document, schema)
+
+    _write(os.path.join(schemas, 'schemas', 'types.xsd'),
+           TYPES_SCHEMA.replace('value="5"', 'value="10"'))
+    monkeypatch.setattr(schema_utils, '_SCHEMAS', {})
+    schema = schema_utils.get_schema(location, catalog, cache_dir)
+    schema_utils.validate_mets(document, schema)
+
+    _write(os.path.join(schemas, 'other', 'types.xsd'), TYPES_SCHEMA)
+    shutil.copy(os.path.join(schemas, 'schemas', 'main.xsd'),
+                os.path.join(schemas, 'other', 'main.xsd'))
+    shutil.copytree(os.path.join(schemas, 'schemas', 'sub'),
+                    os.path.join(schemas, 'other', 'sub'))
+    _write(catalog, CATALOG.replace('"schemas/"', '"other/"'))
+    monkeypatch.setattr(schema_utils, '_SCHEMAS', {})
+    schema = schema_utils.get_schema(location, catalog, cache_dir)
+    with pytest.raises(ValueError):
+        schema_utils.validate_mets(document, schema)
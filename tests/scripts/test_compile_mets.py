@@ -1,12 +1,13 @@
 """Tests for ``siptools.scripts.compile_mets`` module"""
 
 import os
+import pytest
 
 import lxml.etree as ET
 from siptools.scripts import (compile_mets, compile_structmap, import_object,
                               premis_event)
 from siptools.scripts.import_description import main
-from siptools.xml.mets import NAMESPACES
+from siptools.xml.mets import METS_SCHEMA, NAMESPACES
 
 
 def create_test_data(workspace, run_cli):
@@ -162,6 +163,241 @@ def test_compile_mets_cleanup_ok(testpath, run_cli):
     assert root.xpath("/mets:mets/mets:metsHdr/mets:agent/mets:name",
                       namespaces=NAMESPACES)[0].text == 'CSC'
 
+    # Only the METS document is left of the metadata files
+    assert not [name for name in os.listdir(testpath)
+                if name.endswith(('.xml', '.json', '.jsonl')) and
+                name != 'mets.xml']
+
+
+def _section_ids(root):
+    """Return the names and IDs of the METS sections and the metadata
+    sections in amdSec.
+    """
+    return [(ET.QName(elem).localname, elem.get('ID'))
+            for elem in root.xpath('/mets:mets/* | /mets:mets/mets:amdSec/*',
+                                   namespaces=NAMESPACES)]
+
+
+def test_compile_mets_streaming(testpath, run_cli):
+    """
+    Test that the streaming mode creates the same sections as the
+    default mode, with the metadata sections in the order of the METS
+    schema.
+    """
+    create_test_data(testpath, run_cli)
+    arguments = ['ch',
+                 'CSC',
+                 'urn:uuid:89e92a4f-f0e4-4768-b785-4781d3299b20',
+                 '--objid', 'ABC-123',
+                 '--create_date', '2016-10-28T09:30:55',
+                 '--workspace', testpath]
+    output_file = os.path.join(testpath, 'mets.xml')
+    parser = ET.XMLParser(remove_blank_text=True)
+
+    run_cli(compile_mets.main, arguments)
+    root = ET.parse(output_file, parser=parser).getroot()
+
+    run_cli(compile_mets.main, arguments + ['--streaming'])
+    streaming_root = ET.parse(output_file, parser=parser).getroot()
+
+    assert streaming_root.attrib == root.attrib
+    assert sorted(_section_ids(streaming_root)) == \
+        sorted(_section_ids(root))
+    assert [ET.QName(elem).localname for elem in streaming_root] == \
+        [ET.QName(elem).localname for elem in root]
+
+    md_names = [ET.QName(elem).localname for elem in streaming_root.xpath(
+        '/mets:mets/mets:amdSec/*', namespaces=NAMESPACES)]
+    assert md_names == sorted(md_names,
+                              key=compile_mets.AMDSEC_ORDER.index)
+
+    for xpath in ('/mets:mets/mets:fileSec', '/mets:mets/mets:structMap'):
+        assert ET.tostring(
+            streaming_root.xpath(xpath, namespaces=NAMESPACES)[0],
+            method='c14n', exclusive=True) == ET.tostring(
+                root.xpath(xpath, namespaces=NAMESPACES)[0],
+                method='c14n', exclusive=True)
+
+
+@pytest.mark.parametrize('streaming', [[], ['--streaming']])
+def test_compile_mets_jobs(testpath, run_cli, streaming):
+    """
+    Test that parsing the partial METS documents in several threads
+    produces the same METS document as parsing them in one thread.
+    """
+    create_test_data(testpath, run_cli)
+    arguments = ['ch',
+                 'CSC',
+                 'urn:uuid:89e92a4f-f0e4-4768-b785-4781d3299b20',
+                 '--objid', 'ABC-123',
+                 '--create_date', '2016-10-28T09:30:55',
+                 '--workspace', testpath] + streaming
+    output_file = os.path.join(testpath, 'mets.xml')
+
+    run_cli(compile_mets.main, arguments)
+    with open(output_file, 'rb') as infile:
+        expected = infile.read()
+
+    run_cli(compile_mets.main, arguments + ['--jobs', '4'])
+    with open(output_file, 'rb') as infile:
+        assert infile.read() == expected
+
+
+@pytest.mark.parametrize('copy_mode',
+                         ['copy', 'reflink', 'hardlink', 'symlink'])
+def test_compile_mets_copy_files(testpath, run_cli, copy_mode):
+    """
+    Test that the digital objects are copied to the workspace in all
+    copy modes and that the copies pass the fixity verification.
+    """
+    create_test_data(testpath, run_cli)
+    arguments = ['ch',
+                 'CSC',
+                 'urn:uuid:89e92a4f-f0e4-4768-b785-4781d3299b20',
+                 '--workspace', testpath,
+                 '--copy_files', '--copy_mode', copy_mode,
+                 '--verify_copies', '--jobs', '2']
+    run_cli(compile_mets.main, arguments)
+
+    source = 'tests/data/structured/Software files/koodi.java'
+    target = os.path.join(testpath, source)
+    with open(source, 'rb') as infile:
+        with open(target, 'rb') as copy:
+            assert copy.read() == infile.read()
+    assert os.path.islink(target) == (copy_mode == 'symlink')
+
+
+def test_compile_mets_verify_copies_fail(testpath, run_cli):
+    """
+    Test that a copy not matching the recorded PREMIS fixity fails
+    the verification.
+    """
+    create_test_data(testpath, run_cli)
+    for name in os.listdir(testpath):
+        if name.endswith('-PREMIS%3AOBJECT-amd.xml'):
+            path = os.path.join(testpath, name)
+            tree = ET.parse(path)
+            tree.find('.//{%s}messageDigest' % NAMESPACES['premis']).text \
+                = '0' * 32
+            tree.write(path)
+
+    arguments = ['ch',
+                 'CSC',
+                 'urn:uuid:89e92a4f-f0e4-4768-b785-4781d3299b20',
+                 '--workspace', testpath,
+                 '--copy_files', '--verify_copies']
+    result = run_cli(compile_mets.main, arguments, success=False)
+    assert isinstance(result.exception, ValueError)
+    assert 'does not match the recorded' in str(result.exception)
+
+
+@pytest.mark.parametrize(('required_attribute', 'valid'), [
+    ('OBJID', True),
+    ('MISSING', False)
+])
+@pytest.mark.parametrize('streaming', [[], ['--streaming']])
+def test_compile_mets_validate(testpath, run_cli, required_attribute, valid,
+                               streaming):
+    """
+    Test that --validate validates the METS document against the METS
+    schema resolved with the given catalog, and fails without writing
+    the document in default mode if it is not valid.
+    """
+    create_test_data(testpath, run_cli)
+    schema_dir = os.path.join(testpath, 'schemas')
+    os.mkdir(schema_dir)
+    with open(os.path.join(schema_dir, 'mets.xsd'), 'w') as outfile:
+        outfile.write(
+            '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+            'targetNamespace="%s"><xs:element name="mets"><xs:complexType>'
+            '<xs:sequence><xs:any processContents="skip" '
+            'maxOccurs="unbounded"/></xs:sequence>'
+            '<xs:attribute name="%s" use="required"/>'
+            '<xs:anyAttribute processContents="skip"/>'
+            '</xs:complexType></xs:element></xs:schema>'
+            % (NAMESPACES['mets'], required_attribute))
+    catalog = os.path.join(schema_dir, 'catalog.xml')
+    with open(catalog, 'w') as outfile:
+        outfile.write(
+            '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog">'
+            '<uri name="%s" uri="mets.xsd"/></catalog>' % METS_SCHEMA)
+
+    arguments = ['ch',
+                 'CSC',
+                 'urn:uuid:89e92a4f-f0e4-4768-b785-4781d3299b20',
+                 '--workspace', testpath,
+                 '--validate', '--schema_catalog', catalog,
+                 '--schema_cache', os.path.join(testpath, 'cache')]
+    result = run_cli(compile_mets.main, arguments + streaming,
+                     success=valid)
+
+    output_file = os.path.join(testpath, 'mets.xml')
+    if valid:
+        assert os.path.isfile(output_file)
+    else:
+        assert isinstance(result.exception, ValueError)
+        assert 'MISSING' in str(result.exception)
+        assert os.path.isfile(output_file) == bool(streaming)
+
+
+def _amdsec_parts(count):
+    """Create partial amdSec elements with one metadata section each.
+    """
+    md_types = ['digiprovMD', 'techMD', 'rightsMD']
+    parts = []
+    for index in range(count):
+        amdsec = ET.Element('{%s}amdSec' % NAMESPACES['mets'])
+        ET.SubElement(amdsec, '{%s}%s' % (NAMESPACES['mets'],
+                                          md_types[index % 3]),
+                      ID='_%d' % index)
+        parts.append(amdsec)
+    return parts
+
+
+def test_merge_sections():
+    """
+    Test that merge_sections() moves all metadata sections to one
+    amdSec in the order of the METS schema and orders the sections.
+    """
+    structmap = ET.Element('{%s}structMap' % NAMESPACES['mets'])
+    dmdsec = ET.Element('{%s}dmdSec' % NAMESPACES['mets'])
+    filesec = ET.Element('{%s}fileSec' % NAMESPACES['mets'])
+    amdsecs = _amdsec_parts(6)
+
+    merged = compile_mets.merge_sections(
+        [structmap] + amdsecs[:3] + [filesec, dmdsec] + amdsecs[3:])
+
+    assert merged == [dmdsec, amdsecs[0], filesec, structmap]
+    assert [(ET.QName(elem).localname, elem.get('ID'))
+            for elem in amdsecs[0]] == [
+                ('techMD', '_1'), ('techMD', '_4'),
+                ('rightsMD', '_2'), ('rightsMD', '_5'),
+                ('digiprovMD', '_0'), ('digiprovMD', '_3')]
+
+
+@pytest.mark.parametrize('count', [2000, 20000])
+def test_merge_sections_scaling(monkeypatch, count):
+    """
+    Test that merge_sections() inspects each partial amdSec element and
+    metadata section once, so the work grows linearly with the number
+    of sections, and that all the metadata sections are merged.
+    """
+    parts = _amdsec_parts(count)
+    names = []
+    qname = ET.QName
+
+    def _qname(element):
+        names.append(element)
+        return qname(element)
+
+    monkeypatch.setattr(compile_mets.lxml.etree, 'QName', _qname)
+    merged = compile_mets.merge_sections(parts)
+    monkeypatch.undo()
+
+    assert len(names) == 2 * count
+    assert merged == [parts[0]]
+    assert len(parts[0]) == count
+
 
 def test_compile_mets_fail(testpath, run_cli):
     """
@@ -179,3 +415,23 @@ def test_compile_mets_fail(testpath, run_cli):
                  '--workspace', testpath]
     result = run_cli(compile_mets.main, arguments, success=False)
     assert isinstance(result.exception, SystemExit)
+
+
+def test_clean_metsparts(testpath):
+    """Test that the METS parts and the workspace indexes are removed
+    from the workspace, and the other files are kept.
+    """
+    removed = ['a-PREMIS%3AOBJECT-amd.xml', 'dmdsec.xml', 'structmap.xml',
+               'filesec.xml', 'import-object-md-references.jsonl',
+               'a-scraper.json', 'import-description-AGENTS-amd.jsonl',
+               'b-AGENTS-amd.json', 'premis-agent-index.jsonl',
+               'premis-event-catalog.jsonl']
+    kept = ['mets.xml', 'signature.sig', 'events.jsonl']
+    os.makedirs(os.path.join(testpath, 'data'))
+    for name in removed + kept + ['data/file.txt']:
+        with open(os.path.join(testpath, name), 'w') as out_file:
+            out_file.write('x')
+
+    compile_mets.clean_metsparts(testpath)
+    assert sorted(os.listdir(testpath)) == sorted(kept + ['data'])
+    assert os.listdir(os.path.join(testpath, 'data')) == ['file.txt']
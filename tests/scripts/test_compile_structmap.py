@@ -2,6 +2,7 @@
 
 import os
 import shutil
+import sys
 
 import file_scraper.scraper
 import lxml.etree
@@ -359,6 +360,185 @@ def test_get_fileid():
         filegrp, 'path/to/file name1', file_ids={}) == 'identifier1'
 
 
+def test_create_div_deep_structure():
+    """Test that create_div handles directory structures deeper than
+    the recursion limit.
+    """
+    depth = sys.getrecursionlimit() + 100
+    path = '/'.join(['dir'] * depth + ['file.txt'])
+    container_div = mets.div(type_attr='directory')
+
+    compile_structmap.create_div(
+        divs=compile_structmap.div_structure(filelist=[path],
+                                             supplementary_files={},
+                                             supplementary_types=set(),
+                                             is_supplementary=False),
+        parent=container_div,
+        filesec=None,
+        all_amd_refs={},
+        all_dmd_refs={},
+        supplementary_files={},
+        file_ids={path: '_file'},
+        structmap_type='Directory-physical',
+        workspace=None,
+        file_properties={path: {}})
+
+    divs = list(container_div.iter('{%s}div' % NAMESPACES['mets']))
+    assert len(divs) == depth + 1
+    assert divs[-1].get('LABEL') == 'dir'
+    assert divs[-1][0].get('FILEID') == '_file'
+
+
+def test_create_div_order():
+    """Test that create_div adds the fptr elements, the file divs and the
+    directory divs in the order of the sorted file list.
+    """
+    filelist = sorted(['a/x', 'a b/x', 'a/b/x', 'a/a.txt', 'a/c.txt',
+                       'b.txt'])
+    file_ids = {path: '_%s' % num for num, path in enumerate(filelist)}
+    file_properties = {path: {} for path in filelist}
+    file_properties['a/c.txt'] = {'order': '1'}
+    container_div = mets.div(type_attr='directory')
+
+    compile_structmap.create_div(
+        divs=compile_structmap.div_structure(filelist=filelist,
+                                             supplementary_files={},
+                                             supplementary_types=set(),
+                                             is_supplementary=False),
+        parent=container_div,
+        filesec=None,
+        all_amd_refs={},
+        all_dmd_refs={},
+        supplementary_files={},
+        file_ids=file_ids,
+        structmap_type='Directory-physical',
+        workspace=None,
+        file_properties=file_properties)
+
+    assert [elem.get('FILEID') or elem.get('LABEL')
+            for elem in container_div] == [file_ids['b.txt'], 'a b', 'a']
+    a_div = container_div[2]
+    assert [elem.get('FILEID') or elem.get('TYPE') for elem in a_div] == [
+        file_ids['a/a.txt'], file_ids['a/x'], 'file', 'directory']
+    assert a_div[2][0].get('FILEID') == file_ids['a/c.txt']
+    assert a_div[3][0].get('FILEID') == file_ids['a/b/x']
+
+
+def _normalized_section(section_file):
+    """Return a METS section file as a string that does not depend on
+    the random file identifiers or the order of the referenced IDs.
+    The ADMID of the root div is left out, since each run of
+    compile_structmap adds a new creation event to it.
+    """
+    root = lxml.etree.parse(section_file).getroot()
+    hrefs = {}
+    for file_elem in root.xpath('//mets:file', namespaces=NAMESPACES):
+        hrefs[file_elem.get('ID')] = file_elem.xpath(
+            'mets:FLocat/@xlink:href', namespaces=NAMESPACES)[0]
+        file_elem.set('ID', hrefs[file_elem.get('ID')])
+    for elem in root.iter():
+        for attribute in ('ADMID', 'DMDID'):
+            if elem.get(attribute):
+                elem.set(attribute,
+                         ' '.join(sorted(elem.get(attribute).split())))
+    root_divs = root.xpath('mets:structMap/mets:div', namespaces=NAMESPACES)
+    for root_div in root_divs:
+        root_div.attrib.pop('ADMID', None)
+    return lxml.etree.tostring(root)
+
+
+def _file_hrefs(workspace):
+    """Return a dict of file identifiers and hrefs in the fileSec."""
+    root = lxml.etree.parse(os.path.join(workspace, 'filesec.xml'))
+    return {file_elem.get('ID'): file_elem.xpath(
+        'mets:FLocat/@xlink:href', namespaces=NAMESPACES)[0]
+            for file_elem in root.xpath('//mets:file',
+                                        namespaces=NAMESPACES)}
+
+
+@pytest.mark.parametrize('structmap_type', [None, 'Directory-physical'])
+def test_compile_structmap_incremental(testpath, run_cli, structmap_type):
+    """Test that updating the fileSec and structMap with new and changed
+    files gives the same result as compiling them from scratch, and
+    that the unchanged files keep their identifiers.
+    """
+    type_args = []
+    if structmap_type:
+        type_args = ['--structmap_type', structmap_type]
+
+    for path in ['tests/data/structured/Software files/koodi.java',
+                 'tests/data/structured/Documentation files/readme.txt']:
+        run_cli(import_object.main, [
+            '--workspace', testpath, '--skip_wellformed_check', path])
+    run_cli(compile_structmap.main, ['--workspace', testpath] + type_args)
+    old_hrefs = _file_hrefs(testpath)
+
+    # Append new files, one of them with an order, and add an event to
+    # an existing file
+    run_cli(import_object.main, [
+        '--workspace', testpath, '--skip_wellformed_check',
+        'tests/data/structured/Publication files/publication.txt',
+        'tests/data/structured/Documentation files/Notebook/notes.txt'])
+    run_cli(import_object.main, [
+        '--workspace', testpath, '--skip_wellformed_check',
+        '--order', '2',
+        'tests/data/structured/Documentation files/Other files/this.txt'])
+    run_cli(premis_event.main, [
+        'creation', '2016-10-13T12:30:55',
+        '--event_outcome_detail', 'Test ok',
+        '--event_detail', 'Testing', '--event_outcome', 'success',
+        '--workspace', testpath, '--event_target',
+        'tests/data/structured/Software files/koodi.java'])
+
+    run_cli(compile_structmap.main,
+            ['--workspace', testpath, '--incremental'] + type_args)
+    incremental = [_normalized_section(os.path.join(testpath, name))
+                   for name in ('filesec.xml', 'structmap.xml')]
+    new_hrefs = _file_hrefs(testpath)
+    assert len(new_hrefs) == 5
+    for fileid, href in old_hrefs.items():
+        assert new_hrefs[fileid] == href
+
+    run_cli(compile_structmap.main, ['--workspace', testpath] + type_args)
+    full = [_normalized_section(os.path.join(testpath, name))
+            for name in ('filesec.xml', 'structmap.xml')]
+    assert incremental == full
+
+
+def test_compile_structmap_incremental_fallback(testpath, run_cli):
+    """Test that the fileSec and structMap are compiled from scratch
+    when there are no existing files to update.
+    """
+    create_test_data(testpath, run_cli)
+    run_cli(compile_structmap.main, ['--workspace', testpath,
+                                     '--incremental'])
+
+    assert len(_file_hrefs(testpath)) == 1
+    assert os.path.isfile(os.path.join(testpath, 'structmap.xml'))
+
+
+def test_compile_structmap_deterministic_ids(testpath, run_cli):
+    """Test that repeated builds with --deterministic_ids give the same
+    file section and file identifiers.
+    """
+    create_test_data(testpath, run_cli)
+    args = ['--workspace', testpath, '--deterministic_ids',
+            '--objid', 'test-objid']
+
+    run_cli(compile_structmap.main, args)
+    with open(os.path.join(testpath, 'filesec.xml'), 'rb') as infile:
+        filesec = infile.read()
+    fileids = list(_file_hrefs(testpath))
+
+    run_cli(compile_structmap.main, args)
+    with open(os.path.join(testpath, 'filesec.xml'), 'rb') as infile:
+        assert infile.read() == filesec
+
+    sm_root = lxml.etree.parse(os.path.join(testpath, 'structmap.xml'))
+    assert sm_root.xpath('//mets:fptr/@FILEID',
+                         namespaces=NAMESPACES) == fileids
+
+
 @pytest.mark.parametrize(
     [
         'grade',
@@ -8,7 +8,9 @@ import lxml.etree as ET
 import premis
 
 from siptools.utils import read_md_references, get_file_properties
-from siptools.ead_utils import add_fptrs_div_ead, collect_dao_hrefs
+from siptools.ead_utils import (add_fptrs_div_ead, build_href_index,
+                                collect_dao_hrefs, compile_ead3_structmap,
+                                resolve_href)
 from siptools.scripts import compile_structmap, import_object
 from siptools.xml.mets import NAMESPACES
 
@@ -157,6 +159,57 @@ def test_collect_dao_hrefs():
     assert hrefs == [('file1.txt', None), ('file2.txt', None)]
 
 
+@pytest.mark.parametrize(
+    ('href', 'expected'),
+    [('a/b/c.txt', 'a/b/c.txt'),
+     ('b/c.txt', 'a/b/c.txt'),
+     ('d.txt', 'y/d.txt'),
+     ('d.tx', 'x/ad.txt'),
+     ('e/f', 'y/e/f.txt'),
+     ('g/c.txt', None)],
+    ids=('Exact path', 'End of path', 'File name',
+         'Substring of file name', 'Substring of path', 'No matching file')
+)
+def test_resolve_href(href, expected):
+    """Tests that resolve_href finds the file whose path ends with the
+    whole path segments of the href, or else the first file whose path
+    contains the href.
+    """
+    file_properties = {'a/b/c.txt': None, 'x/ad.txt': None,
+                       'y/d.txt': None, 'y/e/f.txt': None}
+    href_index = build_href_index(file_properties)
+    assert resolve_href(href, file_properties, href_index) == expected
+
+
+def test_resolve_href_ambiguous(capsys):
+    """Tests that an href matching several files resolves to the first
+    one, every time with a message, and that an exact match is not
+    ambiguous.
+    """
+    file_properties = {'a/b/c.txt': None, 'y/b/c.txt': None,
+                       'b/c.txt': None}
+    href_index = build_href_index(file_properties)
+
+    for _ in range(2):
+        assert resolve_href('c.txt', file_properties,
+                            href_index) == 'a/b/c.txt'
+    assert capsys.readouterr().out.count(
+        "EAD3 dao href 'c.txt' matches several files: a/b/c.txt, "
+        "y/b/c.txt, b/c.txt. Using file 'a/b/c.txt'.") == 2
+
+    assert resolve_href('b/c.txt', file_properties,
+                        href_index) == 'b/c.txt'
+    assert resolve_href('c.tx', file_properties, href_index) == 'a/b/c.txt'
+    assert "EAD3 dao href 'c.tx' matches several files: a/b/c.txt, " \
+        "y/b/c.txt, b/c.txt." in capsys.readouterr().out
+
+    # A path ending with the href is preferred to a path containing it
+    file_properties = {'x/ab.txt': None, 'y/b.txt': None}
+    assert resolve_href('b.txt', file_properties,
+                        build_href_index(file_properties)) == 'y/b.txt'
+    assert capsys.readouterr().out == ''
+
+
 @pytest.mark.parametrize(
     ('hrefs', 'length', 'child_elem', 'order'),
     [([('koodi.java', None)], 1, 'div', True),
@@ -219,6 +272,155 @@ def test_add_fptrs_div_ead(testpath, run_cli, hrefs, length, child_elem,
         assert 'ORDER' not in c_div.attrib
 
 
+def test_add_fptrs_div_ead_same_file():
+    """Tests that daos referring to the same file share one file element
+    and identifier, also with deterministic file identifiers.
+    """
+    path = 'tests/data/structured/Software files/koodi.java'
+    all_amd_refs = {path: {'path_type': 'file', 'streams': {},
+                           'md_ids': ['_amd']}}
+    file_properties = {path: None}
+
+    filegrp = mets.filegrp()
+    added_file_ids = {}
+    divs = []
+    for hrefs in ([('koodi.java', None), ('koodi.java', None)],
+                  [('Software files/koodi.java', None)]):
+        divs.append(add_fptrs_div_ead(
+            mets.div(type_attr='c'), hrefs, filegrp,
+            all_amd_refs=all_amd_refs, object_refs=all_amd_refs,
+            file_properties=file_properties, deterministic_ids=True,
+            added_file_ids=added_file_ids))
+
+    assert len(filegrp) == 1
+    fileids = [fptr.get('FILEID') for div in divs
+               for fptr in div.iter('{%s}fptr' % NAMESPACES['mets'])]
+    assert fileids == [filegrp[0].get('ID')] * 3
+    assert added_file_ids == {path: filegrp[0].get('ID')}
+
+
+def test_add_fptrs_div_ead_unresolved(capsys):
+    """Tests that an href matching no file is reported with the daos
+    after it, which get no file pointers.
+    """
+    path = 'tests/data/structured/Software files/koodi.java'
+    all_amd_refs = {path: {'path_type': 'file', 'streams': {},
+                           'md_ids': ['_amd']}}
+    file_properties = {path: None}
+
+    filegrp = mets.filegrp()
+    div = add_fptrs_div_ead(
+        mets.div(type_attr='c'),
+        [('koodi.java', None), ('missing.txt', None), ('koodi', None)],
+        filegrp, all_amd_refs=all_amd_refs, object_refs=all_amd_refs,
+        file_properties=file_properties, added_file_ids={})
+
+    assert len(div) == 1
+    assert "EAD3 dao href 'missing.txt' does not match any file. No file " \
+        "pointer created for it or the following daos: koodi." in \
+        capsys.readouterr().out
+
+
+NESTED_EAD3 = """<ead xmlns="http://ead3.archivists.org/schema/">
+  <control/>
+  <archdesc level="fonds">
+    <did><dao daotype="derived" href="archdesc.txt"/></did>
+    <dsc>
+      <head>Contents</head>
+      <c01 level="series">
+        <did>
+          <unittitle>Series</unittitle>
+          <dao daotype="derived" href="/data/a.txt"/>
+          <daoset label="set1">
+            <dao daotype="derived" href="b.txt"/>
+            <dao daotype="derived" href="data/c.txt"/>
+          </daoset>
+          <dao daotype="derived" href="e.txt" label="e"/>
+        </did>
+        <c02 otherlevel="sub">
+          <did><dao daotype="derived" href="d.txt"/></did>
+          <c03>
+            <did>
+              <daoset><dao daotype="derived" href="f.txt"/></daoset>
+            </did>
+          </c03>
+          <dao daotype="derived" href="g.txt"/>
+        </c02>
+        <c02 level="file"/>
+      </c01>
+      <c level="series"><did><dao daotype="derived" href="g.txt"/></did></c>
+    </dsc>
+  </archdesc>
+</ead>"""
+
+
+def test_compile_ead3_structmap_nested(testpath):
+    """Tests the divs and fptrs created from nested c elements, daoset
+    elements and dao elements of did elements. The expected structure
+    is the output of the parser that read the whole EAD3 tree at once:
+    the divs of the child c elements come first, then the daoset divs
+    and last the fptrs of the dao elements of the did element.
+    """
+    dmdsec_loc = os.path.join(testpath, 'ead3.xml')
+    with open(dmdsec_loc, 'w') as outfile:
+        outfile.write(NESTED_EAD3)
+
+    files = ['data/a.txt', 'data/b.txt', 'data/c.txt', 'data/d.txt',
+             'data/e.txt', 'data/f.txt', 'data/g.txt', 'archdesc.txt']
+    all_amd_refs = {path: {'path_type': 'file', 'streams': {},
+                           'md_ids': ['_amd']} for path in files}
+    file_properties = {path: {'bit_level': False, 'grade': None,
+                              'supplementary': None} for path in files}
+    file_properties['data/b.txt']['order'] = '2'
+    file_properties['data/c.txt']['order'] = '1'
+
+    (structmap, filesec, _) = compile_ead3_structmap(
+        dmdsec_loc=dmdsec_loc, workspace=testpath,
+        all_amd_refs=all_amd_refs, all_dmd_refs=all_amd_refs,
+        object_refs=all_amd_refs, file_properties=file_properties,
+        supplementary_files={}, supplementary_types=set(),
+        deterministic_ids=True)
+
+    hrefs = {}
+    for file_elem in filesec.iter('{%s}file' % NAMESPACES['mets']):
+        hrefs[file_elem.get('ID')] = file_elem[0].get(
+            '{%s}href' % NAMESPACES['xlink'])
+    assert list(hrefs.values()) == [
+        'file://data/f.txt', 'file://data/d.txt', 'file://data/b.txt',
+        'file://data/c.txt', 'file://data/a.txt', 'file://data/e.txt',
+        'file://data/g.txt']
+
+    def _walk(parent, depth=0):
+        for elem in parent:
+            if elem.tag == '{%s}div' % NAMESPACES['mets']:
+                yield (depth, elem.get('TYPE'), elem.get('LABEL'),
+                       elem.get('ORDER'))
+                yield from _walk(elem, depth + 1)
+            else:
+                yield (depth, 'fptr', hrefs[elem.get('FILEID')])
+
+    container_div = structmap.getroot()[0][0]
+    assert list(_walk(container_div)) == [
+        (0, 'archdesc', 'fonds', None),
+        (1, 'c01', 'series', None),
+        (2, 'c02', 'sub', None),
+        (3, 'c03', 'c03', None),
+        (4, 'daoset', 'daoset', None),
+        (5, 'fptr', 'file://data/f.txt'),
+        (3, 'fptr', 'file://data/d.txt'),
+        (2, 'c02', 'file', None),
+        (2, 'daoset', 'set1', None),
+        (3, 'dao', None, '2'),
+        (4, 'fptr', 'file://data/b.txt'),
+        (3, 'dao', None, '1'),
+        (4, 'fptr', 'file://data/c.txt'),
+        (2, 'fptr', 'file://data/a.txt'),
+        (2, 'dao', 'e', None),
+        (3, 'fptr', 'file://data/e.txt'),
+        (1, 'c', 'series', None),
+        (2, 'fptr', 'file://data/g.txt')]
+
+
 def test_compile_structmap_supplementary(testpath, run_cli):
     """Tests the successful compilation of EAD based mets structmap
     with supplementary files. The test assert that a supplementary
@@ -252,3 +454,58 @@ def test_compile_structmap_supplementary(testpath, run_cli):
         "mets:file[mets:FLocat/"
         "@xlink:href='file://tests/data/mets_valid_minimal.xml']",
         namespaces=NAMESPACES)[0].get('ID') == fileid
+
+
+def test_compile_structmap_multiple_types(testpath, run_cli):
+    """Tests the compilation of an EAD3 based structMap and a directory
+    based structMap in one run. The structMaps must be written to their
+    own files and refer to the same shared fileSec.
+    """
+    path = 'tests/data/import_description/metadata/ead3_test.xml'
+    create_test_data(testpath, run_cli)
+    arguments = [
+        '--structmap_type', 'Directory-physical',
+        '--structmap_type', 'EAD3-logical',
+        '--dmdsec_loc', path, '--workspace', testpath]
+    run_cli(compile_structmap.main, arguments)
+
+    fs_root = ET.parse(os.path.join(testpath, 'filesec.xml')).getroot()
+    file_ids = fs_root.xpath(
+        '/mets:mets/mets:fileSec/mets:fileGrp/mets:file/@ID',
+        namespaces=NAMESPACES)
+    assert len(file_ids) == 3
+
+    sm_root = ET.parse(os.path.join(testpath, 'structmap.xml')).getroot()
+    assert sm_root.xpath(
+        '/mets:mets/mets:structMap/@TYPE',
+        namespaces=NAMESPACES) == ['Directory-physical']
+    assert sorted(sm_root.xpath(
+        '//mets:fptr/@FILEID', namespaces=NAMESPACES)) == sorted(file_ids)
+
+    ead_sm_root = ET.parse(
+        os.path.join(testpath, 'EAD3-logical-structmap.xml')).getroot()
+    assert ead_sm_root.xpath(
+        '/mets:mets/mets:structMap/@TYPE',
+        namespaces=NAMESPACES) == ['EAD3-logical']
+    ead_fileids = ead_sm_root.xpath(
+        '//mets:fptr/@FILEID', namespaces=NAMESPACES)
+    assert len(ead_fileids) == 2
+    assert set(ead_fileids) <= set(file_ids)
+
+    # Only one event is created for both structMaps
+    references = read_md_references(testpath,
+                                    'premis-event-md-references.jsonl')
+    outcome_details = []
+    for amdref in references['.']['md_ids']:
+        output = os.path.join(
+            testpath, amdref[1:] + '-PREMIS%3AEVENT-amd.xml')
+        if not os.path.exists(output):
+            continue
+        event_root = ET.parse(output).getroot()
+        if premis.parse_event_type(event_root) == 'creation':
+            outcome_details.extend(event_root.xpath(
+                '//premis:eventOutcomeDetailNote/text()',
+                namespaces=NAMESPACES))
+    assert outcome_details == [
+        'Created METS structural maps of types Directory-physical, '
+        'EAD3-logical']
@@ -2,6 +2,9 @@
 Test TAR packaging.
 """
 
+import gzip
+import hashlib
+import json
 import os
 import tarfile
 import subprocess
@@ -85,3 +88,181 @@ def test_exclude_cwd(testpath):
     with tarfile.open(output) as tar:
         for name in tar.getnames():
             assert not name.endswith(".tif")
+
+
+def _create_workspace(workspace, objects):
+    """
+    Create a workspace with METS document, signature and import-object
+    references to the given objects.
+    """
+    with open(os.path.join(workspace, 'mets.xml'), 'w') as outfile:
+        outfile.write('<mets/>')
+    with open(os.path.join(workspace, 'signature.sig'), 'w') as outfile:
+        outfile.write('signature')
+    with open(os.path.join(
+            workspace, 'import-object-md-references.jsonl'), 'w') as outfile:
+        for index, path in enumerate(objects):
+            outfile.write(json.dumps({path: {
+                'path_type': 'file', 'streams': {},
+                'md_ids': ['_id%d' % index]}}) + '\n')
+
+
+def test_compress_base_path(testpath, run_cli):
+    """
+    Test that with --base_path the METS document, signature and the
+    digital objects are added to the TAR file in a deterministic order
+    directly from the base path.
+    """
+    objects = ['structured/Software files/koodi.java',
+               'structured/Documentation files/readme.txt',
+               'images/tiff1.tif']
+    _create_workspace(testpath, objects)
+    base_path = os.path.join(os.path.dirname(__file__), '..', 'data')
+    output = os.path.join(testpath, 'sip.tar')
+    arguments = [testpath, '--tar_filename', output,
+                 '--base_path', base_path]
+
+    run_cli(siptools.scripts.compress.main, arguments)
+
+    with tarfile.open(output) as tar:
+        assert tar.getnames() == [
+            '.', './mets.xml', './signature.sig',
+            './images', './images/tiff1.tif',
+            './structured', './structured/Documentation files',
+            './structured/Documentation files/readme.txt',
+            './structured/Software files',
+            './structured/Software files/koodi.java']
+        for path in objects:
+            with open(os.path.join(base_path, path), 'rb') as infile:
+                assert tar.extractfile('./' + path).read() == infile.read()
+
+
+def test_compress_base_path_exclude(testpath, run_cli):
+    """
+    Test excluding files and directories with --base_path.
+    """
+    _create_workspace(testpath, ['structured/Software files/koodi.java',
+                                 'images/tiff1.tif', 'images/tiff2.tif'])
+    base_path = os.path.join(os.path.dirname(__file__), '..', 'data')
+    output = os.path.join(testpath, 'sip.tar')
+    arguments = [testpath, '--tar_filename', output,
+                 '--base_path', base_path,
+                 '--exclude', '*.sig', '--exclude', 'Software files']
+
+    run_cli(siptools.scripts.compress.main, arguments)
+
+    with tarfile.open(output) as tar:
+        assert tar.getnames() == [
+            '.', './mets.xml', './images', './images/tiff1.tif',
+            './images/tiff2.tif', './structured']
+
+
+def test_compress_base_path_no_mets(testpath, run_cli):
+    """
+    Test that --base_path fails without METS document in workspace.
+    """
+    arguments = [testpath, '--tar_filename',
+                 os.path.join(testpath, 'sip.tar'), '--base_path', '.']
+    result = run_cli(siptools.scripts.compress.main, arguments,
+                     success=False)
+    assert isinstance(result.exception, IOError)
+
+
+def test_compress_manifest(testpath, run_cli):
+    """
+    Test that --manifest lists the checksums of all files in the TAR
+    file.
+    """
+    dir_to_tar = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..', 'data', 'structured'))
+    output = os.path.join(testpath, 'sip.tar')
+    manifest = os.path.join(testpath, 'manifest.txt')
+    arguments = [dir_to_tar, '--tar_filename', output,
+                 '--manifest', manifest, '--manifest_algorithm', 'SHA-256']
+
+    run_cli(siptools.scripts.compress.main, arguments)
+
+    with open(manifest) as infile:
+        lines = infile.read().splitlines()
+    with tarfile.open(output) as tar:
+        expected = ['%s  %s' % (
+            hashlib.sha256(tar.extractfile(member).read()).hexdigest(),
+            member.name) for member in tar.getmembers() if member.isfile()]
+    assert len(expected) > 1
+    assert lines == expected
+
+
+def test_compress_progress(testpath):
+    """
+    Test that the progress function is called after each member with
+    the numbers of members and bytes added, and when the TAR file is
+    finished.
+    """
+    dir_to_tar = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..', 'data', 'structured'))
+    output = os.path.join(testpath, 'sip.tar')
+    events = []
+
+    siptools.scripts.compress.compress(
+        dir_to_tar, output,
+        progress=lambda *event: events.append(event))
+
+    with tarfile.open(output) as tar:
+        members = tar.getmembers()
+    assert [event[2] for event in events] == \
+        [member.name for member in members] + [None]
+    assert [event[0] for event in events] == \
+        list(range(1, len(members) + 1)) + [len(members)]
+    assert events[-1][1] == sum(member.size for member in members)
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz'])
+def test_compress_compression(testpath, run_cli, compression):
+    """
+    Test that the compressed TAR file contains the same data as the
+    uncompressed TAR file, is readable with tarfile and the stock tools,
+    and does not depend on the number of threads.
+    """
+    dir_to_tar = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), '..', 'data', 'structured'))
+    plain = os.path.join(testpath, 'sip.tar')
+    run_cli(siptools.scripts.compress.main,
+            [dir_to_tar, '--tar_filename', plain])
+
+    outputs = []
+    for jobs in ['1', '3']:
+        output = os.path.join(testpath, 'sip%s.tar.%s' % (jobs, compression))
+        run_cli(siptools.scripts.compress.main,
+                [dir_to_tar, '--tar_filename', output,
+                 '--compression', compression, '--jobs', jobs])
+        with open(output, 'rb') as infile:
+            outputs.append(infile.read())
+    assert outputs[0] == outputs[1]
+
+    with open(plain, 'rb') as infile:
+        expected = infile.read()
+    command = [compression, '-dc', output]
+    assert subprocess.check_output(command) == expected
+    with tarfile.open(output) as tar:
+        with tarfile.open(plain) as plain_tar:
+            assert tar.getnames() == plain_tar.getnames()
+
+
+def test_block_compressor(testpath):
+    """
+    Test that BlockCompressor writes several gzip members, which
+    decompress to the data written.
+    """
+    data = os.urandom(2 * 1024 * 1024 + 123) * 2
+    output = os.path.join(testpath, 'data.gz')
+    with open(output, 'wb') as outfile:
+        with siptools.scripts.compress.BlockCompressor(
+                outfile, 'gzip', jobs=2) as compressor:
+            for index in range(0, len(data), 100000):
+                compressor.write(data[index:index + 100000])
+            assert compressor.tell() == len(data)
+
+    with open(output, 'rb') as infile:
+        compressed = infile.read()
+    assert compressed.count(b'\x1f\x8b\x08') >= 4
+    assert gzip.decompress(compressed) == data
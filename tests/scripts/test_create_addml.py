@@ -1,12 +1,14 @@
 """Tests for ``siptools.scripts.create_addml`` module"""
 
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
 import lxml.etree as ET
 import siptools.scripts.create_addml as create_addml
-from siptools.utils import decode_path, read_md_references
+from siptools.utils import decode_path, generate_digest, read_md_references
 
 CSV_FILE = "tests/data/csvfile.csv"
 DELIMITER = ";"
@@ -209,3 +211,153 @@ def _create_addml(testpath, isheader):
     })
 
     creator.write()
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_create_addml_batch(testpath, run_cli, write_references_spy,
+                            jobs):
+    """Test creating ADDML metadata for the CSV files of a directory in
+    one run, with one write of the references.
+    """
+    csv_dir = os.path.join(testpath, 'data', 'csvs')
+    os.makedirs(os.path.join(csv_dir, 'sub'))
+    for (name, content) in (('a.csv', '1,2,3\n4,5,6\n'),
+                            ('sub/c.csv', '1,2,3\n7,8,9\n'),
+                            ('d.csv', 'x,y\n1,2\n'),
+                            ('e.txt', 'not,a,csv\n')):
+        with open(os.path.join(csv_dir, name), 'w') as out_file:
+            out_file.write(content)
+
+    calls = write_references_spy(create_addml.AddmlCreator)
+
+    run_cli(create_addml.main, [
+        '--delim', ',', '--charset', CHARSET, '--header',
+        '--sep', RECORDSEPARATOR, '--quot', QUOTINGCHAR,
+        '--workspace', testpath, '--base_path',
+        os.path.join(testpath, 'data'), '--jobs', jobs, 'csvs'])
+
+    assert calls == ['create-addml-md-references.jsonl']
+    references = read_md_references(testpath,
+                                    'create-addml-md-references.jsonl')
+    assert sorted(references) == ['csvs/a.csv', 'csvs/d.csv',
+                                  'csvs/sub/c.csv']
+    assert references['csvs/a.csv']['md_ids'] == \
+        references['csvs/sub/c.csv']['md_ids']
+    assert references['csvs/a.csv']['md_ids'] != \
+        references['csvs/d.csv']['md_ids']
+
+    amd_files = [name for name in os.listdir(testpath)
+                 if name.endswith('-ADDML-amd.xml')]
+    assert len(amd_files) == 2
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+@pytest.mark.parametrize(('content', 'message'), [
+    (b'', 'The file is empty'),
+    (b'a,b\n\xff\xfe,c\n', "can't decode byte"),
+])
+def test_create_addml_batch_errors(testpath, run_cli, jobs, content,
+                                   message):
+    """Test that the errors of reading a CSV file in a batch name the
+    file, also when the headers are read in worker processes.
+    """
+    csv_dir = os.path.join(testpath, 'data', 'csvs')
+    os.makedirs(csv_dir)
+    for (name, data) in (('a.csv', b'1,2,3\n'), ('b.csv', content)):
+        with open(os.path.join(csv_dir, name), 'wb') as out_file:
+            out_file.write(data)
+
+    result = run_cli(create_addml.main, [
+        '--delim', ',', '--charset', CHARSET, '--header',
+        '--sep', RECORDSEPARATOR, '--quot', QUOTINGCHAR, '--sniff',
+        '--workspace', testpath, '--base_path',
+        os.path.join(testpath, 'data'), '--jobs', jobs, 'csvs'],
+        success=False)
+    assert isinstance(result.exception, ValueError)
+    assert 'CSV file %s' % os.path.join(testpath, 'data', 'csvs',
+                                        'b.csv') in str(result.exception)
+    assert message in str(result.exception)
+
+
+def test_create_addml_existing_flat_files(testpath):
+    """Test that the flatFile elements of later runs are added to the
+    existing METS XML file without duplicates, and that the file name
+    digest is generated without the flatFile elements.
+    """
+    attributes = {
+        "delimiter": ",", "isheader": False, "charset": CHARSET,
+        "record_separator": RECORDSEPARATOR, "quoting_char": QUOTINGCHAR
+    }
+    for csv_files in (["tests/data/simple_csv.csv"],
+                      ["tests/data/simple_csv_2.csv",
+                       "tests/data/simple_csv.csv"]):
+        creator = create_addml.AddmlCreator(testpath)
+        for csv_file in csv_files:
+            creator.add_addml_md(dict(attributes, csv_file=csv_file))
+        creator.write()
+
+    digest = generate_digest(create_addml.create_addml_metadata(
+        csv_file="tests/data/simple_csv.csv", **attributes))
+    root = ET.parse(os.path.join(testpath, '%s-ADDML-amd.xml' % digest))
+    flat_files = root.findall(ADDML_NS + "flatFile")
+    assert [decode_path(elem.get('name')) for elem in flat_files] == \
+        ["tests/data/simple_csv.csv", "tests/data/simple_csv_2.csv"]
+
+
+def test_create_addml_sniff(testpath, run_cli):
+    """Test detecting the delimiters and quoting characters of CSV files
+    with different dialects in one run.
+    """
+    csv_dir = os.path.join(testpath, 'data')
+    os.makedirs(csv_dir)
+    for (name, content) in (('comma.csv', 'a,b,c\n1,2,3\n4,5,6\n'),
+                            ('semicolon.csv',
+                             "'a';'b;c'\n'1';'2;3'\n'4';'5;6'\n")):
+        with open(os.path.join(csv_dir, name), 'w') as out_file:
+            out_file.write(content)
+
+    run_cli(create_addml.main, [
+        '--delim', '|', '--charset', CHARSET, '--header', '--sniff',
+        '--sep', RECORDSEPARATOR, '--quot', QUOTINGCHAR,
+        '--workspace', testpath, '--base_path', testpath, 'data'])
+
+    dialects = {}
+    for name in os.listdir(testpath):
+        if name.endswith('-ADDML-amd.xml'):
+            root = ET.parse(os.path.join(testpath, name))
+            fields = [elem.get('name') for elem in
+                      root.find(ADDML_NS + 'fieldDefinitions')]
+            dialects[root.find(ADDML_NS + 'fieldSeparatingChar').text] = \
+                (root.find(ADDML_NS + 'quotingChar').text, fields)
+    assert dialects == {',': ('"', ['a', 'b', 'c']),
+                        ';': ("'", ['a', 'b;c'])}
+
+
+@pytest.mark.parametrize(('content', 'dialect'), [
+    ('a,b,c\n1,2,3\n4,5,6\n', {"delimiter": ",", "quoting_char": "'"}),
+    ('"a";"b;c"\n"1";"2;3"\n', {"delimiter": ";", "quoting_char": '"'}),
+    ('', {"delimiter": "|", "quoting_char": "'"})
+])
+def test_sniff_csv_dialect(content, dialect):
+    """Test that the given quoting character is kept unless the sample
+    has quoted fields, and that the given delimiter is used if it can not
+    be detected.
+    """
+    csv_file = io.StringIO(content)
+    assert create_addml.sniff_csv_dialect(csv_file, '|', "'") == dialect
+    assert csv_file.tell() == 0
+
+
+def test_read_csv_header_threads():
+    """Test that headers of CSV files with different delimiters can be
+    read concurrently in threads.
+    """
+    attributes = [
+        {"csv_file": "tests/data/simple_csv.csv", "delimiter": ",",
+         "charset": CHARSET, "isheader": True},
+        {"csv_file": CSV_FILE, "delimiter": DELIMITER,
+         "charset": CHARSET, "isheader": True}
+    ] * 200
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        headers = list(executor.map(create_addml.csv_header, attributes))
+    assert headers == [['1', '2', '3'], ['test', 'test', 'test']] * 200
@@ -4,7 +4,8 @@ import os
 import json
 
 import pytest
-from siptools.scripts import create_agent
+from siptools.scripts import create_agent, premis_event
+from siptools.utils import read_md_references
 
 
 @pytest.mark.parametrize(
@@ -52,11 +53,10 @@ def test_create_agent_ok(
         identifier_type = 'test'
 
     # Read output files
-    create_agent_file = os.path.join(testpath, 'test-file-AGENTS-amd.json')
+    create_agent_file = os.path.join(testpath, 'test-file-AGENTS-amd.jsonl')
     assert os.path.exists(create_agent_file)
 
-    with open(create_agent_file) as in_file:
-        agent_data = json.load(in_file)
+    agent_data = list(create_agent.read_agents(testpath, 'test-file'))
 
     assert len(agent_data) == ag_count
     for agent in agent_data:
@@ -72,3 +72,53 @@ def test_create_agent_ok(
         if ag_type == 'software':
             assert agent["agent_version"] == version
         assert agent["agent_note"] == 'Notes'
+
+
+def test_read_agents(testpath):
+    """Test that agents collected several times are read once, and that
+    the agents of older versions are read from the JSON file.
+    """
+    for _ in range(2):
+        create_agent.create_agent(
+            workspace=testpath, agent_name='test-agent',
+            agent_type='software', agent_version='1.0',
+            create_agent_file='test-file')
+    legacy_agent = {"identifier_type": "local", "identifier_value": "foo",
+                    "agent_name": "legacy-agent", "agent_type": "person"}
+    with open(os.path.join(testpath, 'test-file-AGENTS-amd.json'),
+              'w') as out_file:
+        json.dump([legacy_agent], out_file, indent=4)
+
+    agents = list(create_agent.read_agents(testpath, 'test-file'))
+    assert [agent["agent_name"] for agent in agents] == \
+        ['test-agent', 'legacy-agent']
+    assert agents[1] == legacy_agent
+
+
+def test_collect_agents_io(testpath, monkeypatch):
+    """Test that collecting an agent only appends to the agent file and
+    does not read the earlier agents. The event is created with all the
+    agents.
+    """
+    opened = []
+
+    def _open(path, mode='r', **kwargs):
+        opened.append(mode)
+        return open(path, mode, **kwargs)
+
+    monkeypatch.setattr(create_agent, 'open', _open, raising=False)
+    for i in range(1000):
+        create_agent.create_agent(
+            workspace=testpath, agent_name='test-agent%i' % i,
+            agent_type='software', agent_version='1.0',
+            create_agent_file='test-file')
+    assert opened == ['a'] * 1000
+    monkeypatch.delattr(create_agent, 'open')
+
+    premis_event.premis_event(
+        event_type='creation', event_datetime='2016-10-13T12:30:55',
+        event_detail='Testing', event_outcome='success',
+        event_outcome_detail='Outcome detail', workspace=testpath,
+        create_agent_file='test-file')
+    refs = read_md_references(testpath, 'premis-event-md-references.jsonl')
+    assert len(refs['.']['md_ids']) == 1001
@@ -188,6 +188,52 @@ def test_existing_scraper_result(testpath):
     assert audiomd.xpath(path, namespaces=NAMESPACES)[0].text == 'PT50S'
 
 
+def test_create_audiomd_same_metadata(testpath, monkeypatch):
+    """Test that the AudioMD metadata of streams with identical metadata
+    is created and written only once, and all the streams are referenced.
+    """
+    def _stream(index, duration):
+        return {
+            'audio_data_encoding': 'PCM', 'bits_per_sample': '8',
+            'codec_creator_app': None, 'codec_creator_app_version': None,
+            'codec_name': 'PCM', 'codec_quality': 'lossless',
+            'data_rate': '705.6', 'data_rate_mode': 'Fixed',
+            'duration': duration, 'index': index,
+            'mimetype': 'audio/x-wav', 'num_channels': '2',
+            'sampling_frequency': '44.1', 'stream_type': 'audio',
+            'version': ''}
+
+    elements = []
+    audiomd_element = create_audiomd._audiomd_element
+
+    def _audiomd_element(key):
+        elements.append(key)
+        return audiomd_element(key)
+
+    monkeypatch.setattr(create_audiomd, '_audiomd_element', _audiomd_element)
+    creator = create_audiomd.AudiomdCreator(testpath)
+    for index in range(10):
+        creator.add_audiomd_md('audio%d.wav' % index,
+                               streams={0: _stream(0, 'PT1S')})
+    creator.add_audiomd_md('container.mkv', streams={
+        0: {'stream_type': 'videocontainer', 'index': 0},
+        1: _stream(1, 'PT1S'), 2: _stream(2, 'PT2S')})
+    creator.write()
+
+    assert len(elements) == 2
+    amd_files = [name for name in os.listdir(testpath)
+                 if name.endswith('-AudioMD-amd.xml')]
+    assert len(amd_files) == 2
+
+    refs = read_md_references(testpath, 'create-audiomd-md-references.jsonl')
+    assert len(refs) == 11
+    assert refs['audio0.wav']['md_ids'] == refs['audio9.wav']['md_ids']
+    assert refs['container.mkv']['streams']['1'] == \
+        refs['audio0.wav']['md_ids']
+    assert refs['container.mkv']['streams']['2'] != \
+        refs['audio0.wav']['md_ids']
+
+
 @pytest.mark.parametrize("file_, base_path", [
     ('tests/data/audio/valid__wav.wav', ''),
     ('./tests/data/audio/valid__wav.wav', ''),
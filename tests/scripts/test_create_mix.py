@@ -7,6 +7,7 @@ import sys
 
 import pytest
 
+from file_scraper.defaults import UNAV
 import siptools.scripts.create_mix as create_mix
 from siptools.utils import read_md_references
 
@@ -204,3 +205,165 @@ def test_paths(testpath, file_, base_path, run_cli):
     assert refs[os.path.normpath(file_)]
 
     assert os.path.isfile(os.path.normpath(os.path.join(base_path, file_)))
+
+
+TEXT_STREAMS = {0: {'mimetype': 'text/plain', 'index': 0,
+                    'stream_type': 'text', 'version': '(:unap)'}}
+
+
+def _image_streams(width):
+    """Return scraper stream metadata of a TIFF image."""
+    return {0: {
+        'bps_unit': 'integer', 'bps_value': '8', 'colorspace': 'srgb',
+        'compression': 'lzw', 'height': '400', 'icc_profile_name': 'sRGB',
+        'mimetype': 'image/tiff', 'samples_per_pixel': '3',
+        'stream_type': 'image', 'version': '6.0', 'width': width,
+        'byte_order': 'little endian', 'index': 0}}
+
+
+@pytest.mark.parametrize("args", [
+    ['--imported'],
+    ['data'],
+    ['data/*.tif', 'data/text.txt']
+])
+@pytest.mark.parametrize("jobs", ['1', '2'])
+def test_create_mix_batch(testpath, run_cli, monkeypatch,
+                          write_references_spy, args, jobs):
+    """Test creating MIX metadata for many files in one run from the
+    stream metadata of import_object, without scraping the files and
+    with one write of the references. Files that are not images are
+    skipped and reported.
+    """
+    _import_streams(testpath, {
+        'data/a.tif': _image_streams('1234'),
+        'data/b.tif': _image_streams('1234'),
+        'data/c.tif': _image_streams('99'),
+        'data/text.txt': TEXT_STREAMS
+    })
+
+    def _scrape_file(*args, **kwargs):
+        raise AssertionError('File scraped')
+
+    monkeypatch.setattr(create_mix, 'scrape_file', _scrape_file)
+    calls = write_references_spy(create_mix.MixCreator)
+
+    result = run_cli(create_mix.main, [
+        '--workspace', testpath, '--base_path', testpath,
+        '--jobs', jobs] + args)
+
+    assert calls == ['create-mix-md-references.jsonl']
+    assert 'This is not an image file. No MIX metadata created: ' \
+        'data/text.txt' in result.output
+    refs = read_md_references(testpath, 'create-mix-md-references.jsonl')
+    assert sorted(refs) == ['data/a.tif', 'data/b.tif', 'data/c.tif']
+    assert refs['data/a.tif']['md_ids'] == refs['data/b.tif']['md_ids']
+    assert refs['data/a.tif']['md_ids'] != refs['data/c.tif']['md_ids']
+
+
+def test_create_mix_batch_errors(testpath, run_cli):
+    """Test that the files whose MIX metadata can not be created are
+    reported by name, and no metadata is written.
+    """
+    no_byte_order = _image_streams('1234')
+    del no_byte_order[0]['byte_order']
+    no_width = _image_streams(None)
+    _import_streams(testpath, {
+        'data/a.tif': _image_streams('1234'),
+        'data/b.tif': no_byte_order,
+        'data/c.tif': no_width
+    })
+
+    result = run_cli(create_mix.main, [
+        '--workspace', testpath, '--base_path', testpath, '--imported'],
+        success=False)
+    message = str(result.exception)
+    assert 'could not be created for 2 file(s)' in message
+    assert 'Byte order missing from TIFF image file %s' % os.path.join(
+        testpath, 'data/b.tif') in message
+    assert 'Missing metadata value for key width for file %s' % (
+        os.path.join(testpath, 'data/c.tif')) in message
+    assert message.count('data/b.tif') == 1
+    assert message.count('data/c.tif') == 1
+    assert 'data/a.tif' not in message
+    assert not os.path.exists(
+        os.path.join(testpath, 'create-mix-md-references.jsonl'))
+
+
+def _import_streams(testpath, streams):
+    """Write the stream metadata of files as if they were imported with
+    import_object.
+    """
+    os.makedirs(os.path.join(testpath, 'data'))
+    with open(os.path.join(testpath, 'import-object-md-references.jsonl'),
+              'w') as out:
+        for (index, (filerel, file_streams)) in enumerate(streams.items()):
+            shutil.copy('tests/data/images/tiff1.tif',
+                        os.path.join(testpath, filerel))
+            amdid = 'amd%d' % index
+            out.write(json.dumps({filerel: {
+                'path_type': 'file', 'streams': {},
+                'md_ids': ['_' + amdid]}}) + '\n')
+            with open(os.path.join(testpath, '%s-scraper.json' % amdid),
+                      'w') as outfile:
+                json.dump(file_streams, outfile)
+
+
+def test_create_mix_same_metadata(testpath, monkeypatch):
+    """Test that the MIX metadata of images with identical metadata is
+    created and written only once, and all the images are referenced.
+    """
+    elements = []
+    mix_element = create_mix._mix_element
+
+    def _mix_element(key):
+        elements.append(key)
+        return mix_element(key)
+
+    monkeypatch.setattr(create_mix, '_mix_element', _mix_element)
+    creator = create_mix.MixCreator(testpath)
+    for index in range(100):
+        creator.add_mix_md('page%d.tif' % index, streams=_image_streams(
+            '1234' if index % 10 else '99'))
+    creator.write()
+
+    assert len(elements) == 2
+    files = os.listdir(testpath)
+    assert len([x for x in files if x.endswith('NISOIMG-amd.xml')]) == 2
+
+    refs = read_md_references(testpath, 'create-mix-md-references.jsonl')
+    assert len(refs) == 100
+    assert refs['page1.tif']['md_ids'] == refs['page99.tif']['md_ids']
+    assert refs['page0.tif']['md_ids'] == refs['page90.tif']['md_ids']
+    assert refs['page0.tif']['md_ids'] != refs['page1.tif']['md_ids']
+
+
+def test_mix_color_profile(monkeypatch):
+    """Test that a color profile is created for an ICC profile name None,
+    but not for an unavailable one, also when images with both are
+    grouped by their metadata keys.
+    """
+    icc_names = []
+    color_profile = create_mix.nisomix.color_profile
+
+    def _color_profile(**kwargs):
+        icc_names.append(kwargs['icc_name'])
+        return color_profile(**kwargs)
+
+    monkeypatch.setattr(create_mix.nisomix, 'color_profile', _color_profile)
+    keys = []
+    for icc_name in (None, UNAV, 'sRGB'):
+        stream_md = _image_streams('1234')[0]
+        stream_md['icc_profile_name'] = icc_name
+        keys.append(create_mix._mix_key(stream_md, 'image.tif'))
+    assert len(set(keys)) == 3
+
+    for key in keys:
+        create_mix._mix_element(key)
+    assert icc_names == [None, 'sRGB']
+
+
+def test_create_mix_no_files(run_cli, testpath):
+    """Test that either FILENAMES or --imported must be given."""
+    result = run_cli(create_mix.main, ['--workspace', testpath],
+                     success=False)
+    assert 'Give FILENAMES or --imported' in result.output
@@ -242,6 +242,47 @@ def test_existing_scraper_result(testpath):
     assert videomd.xpath(path, namespaces=NAMESPACES)[0].text == 'PT50S'
 
 
+def test_create_videomd_same_metadata(testpath, monkeypatch):
+    """Test that the VideoMD metadata of files with identical metadata
+    is created and written only once, and all the files are referenced.
+    """
+    def _streams(width):
+        return {0: {
+            'mimetype': 'video/mpeg', 'index': 0, 'par': '1',
+            'frame_rate': '30', 'data_rate': '0.171304',
+            'bits_per_sample': '8', 'data_rate_mode': 'Variable',
+            'color': 'Color', 'codec_quality': 'lossy',
+            'signal_format': '(:unap)', 'dar': '1.778', 'height': '180',
+            'sound': 'No', 'version': '1', 'codec_name': 'MPEG Video',
+            'codec_creator_app_version': '(:unav)', 'duration': 'PT50S',
+            'sampling': '4:2:0', 'stream_type': 'video', 'width': width,
+            'codec_creator_app': '(:unav)'}}
+
+    elements = []
+    videomd_element = create_videomd._videomd_element
+
+    def _videomd_element(key):
+        elements.append(key)
+        return videomd_element(key)
+
+    monkeypatch.setattr(create_videomd, '_videomd_element', _videomd_element)
+    creator = create_videomd.VideomdCreator(testpath)
+    for index in range(10):
+        creator.add_videomd_md('video%d.m1v' % index,
+                               streams=_streams('320' if index else '640'))
+    creator.write()
+
+    assert len(elements) == 2
+    amd_files = [name for name in os.listdir(testpath)
+                 if name.endswith('-VideoMD-amd.xml')]
+    assert len(amd_files) == 2
+
+    refs = read_md_references(testpath, 'create-videomd-md-references.jsonl')
+    assert len(refs) == 10
+    assert refs['video1.m1v']['md_ids'] == refs['video9.m1v']['md_ids']
+    assert refs['video0.m1v']['md_ids'] != refs['video1.m1v']['md_ids']
+
+
 @pytest.mark.parametrize("file_, base_path", [
     ('tests/data/video/valid_1.m1v', ''),
     ('./tests/data/video/valid_1.m1v', ''),
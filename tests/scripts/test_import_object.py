@@ -1,7 +1,12 @@
 """Unit tests for ``siptools.scripts.import_object`` module."""
 
 import datetime
+import hashlib
 import os.path
+import stat
+import tarfile
+import tempfile
+import zipfile
 
 import pytest
 
@@ -177,6 +182,101 @@ def test_import_object_multiple(testpath, run_cli):
     assert count == expected_files
 
 
+@pytest.mark.parametrize('archive_name', ['data.tar.gz', 'data.zip'])
+def test_import_object_archive(testpath, run_cli, monkeypatch,
+                               archive_name):
+    """Test importing files from a tar and a zip archive.
+
+    Only the selected files of the archive are imported, with paths in
+    the archive as their paths, and the checksum of the archived data
+    as their fixity. No temporary files are left behind.
+    """
+    archive = os.path.join(testpath, archive_name)
+    if archive_name.endswith('.zip'):
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for path in iterate_files('tests/data/structured'):
+                zip_file.write(path, os.path.relpath(path, 'tests/data'))
+    else:
+        with tarfile.open(archive, 'w:gz') as tar:
+            tar.add('tests/data/structured', arcname='structured')
+
+    spill_dir = os.path.join(testpath, 'tmp')
+    os.mkdir(spill_dir)
+    monkeypatch.setattr(tempfile, 'tempdir', spill_dir)
+
+    arguments = ['--workspace', testpath, '--skip_wellformed_check',
+                 '--archive', archive,
+                 'structured/Software files',
+                 'structured/Documentation files/readme.txt']
+    run_cli(import_object.main, arguments)
+    assert not os.listdir(spill_dir)
+
+    refs = read_md_references(testpath, 'import-object-md-references.jsonl')
+    assert sorted(refs) == ['structured/Documentation files/readme.txt',
+                            'structured/Software files/koodi.java']
+
+    for path in refs:
+        with open(os.path.join('tests/data', path), 'rb') as infile:
+            checksum = hashlib.md5(infile.read()).hexdigest()
+        root = ET.parse(get_amd_file(testpath, path)[0]).getroot()
+        assert root.xpath('//premis:messageDigest/text()',
+                          namespaces=NAMESPACES) == [checksum]
+        assert root.xpath('//premis:formatName/text()',
+                          namespaces=NAMESPACES)[0].startswith('text/')
+
+
+def test_import_object_archive_no_files(testpath, run_cli):
+    """Test that a selection matching no regular files of the archive is
+    a usage error, and that symbolic links in a zip archive are skipped.
+    """
+    archive = os.path.join(testpath, 'data.zip')
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        link = zipfile.ZipInfo('structured/link')
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        zip_file.writestr(link, '/etc/passwd')
+
+    for selection in (['structured/link'], ['structured/missing']):
+        result = run_cli(import_object.main, [
+            '--workspace', testpath, '--archive', archive] + selection,
+                         success=False)
+        assert result.exit_code == 2
+        assert 'No files to import in archive' in result.output
+    assert not os.path.exists(
+        os.path.join(testpath, 'import-object-md-references.jsonl'))
+
+
+def test_import_object_archive_errors(testpath, monkeypatch):
+    """Test that the errors of extracting and scraping a file are
+    reported with the file path in the archive instead of the temporary
+    file.
+    """
+    archive = os.path.join(testpath, 'data.zip')
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('data/file.txt', 'abc' * 100)
+
+    def _scrape_file(filepath, **kwargs):
+        raise ValueError('The format of file %s is unacceptable.' % filepath)
+
+    monkeypatch.setattr(import_object, 'scrape_file', _scrape_file)
+    with pytest.raises(ValueError) as error:
+        import_object.import_object(workspace=testpath, archive=archive,
+                                    filepaths=())
+    assert str(error.value) == (
+        'Failed to import data/file.txt from archive %s: The format of '
+        'file data/file.txt is unacceptable.' % archive)
+
+    # Corrupt the compressed data so that the CRC check fails
+    with open(archive, 'rb') as infile:
+        data = infile.read()
+    with open(archive, 'wb') as outfile:
+        outfile.write(data.replace(b'abc' * 100, b'abd' * 100))
+    with pytest.raises(ValueError) as error:
+        import_object.import_object(workspace=testpath, archive=archive,
+                                    filepaths=())
+    assert 'Failed to extract data/file.txt from archive' in \
+        str(error.value)
+
+
 def test_import_object_order(testpath, run_cli):
     """Test file order."""
     input_file = 'tests/data/structured/Documentation files/readme.txt'
@@ -861,3 +961,28 @@ def test_import_object_not_recognized(testpath, run_cli):
         = 'Proper scraper was not found. The file was not analyzed'
     with pytest.raises(ValueError, match=expected_error_message):
         run_cli(import_object.main, arguments)
+
+
+def test_create_events_catalog(testpath):
+    """Test that existing equivalent events are found in the event
+    catalog, also when the catalog is rebuilt for a workspace without
+    one.
+    """
+    def _event_files():
+        return [name for name in os.listdir(testpath)
+                if name.endswith('-PREMIS%3AEVENT-amd.xml')]
+
+    import_object._create_events(testpath, '.', '2020', '.',
+                                 checksum_event=True, agents=[])
+    event_files = _event_files()
+    assert len(event_files) == 2
+
+    import_object._create_events(testpath, '.', '2020', '.',
+                                 checksum_event=True, agents=[])
+    os.remove(os.path.join(testpath, 'premis-event-catalog.jsonl'))
+    import_object._create_events(testpath, '.', '2020', '.',
+                                 checksum_event=True, agents=[])
+    assert sorted(_event_files()) == sorted(event_files)
+
+    refs = read_md_references(testpath, 'premis-event-md-references.jsonl')
+    assert len(refs['.']['md_ids']) == 3
@@ -1,5 +1,6 @@
 """Tests for :mod:`siptools.scripts.premis_event` module"""
 
+import json
 import os
 import lxml.etree as ET
 
@@ -447,3 +448,225 @@ def test_paths(testpath, file_, base_path, run_cli):
                                        'premis-event-md-references.jsonl')
     assert os.path.normpath(file_) in md_references
     assert os.path.isfile(os.path.normpath(os.path.join(base_path, file_)))
+
+
+def test_agent_index(testpath, run_cli):
+    """Test that the agent index is updated when agents are written and
+    that it is rebuilt from the agent files when it is missing.
+    """
+    for i in range(1, 3):
+        run_cli(premis_event.main, [
+            'creation',
+            '2016-10-13T12:30:55',
+            '--event_detail', 'Testing: act %s' % i,
+            '--event_outcome', 'success',
+            '--event_outcome_detail', 'Outcome detail',
+            '--workspace', testpath,
+            '--agent_name', 'Demo Application',
+            '--agent_type', 'software'
+        ])
+
+    index_path = os.path.join(testpath, premis_event.AGENT_INDEX)
+    with open(index_path) as in_file:
+        assert len(in_file.readlines()) == 1
+
+    agents = premis_event.get_premis_agent_identifiers(testpath)
+    assert list(agents) == [('software', 'Demo Application')]
+    assert agents[('software', 'Demo Application')][0] == 'UUID'
+
+    os.remove(index_path)
+    assert premis_event.get_premis_agent_identifiers(testpath) == agents
+    assert os.path.isfile(index_path)
+
+
+def test_agent_index_trusted(testpath, run_cli, monkeypatch):
+    """Test that an existing agent index is used without reading the
+    agent files, and that rebuilding it leaves no temporary files.
+    """
+    run_cli(premis_event.main, [
+        'creation', '2016-10-13T12:30:55',
+        '--event_detail', 'Testing',
+        '--event_outcome', 'success',
+        '--event_outcome_detail', 'Outcome detail',
+        '--workspace', testpath,
+        '--agent_name', 'Demo Application',
+        '--agent_type', 'software'
+    ])
+    index_path = os.path.join(testpath, premis_event.AGENT_INDEX)
+    with open(index_path, 'w'):
+        pass
+
+    def _glob(*args, **kwargs):
+        raise AssertionError('Agent files listed')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(premis_event.glob, 'glob', _glob)
+        patch.setattr(premis_event.glob, 'iglob', _glob)
+        assert premis_event.get_premis_agent_identifiers(testpath) == {}
+
+    agents = premis_event.rebuild_agent_index(testpath)
+    assert list(agents) == [('software', 'Demo Application')]
+    assert premis_event.get_premis_agent_identifiers(testpath) == agents
+    assert not [name for name in os.listdir(testpath)
+                if name.startswith('.')]
+
+
+def test_premis_events_from_jsonl(testpath, run_cli, write_references_spy):
+    """Test that the events of a JSON lines file are created with their
+    agents in one run, with one write of the metadata references.
+    """
+    events = [
+        {"event_type": "migration",
+         "event_datetime": "2016-10-13T12:30:55",
+         "event_detail": "Migration of %s" % name,
+         "event_outcome": "success",
+         "event_outcome_detail": "Migrated",
+         "event_target": "structured/%s" % name,
+         "agent_name": "Demo Application",
+         "agent_type": "software"}
+        for name in ("Software files/koodi.java",
+                     "Publication files/publication.txt")
+    ]
+    events.append({"event_type": "creation",
+                   "event_datetime": "2016-10-13T12:30:55",
+                   "event_detail": "Creation",
+                   "event_outcome": "success",
+                   "event_outcome_detail": "Created",
+                   "agent_name": "Other Application",
+                   "agent_type": "software",
+                   "agent_identifier": ["local", "other-1"]})
+    event_file = os.path.join(testpath, 'events.jsonl')
+    with open(event_file, 'w') as out_file:
+        for event in events:
+            out_file.write(json.dumps(event) + '\n')
+
+    calls = write_references_spy(premis_event.PremisCreator)
+
+    result = run_cli(premis_event.main, [
+        '--from_jsonl', event_file,
+        '--workspace', testpath,
+        '--base_path', 'tests/data'
+    ])
+    assert 'Created 3 PREMIS events' in result.output
+    assert calls == ['premis-event-md-references.jsonl']
+
+    agents = premis_event.get_premis_agent_identifiers(testpath)
+    assert agents[('software', 'Other Application')] == ('local', 'other-1')
+    assert len(agents) == 2
+
+    refs = read_md_references(testpath, 'premis-event-md-references.jsonl')
+    for name in ("Software files/koodi.java",
+                 "Publication files/publication.txt"):
+        # Event and the agent shared by the events
+        assert len(refs["structured/%s" % name]["md_ids"]) == 2
+    assert len(refs["."]["md_ids"]) == 2
+    assert len([name for name in os.listdir(testpath)
+                if name.endswith('AGENT-amd.xml')]) == 2
+
+
+@pytest.mark.parametrize(('event', 'message'), [
+    ({"event_type": "creation"}, "missing: event_datetime"),
+    ({"event_type": "creation", "event_datetime": "2016-10-13T12:30:55",
+      "event_detail": "Testing", "event_outcome": "nonsense",
+      "event_outcome_detail": "Detail"}, "Invalid event outcome on line 1")
+])
+def test_premis_events_from_jsonl_invalid(testpath, event, message):
+    """Test that invalid events in the JSON lines file are reported."""
+    event_file = os.path.join(testpath, 'events.jsonl')
+    with open(event_file, 'w') as out_file:
+        out_file.write(json.dumps(event) + '\n')
+
+    with pytest.raises(ValueError) as error:
+        premis_event.premis_events_from_jsonl(event_file, workspace=testpath)
+    assert message in str(error.value)
+
+
+def test_premis_event_missing_arguments(testpath, run_cli):
+    """Test that the event arguments are required without --from_jsonl."""
+    result = run_cli(premis_event.main, [
+        'creation', '2016-10-13T12:30:55',
+        '--event_outcome', 'success',
+        '--workspace', testpath
+    ], success=False)
+    assert 'event_detail, event_outcome_detail' in result.output
+
+
+def test_premis_event_single_reference_write(testpath, write_references_spy):
+    """Test that the agents and the event are written with one write of
+    the metadata references.
+    """
+    for i in range(3):
+        create_agent(workspace=testpath,
+                     agent_name='Scraper %d' % i,
+                     agent_version='1.0',
+                     agent_type='software',
+                     agent_role='executing program',
+                     create_agent_file='test-agents')
+
+    calls = write_references_spy(premis_event.PremisCreator)
+
+    premis_event.premis_event(
+        event_type='validation', event_datetime='2016-10-13T12:30:55',
+        event_detail='Testing', event_outcome='success',
+        event_outcome_detail='Outcome detail', workspace=testpath,
+        create_agent_file='test-agents')
+
+    assert calls == ['premis-event-md-references.jsonl']
+    refs = read_md_references(testpath, 'premis-event-md-references.jsonl')
+    assert len(refs['.']['md_ids']) == 4
+
+
+def test_event_catalog(testpath):
+    """Test that events without linking objects are added to the event
+    catalog, and that the catalog is rebuilt from the event files when it
+    is missing.
+    """
+    event = {"event_type": "creation",
+             "event_datetime": "2016-10-13T12:30:55",
+             "event_detail": "Testing",
+             "event_outcome": "success",
+             "event_outcome_detail": "Outcome detail"}
+    premis_event.premis_event(workspace=testpath, **event)
+    premis_event.premis_event(
+        workspace=testpath,
+        linked_object_ids=(("local", "object-1", "source"),),
+        add_object_links=True,
+        **dict(event, event_detail="Linked"))
+
+    catalog = premis_event.get_event_catalog(testpath)
+    assert set(catalog) == {premis_event.event_key(event)}
+
+    os.remove(os.path.join(testpath, premis_event.EVENT_CATALOG))
+    assert premis_event.get_event_catalog(testpath) == catalog
+
+
+def test_event_catalog_files(testpath):
+    """Test that an event is found from the event catalog only while its
+    event file exists, and that the event is cataloged again when it is
+    recreated. Events without outcome details are tested as well.
+    """
+    events = [{"event_type": "creation",
+               "event_datetime": "2016-10-13T12:30:55",
+               "event_detail": "Testing",
+               "event_outcome": "success",
+               "event_outcome_detail": detail}
+              for detail in ("Outcome detail", None)]
+    for event in events:
+        premis_event.premis_event(workspace=testpath, **event)
+    keys = [premis_event.event_key(event) for event in events]
+    catalog = premis_event.get_event_catalog(testpath)
+    assert set(catalog) == set(keys)
+    for key in keys:
+        assert premis_event.event_in_catalog(testpath, catalog, key)
+
+    os.remove(os.path.join(testpath, catalog[keys[0]]))
+    catalog = premis_event.get_event_catalog(testpath)
+    assert set(catalog) == set(keys)
+    assert not premis_event.event_in_catalog(testpath, catalog, keys[0])
+    assert premis_event.event_in_catalog(testpath, catalog, keys[1])
+
+    premis_event.premis_event(workspace=testpath, **events[0])
+    catalog = premis_event.get_event_catalog(testpath)
+    assert premis_event.event_in_catalog(testpath, catalog, keys[0])
+    with open(os.path.join(testpath, premis_event.EVENT_CATALOG)) as in_file:
+        assert len(in_file.readlines()) == 3
@@ -0,0 +1,26 @@
+"""Tests for ``siptools.scripts.rebuild_agent_index`` module"""
+
+import os
+
+from siptools.scripts import premis_event, rebuild_agent_index
+
+
+def test_rebuild_agent_index(testpath, run_cli):
+    """Test that the agent index is rebuilt from the agent files."""
+    premis_event.premis_event(
+        event_type='creation', event_datetime='2016-10-13T12:30:55',
+        event_detail='Testing', event_outcome='success',
+        event_outcome_detail='Outcome detail', workspace=testpath,
+        agent_name='Demo Application', agent_type='software',
+        agent_identifier=('local', 'demo-1'))
+
+    index_path = os.path.join(testpath, premis_event.AGENT_INDEX)
+    with open(index_path, 'w') as out_file:
+        out_file.write('')
+
+    result = run_cli(rebuild_agent_index.main, ['--workspace', testpath])
+    assert 'Indexed 1 PREMIS agents' in result.output
+
+    assert premis_event.get_premis_agent_identifiers(testpath) == {
+        ('software', 'Demo Application'): ('local', 'demo-1')
+    }
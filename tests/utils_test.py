@@ -1,5 +1,6 @@
 """Tests for the utility functions."""
 
+import os
 import pytest
 import lxml.etree
 from file_scraper.scraper import Scraper
@@ -35,6 +36,51 @@ def test_decode_path():
     assert decoded_path == 't\u00e4sts/t\u00f8stpath'
 
 
+def test_file_identifier():
+    """Test that deterministic file identifiers depend only on the path
+    and objid, and that the default identifiers are random.
+    """
+    path = 'tests/data/structured/Software files/koodi.java'
+    assert utils.file_identifier(path) != utils.file_identifier(path)
+
+    fileid = utils.file_identifier(path, deterministic_ids=True)
+    assert fileid.startswith('_')
+    assert fileid == utils.file_identifier(path, deterministic_ids=True)
+    assert fileid != utils.file_identifier(
+        'tests/data/structured/Publication files/publication.txt',
+        deterministic_ids=True)
+
+    objid_fileid = utils.file_identifier(path, deterministic_ids=True,
+                                         objid='objid-1')
+    assert objid_fileid != fileid
+    assert objid_fileid == utils.file_identifier(
+        path, deterministic_ids=True, objid='objid-1')
+    assert objid_fileid != utils.file_identifier(
+        path, deterministic_ids=True, objid='objid-2')
+
+
+@pytest.mark.parametrize('copy_mode', utils.COPY_MODES)
+@pytest.mark.parametrize('size', [10, utils.COPY_FILE_RANGE_MIN_SIZE + 10])
+def test_copy_file(tmpdir, copy_mode, size):
+    """Test that copy_file() copies the file in all copy modes, replaces
+    an existing target and leaves the source alone if it is the target.
+    """
+    source = tmpdir.join('source')
+    source.write_binary(os.urandom(size))
+    target = tmpdir.join('target')
+    target.write('old content')
+
+    utils.copy_file(str(source), str(target), copy_mode)
+    assert target.read_binary() == source.read_binary()
+    assert target.islink() == (copy_mode == 'symlink')
+
+    utils.copy_file(str(source), str(source), copy_mode)
+    assert source.read_binary() == target.read_binary()
+
+    with pytest.raises(ValueError):
+        utils.copy_file(str(source), str(target), 'move')
+
+
 def test_copy_etree():
     """Test that copy_etree creates a new lxml.etree
     instance with identical data.
@@ -126,3 +172,25 @@ def test_filescraper_error(monkeypatch):
 
     assert "ValueError" in error.typename
     assert message in str(error.value)
+
+
+def test_read_fixity(tmpdir):
+    """Test that read_fixity reads the fixity from the PREMIS object of
+    the given references without reading the reference file.
+    """
+    premis_ns = 'info:lc/xmlns/premis-v2'
+    with open(os.path.join(str(tmpdir), 'abc-PREMIS%3AOBJECT-amd.xml'),
+              'w') as outfile:
+        outfile.write(
+            '<object xmlns="%s"><objectCharacteristics><fixity>'
+            '<messageDigestAlgorithm>MD5</messageDigestAlgorithm>'
+            '<messageDigest>1234</messageDigest>'
+            '</fixity></objectCharacteristics></object>' % premis_ns)
+    object_refs = {'data/file.txt': {'path_type': 'file', 'streams': {},
+                                     'md_ids': ['_missing', '_abc']}}
+
+    assert utils.read_fixity('data/file.txt', str(tmpdir),
+                             object_refs) == ('MD5', '1234')
+    assert utils.read_fixity('data/other.txt', str(tmpdir),
+                             object_refs) is None
+    assert utils.read_fixity('data/file.txt', str(tmpdir)) is None